@@ -20,16 +20,32 @@
  *                                                                         *
  ***************************************************************************/
 """
-from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication, Qt, QDate
+from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication
 from qgis.PyQt.QtGui import QIcon
-from qgis.PyQt.QtWidgets import QAction, QMessageBox, QVBoxLayout, QLabel, QDialog, QComboBox, QLineEdit, QPushButton, QDateEdit, QFileDialog
-from qgis.core import QgsProject, QgsVectorLayer
-from qgis.utils import iface
+from qgis.PyQt.QtWidgets import QAction, QActionGroup, QMenu, QMessageBox, QDialog, QFileDialog, QInputDialog
+from qgis.core import QgsApplication, QgsProject, QgsVectorLayer
 import os.path
-import pandas as pd
 
 # Initialize Qt resources from file resources.py
 from .resources import *
+from .field_index import FieldIndex
+from .filter_engine import FilterEngine
+from .value_table import ValueListStore
+from .attribute_index import AttributeIndexManager
+from .value_catalog import ValueCatalog, UNCATALOGUED_CRITERIA
+from .fid_index import FidIndex, fid_subset_string
+from .session import FilterSession
+from .plans import single_filter_plan, multi_filter_plan, composite_plan
+from .query_planner import SelectivityPlanner
+from .cascade import Cascade
+from .spatial_filter import SpatialFilter
+from .layer_scope import LayerScope, SCOPES, SCOPE_LAYER_SET
+from .export import ExportTask, export_job, filtered_layers, report
+from .result_cache import ResultCache
+from .profiler import profile_details_enabled, profile_log_path, set_profile_details_enabled, set_profile_log_path
+from .live_filter import LiveFilter
+from .match_preview import input_key
+from .sql_dialect import native_sql_enabled, set_native_sql_enabled
 
 class AutoFilter:
 
@@ -42,6 +58,39 @@ class AutoFilter:
     def __init__(self, iface):
         self.iface = iface
         self.tool = None
+        # Dialogs are built on first use and reused afterwards
+        self.single_filter_dialog = None
+        self.multi_filter_dialog = None
+        self.composite_filter_dialog = None
+        self.export_dialog = None
+        # Running export, referenced so it is not garbage collected
+        self.export_task = None
+        # Criterion -> matching fields per layer, built on first filter
+        self.field_index = FieldIndex(QgsProject.instance())
+        # Feature ids kept by filters applied before, reused when they come back
+        self.result_cache = ResultCache(QgsProject.instance())
+        # Provider-side storage for long Multi-Filter value lists
+        self.value_store = ValueListStore()
+        # Validates filters off the GUI thread and applies them in one batch
+        self.filter_engine = FilterEngine(QgsProject.instance(), iface.mapCanvas(), self.result_cache, self.value_store)
+        # Attribute indexes on the criteria fields
+        self.index_manager = AttributeIndexManager(self.field_index)
+        # Distinct values per criterion for typeahead and validation
+        self.value_catalog = ValueCatalog(self.field_index)
+        # Optional value -> feature ids index per layer
+        self.fid_index = FidIndex(self.field_index)
+        # Original filters of touched layers and undo/redo snapshots
+        self.session = FilterSession(QgsProject.instance(), self.filter_engine.subset_string)
+        # Filters applied while typing and deferred filters of hidden layers
+        self.live_filter = LiveFilter(self.filter_engine, self.session, QgsProject.instance(), iface.mapCanvas())
+        # Orders the criteria of composite filters by estimated selectivity
+        self.planner = SelectivityPlanner(self.value_catalog, self.index_manager)
+        # Carries filters over to layers linked by relations or key fields
+        self.cascade = Cascade(self.field_index, QgsProject.instance())
+        # Filters layers without criteria fields by location
+        self.spatial_filter = SpatialFilter(self.field_index, QgsProject.instance())
+        # Layers a filter or clear may change, from cached layer-tree lookups
+        self.scope = LayerScope(QgsProject.instance(), self.current_group)
 
     def initGui(self):
         """Create the menu entries and toolbar icons inside the QGIS GUI."""
@@ -52,24 +101,181 @@ class AutoFilter:
         # Create action for multi-filter options
         self.multi_filter_action = QAction(QIcon(os.path.join(os.path.dirname(__file__), 'MultiFilter')), 'Multi-Filter', self.iface.mainWindow())
         self.multi_filter_action.triggered.connect(self.multiFilter)
+
+        # Create action for combining several criteria
+        self.composite_filter_action = QAction('Composite Filter', self.iface.mainWindow())
+        self.composite_filter_action.triggered.connect(self.compositeFilter)
         
         # Create action for clearing filters
         self.clear_action = QAction(QIcon(os.path.join(os.path.dirname(__file__), 'mActionDelete.png')), 'Clear Filters', self.iface.mainWindow())
         self.clear_action.triggered.connect(self.clearFilters)
 
+        # Create action for exporting the filtered layers
+        self.export_action = QAction(QgsApplication.getThemeIcon('/mActionFileSave.svg'), 'Export Filtered Layers', self.iface.mainWindow())
+        self.export_action.triggered.connect(self.exportFilteredLayers)
+
+        # Create actions for moving through the filter history
+        self.undo_action = QAction('Undo Filter', self.iface.mainWindow())
+        self.undo_action.triggered.connect(self.undoFilter)
+        self.redo_action = QAction('Redo Filter', self.iface.mainWindow())
+        self.redo_action.triggered.connect(self.redoFilter)
+        self.update_history_actions()
+
+        # Create a checkable action for the background execution mode
+        self.background_action = QAction('Run Filters in Background', self.iface.mainWindow())
+        self.background_action.setCheckable(True)
+        self.background_action.setChecked(self.filter_engine.background)
+        self.background_action.toggled.connect(self.toggleBackground)
+
+        # Create actions for attribute indexes on the filter fields
+        self.create_indexes_action = QAction('Create Missing Attribute Indexes', self.iface.mainWindow())
+        self.create_indexes_action.triggered.connect(self.createIndexes)
+        self.auto_index_action = QAction('Index Filter Fields on First Use', self.iface.mainWindow())
+        self.auto_index_action.setCheckable(True)
+        self.auto_index_action.setChecked(self.index_manager.auto_index)
+        self.auto_index_action.toggled.connect(self.toggleAutoIndex)
+
+        # Create a checkable action for the feature-ID index
+        self.fid_index_action = QAction('Use Feature-ID Index', self.iface.mainWindow())
+        self.fid_index_action.setCheckable(True)
+        self.fid_index_action.setChecked(self.fid_index.enabled)
+        self.fid_index_action.toggled.connect(self.toggleFidIndex)
+
+        # Create a menu of exclusive actions for the filter scope
+        self.scope_menu = QMenu('Filter Scope', self.iface.mainWindow())
+        self.scope_group = QActionGroup(self.scope_menu)
+        self.scope_actions = {}
+        for scope, label in SCOPES.items():
+            action = QAction(label, self.scope_menu)
+            action.setCheckable(True)
+            action.setChecked(scope == self.scope.scope)
+            action.triggered.connect(lambda checked, scope=scope: self.setScope(scope))
+            self.scope_group.addAction(action)
+            self.scope_menu.addAction(action)
+            self.scope_actions[scope] = action
+
+        # Create a checkable action for cascading filters to linked layers
+        self.cascade_action = QAction('Cascade Filters to Linked Layers', self.iface.mainWindow())
+        self.cascade_action.setCheckable(True)
+        self.cascade_action.setChecked(self.cascade.enabled)
+        self.cascade_action.toggled.connect(self.toggleCascade)
+
+        # Create a checkable action for filtering layers without IDs by location
+        self.spatial_filter_action = QAction('Filter Layers Without IDs by Location', self.iface.mainWindow())
+        self.spatial_filter_action.setCheckable(True)
+        self.spatial_filter_action.setChecked(self.spatial_filter.enabled)
+        self.spatial_filter_action.toggled.connect(self.toggleSpatialFilter)
+
+        # Create a checkable action for the filter result cache
+        self.result_cache_action = QAction('Cache Filter Results', self.iface.mainWindow())
+        self.result_cache_action.setCheckable(True)
+        self.result_cache_action.setChecked(self.result_cache.enabled)
+        self.result_cache_action.toggled.connect(self.toggleResultCache)
+
+        # Create a checkable action for provider-native SQL subset strings
+        self.native_sql_action = QAction('Use Provider-Native SQL', self.iface.mainWindow())
+        self.native_sql_action.setCheckable(True)
+        self.native_sql_action.setChecked(native_sql_enabled())
+        self.native_sql_action.toggled.connect(self.toggleNativeSql)
+
+        # Create checkable actions for the per-layer profiler and its log file
+        self.profile_action = QAction('Profile Filter Operations', self.iface.mainWindow())
+        self.profile_action.setCheckable(True)
+        self.profile_action.setChecked(self.filter_engine.profiling)
+        self.profile_action.toggled.connect(self.toggleProfiling)
+        self.profile_details_action = QAction('Profile Extent and Feature Count (Extra Queries)', self.iface.mainWindow())
+        self.profile_details_action.setCheckable(True)
+        self.profile_details_action.setChecked(profile_details_enabled())
+        self.profile_details_action.toggled.connect(self.toggleProfileDetails)
+        self.profile_log_action = QAction('Write Filter Profile to File...', self.iface.mainWindow())
+        self.profile_log_action.setCheckable(True)
+        self.profile_log_action.setChecked(bool(profile_log_path()))
+        self.profile_log_action.toggled.connect(self.toggleProfileLog)
+
         # Add toolbar buttons and menu items
         self.iface.addToolBarIcon(self.action)
         self.iface.addToolBarIcon(self.multi_filter_action)  # Add the multi-filter icon to the toolbar
         self.iface.addToolBarIcon(self.clear_action)
+        self.iface.addToolBarIcon(self.export_action)
         self.iface.addPluginToMenu('&AutoFilter', self.action)
         self.iface.addPluginToMenu('&AutoFilter', self.multi_filter_action)  # Add the multi-filter option to the menu
+        self.iface.addPluginToMenu('&AutoFilter', self.composite_filter_action)
         self.iface.addPluginToMenu('&AutoFilter', self.clear_action)
+        self.iface.addPluginToMenu('&AutoFilter', self.export_action)
+        self.iface.addPluginToMenu('&AutoFilter', self.undo_action)
+        self.iface.addPluginToMenu('&AutoFilter', self.redo_action)
+        self.iface.addPluginToMenu('&AutoFilter', self.background_action)
+        self.iface.addPluginToMenu('&AutoFilter', self.create_indexes_action)
+        self.iface.addPluginToMenu('&AutoFilter', self.auto_index_action)
+        self.iface.addPluginToMenu('&AutoFilter', self.fid_index_action)
+        self.iface.addPluginToMenu('&AutoFilter', self.scope_menu.menuAction())
+        self.iface.addPluginToMenu('&AutoFilter', self.cascade_action)
+        self.iface.addPluginToMenu('&AutoFilter', self.spatial_filter_action)
+        self.iface.addPluginToMenu('&AutoFilter', self.result_cache_action)
+        self.iface.addPluginToMenu('&AutoFilter', self.native_sql_action)
+        self.iface.addPluginToMenu('&AutoFilter', self.profile_action)
+        self.iface.addPluginToMenu('&AutoFilter', self.profile_details_action)
+        self.iface.addPluginToMenu('&AutoFilter', self.profile_log_action)
+
+        # Drop the lookup lists of a project when it is closed
+        QgsProject.instance().aboutToBeCleared.connect(self.release_value_lists)
 
     def unload(self):
         # Remove the actions when the plugin is unloaded
         self.iface.removeToolBarIcon(self.action)
         self.iface.removeToolBarIcon(self.multi_filter_action)  # Remove the multi-filter icon from the toolbar
         self.iface.removeToolBarIcon(self.clear_action)
+        self.iface.removeToolBarIcon(self.export_action)
+        self.iface.removePluginMenu('&AutoFilter', self.export_action)
+        self.iface.removePluginMenu('&AutoFilter', self.composite_filter_action)
+        self.iface.removePluginMenu('&AutoFilter', self.undo_action)
+        self.iface.removePluginMenu('&AutoFilter', self.redo_action)
+        self.iface.removePluginMenu('&AutoFilter', self.background_action)
+        self.iface.removePluginMenu('&AutoFilter', self.create_indexes_action)
+        self.iface.removePluginMenu('&AutoFilter', self.auto_index_action)
+        self.iface.removePluginMenu('&AutoFilter', self.fid_index_action)
+        self.iface.removePluginMenu('&AutoFilter', self.scope_menu.menuAction())
+        self.iface.removePluginMenu('&AutoFilter', self.cascade_action)
+        self.iface.removePluginMenu('&AutoFilter', self.spatial_filter_action)
+        self.iface.removePluginMenu('&AutoFilter', self.result_cache_action)
+        self.iface.removePluginMenu('&AutoFilter', self.native_sql_action)
+        self.iface.removePluginMenu('&AutoFilter', self.profile_action)
+        self.iface.removePluginMenu('&AutoFilter', self.profile_details_action)
+        self.iface.removePluginMenu('&AutoFilter', self.profile_log_action)
+        QgsProject.instance().aboutToBeCleared.disconnect(self.release_value_lists)
+        # Cancel any filter or index still being prepared
+        self.filter_engine.cancel()
+        self.cascade.cancel()
+        self.spatial_filter.unload()
+        self.scope.unload()
+        if self.export_task is not None:
+            try:
+                self.export_task.cancel()
+            except RuntimeError:
+                # The task has already been deleted by the task manager
+                pass
+            self.export_task = None
+        self.live_filter.unload()
+        self.index_manager.unload()
+        self.value_catalog.unload()
+        self.planner.unload()
+        self.fid_index.unload()
+        self.result_cache.unload()
+        self.session.unload()
+        self.release_value_lists()
+        # Destroy the dialogs built during this session
+        for dialog in (self.single_filter_dialog, self.multi_filter_dialog, self.composite_filter_dialog):
+            if dialog is not None:
+                dialog.preview.unload()
+                dialog.deleteLater()
+        if self.export_dialog is not None:
+            self.export_dialog.deleteLater()
+        self.single_filter_dialog = None
+        self.multi_filter_dialog = None
+        self.composite_filter_dialog = None
+        self.export_dialog = None
+        # Stop tracking layer and schema changes
+        self.field_index.unload()
 
     def run(self):
         # Check if there are any layers in the project
@@ -78,164 +284,42 @@ class AutoFilter:
             QMessageBox.warning(None, 'Warning', 'The project is empty. Please add layers to the project before using this plugin.')
             return  # Exit the function
 
-        # Create a QDialog for user input
-        dialog = QDialog(self.iface.mainWindow())
-        dialog.setWindowTitle('Select Filter Criteria')
-
-        # Define filter criteria options
-        filter_criteria_options = ["Exchange", "Route", "Cabinet ID", "Data Provider", "Contractor", "Coordinator", "Rework", "Date", "Period Of Time"]
-
-        # Create a combo box for choosing filter criteria
-        combo_box = QComboBox(dialog)
-        combo_box.addItems(filter_criteria_options)
-        combo_box.setEditable(False)
-        combo_box.setCurrentIndex(0)
-
-        # Create a QLineEdit for entering the filter value
-        value_input = QLineEdit(dialog)
-        
-        # Create a QDateEdit widget for entering the date
-        date_input = QDateEdit(QDate.currentDate(), dialog)
-        date_input.setCalendarPopup(True)
-        date_input.setDateRange(QDate(1900, 1, 1), QDate.currentDate())
-        
-        # Create a QDateEdit widget for entering the start date
-        start_date_input = QDateEdit(QDate.currentDate(), dialog)
-        start_date_input.setCalendarPopup(True)
-        start_date_input.setDateRange(QDate(1900, 1, 1), QDate.currentDate())
-
-        # Create a QDateEdit widget for entering the end date
-        end_date_input = QDateEdit(QDate.currentDate(), dialog)
-        end_date_input.setCalendarPopup(True)
-        end_date_input.setDateRange(QDate(1900, 1, 1), QDate.currentDate())
-
-        # Create a function to update the visibility of input widgets based on combo_box selection
-        def update_input_widgets():
-            selected_criteria = combo_box.currentText()
-            if selected_criteria == "Date":
-                value_input.hide()
-                start_date_input.hide()
-                end_date_input.hide()
-                date_input.show()
-            elif selected_criteria == "Period Of Time":
-                value_input.hide()
-                start_date_input.show()
-                end_date_input.show()
-                date_input.hide()
-            else:
-                value_input.show()
-                start_date_input.hide()
-                end_date_input.hide()
-                date_input.hide()
-                value_input.setPlaceholderText(f'Enter {selected_criteria}')
-
-        # Connect the combo_box's currentIndexChanged signal to the update_input_widgets function
-        combo_box.currentIndexChanged.connect(update_input_widgets)
-
-        # Set the initial visibility based on the default selection
-        update_input_widgets()
-
-        # Add a label below the combo box
-        label = QLabel('Powered By © Hasan Sami', dialog)
-        label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-
-        # Create a QPushButton for confirming the filter
-        confirm_button = QPushButton('OK', dialog)
-        confirm_button.clicked.connect(dialog.accept)
-
-        # Create a layout for the dialog
-        layout = QVBoxLayout()
-        layout.addWidget(combo_box)
-        layout.addWidget(value_input)
-        layout.addWidget(end_date_input)
-        layout.addWidget(start_date_input)
-        layout.addWidget(date_input)        
-        layout.addWidget(confirm_button)
-        layout.addWidget(label)
-        
-        # Set the layout for the dialog
-        dialog.setLayout(layout)
+        # Build the dialog on first use and reuse it afterwards
+        if self.single_filter_dialog is None:
+            from .dialogs import SingleFilterDialog
+            self.single_filter_dialog = SingleFilterDialog(self, self.iface.mainWindow())
+        dialog = self.single_filter_dialog
+        dialog.prepare()
 
         # Show the dialog and get the selected filter criteria and value
-        if dialog.exec_() == QDialog.Accepted:
-            filter_criteria = combo_box.currentText()
-            if filter_criteria == "Date":
-                value_to_filter = date_input.date().toString("yyyy-MM-dd")
-                if "AND" in value_to_filter:
-                    QMessageBox.warning(None, 'Warning', 'Please enter a single date for the "Date" filter.')
-                    return  # Exit the function
-            elif filter_criteria == "Period Of Time":
-                start_date = start_date_input.date().toString("yyyy-MM-dd")
-                end_date = end_date_input.date().toString("yyyy-MM-dd")
-                if not start_date or not end_date:
-                    QMessageBox.warning(None, 'Warning', 'Please select both start and end dates for the "Period of Time" filter.')
-                    return  # Exit the function
-                value_to_filter = [start_date, end_date]
-            else:
-                value_to_filter = value_input.text()
-                if not value_to_filter:
-                    QMessageBox.warning(None, 'Warning', 'Please enter a value for the filter field.')
-                    return  # Exit the function
-
-            project = QgsProject.instance()
-            layers = project.mapLayers().values()
-
-            for layer in layers:
-                if isinstance(layer, QgsVectorLayer):
-                    field_to_check = None
-                    if filter_criteria == "Cabinet ID":
-                        field_to_check = ["Cab_ID_OR_OLT_ID", "FDT_ID", "CAB_OR_OLT_ID", "CAB_ID", "Zone_ID", "ZoneID", "cab_id", "FDT_ID_OR_OLT_ID"]
-                    elif filter_criteria == "Route":
-                        field_to_check = ["SUB_RingID", "subring_id", "Route_ID"]
-                    elif filter_criteria == "Data Provider":
-                        field_to_check = ["Data_providor", "Data_Providor", "Data_Provider"]
-                    elif filter_criteria == "Contractor":
-                        field_to_check = ["Implementing_Contractor", "Implementing_contractor", "Contractor", "contractor_id"]
-                    elif filter_criteria == "Coordinator":
-                        field_to_check = ["Coordinator"]
-                    elif filter_criteria == "Exchange":
-                        field_to_check = ["ExchangeID", "Exchange ID"]
-                    elif filter_criteria == "Rework":
-                        if value_to_filter in ['Yes', 'No']:
-                            field_to_check = "Rework"
-                        else:
-                            QMessageBox.warning(None, 'Warning', 'Please enter "Yes" or "No" for the "Rework" field.')
-                            return  # Exit the function
-                    elif filter_criteria in ["Date", "Period Of Time"]:
-                        field_to_check = ["Installation_Date", "Excavation_Date"]
-
-                    if field_to_check:
-                        if isinstance(field_to_check, list):
-                            # Check if any of the fields in the list exist in the layer's fields
-                            fields = layer.fields()
-                            field_names = [field.name() for field in fields]
-                            filter_strings = []
-                            for field in field_to_check:
-                                if field in field_names:
-                                    if filter_criteria == "Period Of Time":
-                                        # Use BETWEEN operator for date range
-                                        start_date, end_date = value_to_filter
-                                        filter_strings.append(f'"{field}" BETWEEN \'{end_date}\' AND \'{start_date}\'')
-                                    else:
-                                        # Use direct action
-                                        filter_strings.append(f'"{field}" = \'{value_to_filter}\'')
-                            if filter_strings:
-                                query = ' OR '.join(filter_strings)
-                                layer.setSubsetString(query)
-                        else:
-                            if field_to_check in layer.fields().names():
-                                if filter_criteria == "Period Of Time":
-                                    # Use BETWEEN operator for date range
-                                    start_date, end_date = value_to_filter
-                                    query = f'"{field_to_check}" BETWEEN \'{end_date}\' AND \'{start_date}\''
-                                else:
-                                    # Use direct action
-                                    query = f'"{field_to_check}" = \'{value_to_filter}\''
-                                layer.setSubsetString(query)
-                            else:
-                                layer.setSubsetString("")  # Clear the filter if the field is not present or if no filter value is entered
-                        # Refresh the layer to apply the filter
-                        layer.triggerRepaint()
+        self.live_filter.begin()
+        accepted = dialog.exec_() == QDialog.Accepted
+        dialog.stop_live()
+        dialog.preview.cancel()
+        # Live mode was on, or the live preview already changed some layers
+        live = dialog.live_checkbox.isChecked() or bool(self.live_filter.touched)
+        if accepted:
+            filter_criteria = dialog.criterion()
+            plan, native = self.single_filter_plan(filter_criteria, dialog.filter_value)
+            # Empty the layers the preview found without matches, if asked to
+            plan = dialog.preview.filter_plan(plan, input_key(filter_criteria, dialog.filter_value))
+
+            # Index the criterion's fields in the background if enabled
+            self.index_manager.on_first_use(filter_criteria)
+
+            # Validate and apply every layer, then refresh the canvas once
+            def apply(plan, native, on_finished):
+                if live:
+                    # Hidden layers are only filtered once they are switched on
+                    plan, deferred, native, trusted = self.live_filter.accept(plan, native)
+                    self.apply_plan('AutoFilter: Single-Filter', plan, native, on_finished, deferred, trusted)
+                else:
+                    self.apply_plan('AutoFilter: Single-Filter', plan, native, on_finished)
+
+            self.expand_plan('AutoFilter: Single-Filter', plan, native, apply)
+        elif live:
+            # Put back the filters the live preview changed
+            self.live_filter.restore()
 
         # Deactivate the custom map tool after the action is completed
         if self.tool:
@@ -248,165 +332,334 @@ class AutoFilter:
             QMessageBox.warning(None, 'Warning', 'The project is empty. Please add layers to the project before using this plugin.')
             return  # Exit the function
 
-        # Create a QDialog for multi-filter input
-        dialog = QDialog(self.iface.mainWindow())
-        dialog.setWindowTitle('Multi-Filter')
-
-        # Define filter criteria options
-        filter_criteria_options = ["Exchange", "Route", "Cabinet"]
-
-        # Create a combo box for choosing filter criteria
-        combo_box = QComboBox(dialog)
-        combo_box.addItems(filter_criteria_options)
-        combo_box.setEditable(False)
-        combo_box.setCurrentIndex(0)
-
-        # Create a label for choosing the number of values
-        num_values_label = QLabel('Number of Values:', dialog)
-
-        # Create a combo box for choosing the number of values
-        num_values_combo = QComboBox(dialog)
-        num_values_combo.addItems(['2', '3', '4', '5', '6', '7', '8', '9', '10', '11','12', '13', '14', '15', '16', '17', '18', '19', '20','21','22', '23', '24', '25', '26', '27', '28', '29', '30'])
-        num_values_combo.setEditable(False)
-        num_values_combo.setCurrentIndex(0)
-
-        # Create a list of line edit widgets for entering filter values
-        value_inputs = [QLineEdit(dialog) for _ in range(30)]
-
-        # Create a QLabel for the powered by message
-        powered_by_label = QLabel('Powered By © Hasan Sami', dialog)
-        powered_by_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-
-        # Create a QPushButton for confirming the multi-filter
-        confirm_button = QPushButton('OK', dialog)
-
-        # Create a QPushButton for importing values from Excel
-        import_excel_button = QPushButton('Import Values from Excel', dialog)
-
-        # Create a layout for the dialog
-        layout = QVBoxLayout()
-        layout.addWidget(combo_box)
-        layout.addWidget(num_values_label)
-        layout.addWidget(num_values_combo)
-        for value_input in value_inputs:
-            layout.addWidget(value_input)
-        layout.addWidget(import_excel_button)  # Add the import Excel button
-        layout.addWidget(confirm_button)
-        layout.addWidget(powered_by_label)  # Add the powered by label
-        
-        # Set the layout for the dialog
-        dialog.setLayout(layout)
-
-        # Function to update the visibility of value input widgets based on the selected number of values
-        def update_value_inputs():
-            num_values = int(num_values_combo.currentText())
-            for i, input_widget in enumerate(value_inputs):
-                input_widget.setVisible(i < num_values)
-
-        # Connect the num_values_combo's currentIndexChanged signal to the update_value_inputs function
-        num_values_combo.currentIndexChanged.connect(update_value_inputs)
+        # Build the dialog on first use and reuse it afterwards
+        if self.multi_filter_dialog is None:
+            from .dialogs import MultiFilterDialog
+            self.multi_filter_dialog = MultiFilterDialog(self, self.iface.mainWindow())
+        dialog = self.multi_filter_dialog
+        dialog.prepare()
 
-        # Set the initial visibility based on the default selection
-        update_value_inputs()
+        # Show the dialog
+        accepted = dialog.exec_() == QDialog.Accepted
+        dialog.preview.cancel()
+        if accepted:
+            criterion = dialog.criterion()
+            plan, native = self.multi_filter_plan(criterion, dialog.filter_values)
+            # Empty the layers the preview found without matches, if asked to
+            plan = dialog.preview.filter_plan(plan, input_key(criterion, dialog.filter_values))
+
+            # Index the criterion's fields in the background if enabled
+            self.index_manager.on_first_use(criterion)
+
+            # Validate and apply every layer, then refresh the canvas once
+            self.expand_plan('AutoFilter: Multi-Filter', plan, native,
+                             lambda plan, native, on_finished: self.apply_plan('AutoFilter: Multi-Filter', plan, native, on_finished))
+
+    def compositeFilter(self):
+        # Check if there are any layers in the project
+        project = QgsProject.instance()
+        if not project.mapLayers():
+            QMessageBox.warning(None, 'Warning', 'The project is empty. Please add layers to the project before using this plugin.')
+            return  # Exit the function
 
-        # Function to handle importing values from Excel
-        def import_values_from_excel():
-            file_dialog = QFileDialog.getOpenFileName(dialog, 'Select Excel File', '', 'Excel Files (*.xlsx *.xls *.csv)')[0]
-            if not file_dialog:
-                return
+        # Build the dialog on first use and reuse it afterwards
+        if self.composite_filter_dialog is None:
+            from .dialogs import CompositeFilterDialog
+            self.composite_filter_dialog = CompositeFilterDialog(self, self.iface.mainWindow())
+        dialog = self.composite_filter_dialog
+        dialog.prepare()
 
-            try:
-                excel_data = pd.read_excel(file_dialog, header=None)
-                num_rows, num_cols = excel_data.shape
-
-                if num_rows > 30:
-                    QMessageBox.warning(None, 'Warning', 'The Excel file contains more than 30 rows of data. Please select a smaller file.')
-                    return  # Exit the function
+        # Show the dialog
+        accepted = dialog.exec_() == QDialog.Accepted
+        dialog.preview.cancel()
+        if accepted:
+            plan, native = self.composite_plan(dialog.predicates, dialog.operator)
+            # Empty the layers the preview found without matches, if asked to
+            plan = dialog.preview.filter_plan(plan, input_key(dialog.operator, dialog.predicates))
+
+            # Index every criterion's fields in the background if enabled
+            for criterion, _values in dialog.predicates:
+                self.index_manager.on_first_use(criterion)
+
+            # Validate and apply every layer, then refresh the canvas once
+            description = f'AutoFilter: Composite Filter ({dialog.operator})'
+            self.expand_plan(description, plan, native,
+                             lambda plan, native, on_finished: self.apply_plan(description, plan, native, on_finished))
 
-                num_values_combo.setCurrentIndex(num_rows - 2)  # Set the combo box to the number of rows minus 2 (to account for 2 as the minimum)
+    def clearFilters(self):
+        # Linked layers still being gathered would be filtered again after the clear
+        self.cancel_expansions()
 
-                for i, value_input in enumerate(value_inputs):
-                    if i < num_rows:
-                        value_input.setText(str(excel_data.iloc[i, 0]))
+        # Restore the layers in scope AutoFilter changed to the filters they had before
+        plan = self.scope.restrict(self.session.clear_plan())
 
-            except Exception as e:
-                QMessageBox.warning(None, 'Error', f'An error occurred while importing values from Excel: {str(e)}')
+        # Display a message based on whether filters were cleared or not
+        if not plan:
+            QMessageBox.warning(None, 'No Filters', f'No filters were applied to clear in scope: {self.scope.describe()}.')
+            return  # Exit the function
 
-        # Connect the import_excel_button's clicked signal to the import_values_from_excel function
-        import_excel_button.clicked.connect(import_values_from_excel)
+        def report_cleared(result):
+            if not result.cancelled:
+                # Drop the lookup lists no undo or redo can bring back
+                self.release_value_lists(self.session.expressions())
+                QMessageBox.information(None, 'Filter Cleared', f'Filters have been cleared in scope: {self.scope.describe()}.')
 
-        # Function to handle the OK button click event
-        def confirm_multi_filter():
-            filter_criteria = combo_box.currentText()
-            num_values = int(num_values_combo.currentText())
-            values = [value_input.text() for value_input in value_inputs[:num_values]]
-            if not any(values):
-                QMessageBox.warning(None, 'Warning', 'Please enter at least one value for the filter.')
-                return  # Exit the function
+        # Restore every changed layer, then refresh the canvas once
+        self.apply_plan('AutoFilter: Clear Filters', plan, (), report_cleared, trusted=set(plan))
 
-            # Construct the IN clause for the filter
-            in_clause = "','".join(values)
-
-            project = QgsProject.instance()
-            layers = project.mapLayers().values()
-
-            for layer in layers:
-                if isinstance(layer, QgsVectorLayer):
-                    field_to_check = None
-                    if filter_criteria == "Cabinet":
-                        field_to_check = ["Cab_ID_OR_OLT_ID", "FDT_ID", "CAB_OR_OLT_ID", "CAB_ID", "Zone_ID", "ZoneID",
-                                          "cab_id", "FDT_ID_OR_OLT_ID"]
-                    elif filter_criteria == "Route":
-                        field_to_check = ["SUB_RingID", "subring_id", "Route_ID", "Route"]
-                    elif filter_criteria == "Exchange":
-                        field_to_check = ["ExchangeID", "Exchange ID"]
-
-                    if field_to_check:
-                        if isinstance(field_to_check, list):
-                            # Check if any of the fields in the list exist in the layer's fields
-                            fields = layer.fields()
-                            field_names = [field.name() for field in fields]
-                            filter_strings = []
-                            for field in field_to_check:
-                                if field in field_names:
-                                    filter_strings.append(f'"{field}" IN (\'{in_clause}\')')
-                            if filter_strings:
-                                query = ' OR '.join(filter_strings)
-                                layer.setSubsetString(query)
-                        else:
-                            if field_to_check in layer.fields().names():
-                                query = f'"{field_to_check}" IN (\'{in_clause}\')'
-                                layer.setSubsetString(query)
-                            else:
-                                layer.setSubsetString("")  # Clear the filter if the field is not present or if no filter value is entered
-                        # Refresh the layer to apply the filter
-                        layer.triggerRepaint()
-
-            # Close the dialog
-            dialog.accept()
-
-        # Connect the confirm_button's clicked signal to the confirm_multi_filter function
-        confirm_button.clicked.connect(confirm_multi_filter)
+    def exportFilteredLayers(self):
+        # Write every filtered vector layer to one GeoPackage in the background
+        layers = filtered_layers(QgsProject.instance())
+        if not layers:
+            QMessageBox.warning(None, 'No Filters', 'No layer is filtered, so there is nothing to export.')
+            return  # Exit the function
+        if self.export_task is not None:
+            QMessageBox.warning(None, 'Export Filtered Layers', 'An export is still running.')
+            return  # Exit the function
 
-        # Show the dialog
-        dialog.exec_()
+        # Build the dialog on first use and reuse it afterwards
+        if self.export_dialog is None:
+            from .dialogs import ExportDialog
+            self.export_dialog = ExportDialog(self.iface.mainWindow())
+        dialog = self.export_dialog
+        dialog.prepare(len(layers))
+        if dialog.exec_() != QDialog.Accepted:
+            return  # Exit the function
 
-    def clearFilters(self):
-        # Flag to check if any filters were applied
-        filters_applied = False
+        def exported(task, result):
+            self.export_task = None
+            if not result:
+                self.iface.messageBar().pushInfo('AutoFilter', 'The export was cancelled.')
+                return
+            summary = report(task)
+            if task.errors:
+                QMessageBox.warning(None, 'Warning', 'Some layers were not exported:\n' + '\n'.join(task.errors))
+            QMessageBox.information(None, 'Filtered Layers Exported', f'{task.path}\n\n{summary}')
+
+        # Layers are read concurrently and written by one writer
+        self.export_task = ExportTask('AutoFilter: Export filtered layers', dialog.path, [export_job(layer) for layer in layers],
+                                      QgsProject.instance().transformContext(), dialog.attributes_only, dialog.tolerance,
+                                      callback=exported)
+        QgsApplication.taskManager().addTask(self.export_task)
+
+    def undoFilter(self):
+        # Go back to the previous filter snapshot
+        self.move_in_history('AutoFilter: Undo Filter', self.session.undo_plan(), -1)
+
+    def redoFilter(self):
+        # Go forward to the next filter snapshot
+        self.move_in_history('AutoFilter: Redo Filter', self.session.redo_plan(), 1)
+
+    def move_in_history(self, description, plan, step):
+        # Reapply only the layers that differ from the target snapshot
+        if plan is None:
+            return  # Exit the function
 
-        # Clear filters on all layers
-        project = QgsProject.instance()
-        layers = project.mapLayers().values()
-        for layer in layers:
-            if isinstance(layer, QgsVectorLayer):
-                if layer.subsetString():  # Check if a filter is applied
-                    filters_applied = True
-                    layer.setSubsetString("")  # Clear the filter
-                    layer.triggerRepaint()  # Refresh the layer to apply the filter removal
+        self.live_filter.discard()
+        self.cancel_expansions()
+
+        def moved(result):
+            if not result.cancelled:
+                self.session.moved(step)
+            self.update_history_actions()
+            self.report_filter_result(result)
+
+        # Snapshot expressions were applied before, so they skip validation
+        self.filter_engine.submit(description, plan, moved, trusted=set(plan))
+
+    def expand_plan(self, description, plan, native, apply):
+        # Apply a plan with apply(plan, native, on_finished) right away, then the filters of
+        # linked and overlapping layers once they are gathered, if enabled
+        # A newer filter supersedes the expansions of the previous one
+        self.cancel_expansions()
+        steps = [expansion for expansion in (self.cascade, self.spatial_filter) if expansion.enabled]
+
+        def applied(result):
+            self.report_filter_result(result)
+            if steps and not result.cancelled:
+                self.expand_steps(description, plan, steps, {}, set())
+
+        # Layers outside the scope are never reloaded
+        apply(self.scope.restrict(plan), native, applied)
+
+    def expand_steps(self, description, plan, steps, children, children_native):
+        # Gather the filters of linked, then overlapping layers, then add them to the applied filter
+        if not steps:
+            children = self.scope.restrict(children)
+            if children:
+                self.apply_plan(f'{description} (linked layers)', children, children_native & set(children), amend=True)
+            return  # Exit the function
 
-        # Display a message based on whether filters were cleared or not
-        if filters_applied:
-            QMessageBox.information(None, 'Filter Cleared', 'Filters have been cleared from all layers.')
-        else:
-            QMessageBox.warning(None, 'No Filters', 'No filters were applied to clear.')
+        def expanded(step_children, step_native):
+            # The user's own filters win over expanded ones, and earlier expansions over later ones
+            added = {layer_id: expression for layer_id, expression in step_children.items()
+                     if layer_id not in plan and layer_id not in children}
+            self.expand_steps(description, plan, steps[1:], dict(children, **added),
+                              children_native | (set(step_native) & set(added)))
+
+        steps[0].expand(dict(children, **plan), expanded)
+
+    def cancel_expansions(self):
+        # Drop the cascaded and spatial filters still being gathered
+        self.cascade.cancel()
+        self.spatial_filter.cancel()
+
+    def apply_plan(self, description, plan, native=(), on_finished=None, deferred=None, trusted=(), amend=False):
+        # Remember the original filters, apply the plan and record a snapshot
+        # (or, with amend, add the plan to the latest one, which it completes)
+        if not amend:
+            self.live_filter.discard()
+        self.session.remember(dict(plan, **(deferred or {})))
+
+        def applied(result):
+            if not result.cancelled:
+                self.session.commit(deferred, set(plan) if amend else None)
+                if deferred:
+                    self.live_filter.defer(deferred, set(native) | set(trusted))
+            self.update_history_actions()
+            (on_finished or self.report_filter_result)(result)
+
+        self.filter_engine.submit(description, plan, applied, native, trusted=trusted)
+
+    def update_history_actions(self):
+        # Enable undo/redo only when there is somewhere to go
+        self.undo_action.setEnabled(self.session.can_undo())
+        self.redo_action.setEnabled(self.session.can_redo())
+
+    def single_filter_plan(self, filter_criteria, value_to_filter):
+        # Build {layer id: subset string} and the ids of provider-native ones
+        plan, native = single_filter_plan(self.field_index, filter_criteria, value_to_filter, self.scope.layer_ids())
+        self.offer_fid_subsets(filter_criteria, [value_to_filter], plan)
+        return plan, native
+
+    def multi_filter_plan(self, criterion, values, preview=False):
+        # Build {layer id: subset string} and the ids of provider-native ones
+        # A preview inlines long lists rather than writing lookup lists for input that may never be applied
+        plan, native = multi_filter_plan(self.field_index, criterion, values, None if preview else self.value_store,
+                                         self.scope.layer_ids())
+        self.offer_fid_subsets(criterion, values, plan)
+        return plan, native
+
+    def release_value_lists(self, keep=()):
+        # Delete the lookup lists written this session that no layer filter nor keep expression uses
+        subsets = {self.filter_engine.subset_string(layer) for layer in QgsProject.instance().mapLayers().values()
+                   if isinstance(layer, QgsVectorLayer)}
+        self.value_store.clear(subsets | set(keep))
+
+    def composite_plan(self, predicates, operator):
+        # Build {layer id: subset string} with each layer's predicates ordered by selectivity
+        self.filter_engine.offers = {}
+        return composite_plan(self.field_index, predicates, operator, self.planner, self.scope.layer_ids())
+
+    def offer_fid_subsets(self, criterion, values, plan):
+        # Let the engine set the plan's filters as the feature ids the inverted index resolves them to;
+        # the plan and the session keep the filters themselves
+        offers = {}
+        if self.fid_index.enabled and criterion not in UNCATALOGUED_CRITERIA:
+            for layer, fields in self.field_index.layers_for(criterion):
+                if layer.id() not in plan:
+                    continue
+                fids = self.fid_index.lookup(layer, fields, values)
+                subset = fid_subset_string(layer, fids)[0] if fids is not None else None
+                if subset is not None:
+                    offers[(layer.id(), plan[layer.id()])] = subset
+        self.filter_engine.offers = offers
+
+    def createIndexes(self):
+        # Index every criteria field that lacks an attribute index, checked in the background
+        def report_indexes(created, failed):
+            if not created and not failed:
+                QMessageBox.information(None, 'Attribute Indexes', 'All filter fields that support it are already indexed.')
+                return  # Exit the function
+            message = f'{created} attribute index(es) created.'
+            if failed:
+                message += '\nFailed:\n' + '\n'.join(f'{source} ({field}): {error}' for (source, field), error in failed)
+            QMessageBox.information(None, 'Attribute Indexes', message)
+
+        self.index_manager.create_missing(on_finished=report_indexes)
+
+    def toggleAutoIndex(self, checked):
+        # Remember whether filter fields are indexed the first time they are used
+        self.index_manager.auto_index = checked
+
+    def toggleFidIndex(self, checked):
+        # Remember whether filters are resolved through the feature-ID index
+        self.fid_index.enabled = checked
+
+    def toggleBackground(self, checked):
+        # Remember whether filters are prepared in a background task
+        self.filter_engine.background = checked
+
+    def current_group(self):
+        # Group selected in the layer tree (the layer's group if a layer is selected)
+        view = self.iface.layerTreeView()
+        return view.currentGroupNode() if view is not None else None
+
+    def setScope(self, scope):
+        # Remember the filter scope; a layer set is a map theme chosen here
+        if scope == SCOPE_LAYER_SET:
+            themes = QgsProject.instance().mapThemeCollection().mapThemes()
+            if not themes:
+                QMessageBox.warning(None, 'Filter Scope', 'The project has no map themes to use as a layer set.')
+                self.scope_actions[self.scope.scope].setChecked(True)
+                return  # Exit the function
+            current = themes.index(self.scope.theme) if self.scope.theme in themes else 0
+            theme, ok = QInputDialog.getItem(self.iface.mainWindow(), 'Filter Scope', 'Map theme:', themes, current, False)
+            if not ok:
+                self.scope_actions[self.scope.scope].setChecked(True)
+                return  # Exit the function
+            self.scope.theme = theme
+        self.scope.scope = scope
+
+    def toggleCascade(self, checked):
+        # Remember whether filters are carried over to linked layers
+        self.cascade.enabled = checked
+
+    def toggleSpatialFilter(self, checked):
+        # Remember whether layers without criteria fields are filtered by location
+        self.spatial_filter.enabled = checked
+
+    def toggleResultCache(self, checked):
+        # Remember whether filter results are cached; turning it off frees the cache
+        self.result_cache.enabled = checked
+
+    def toggleNativeSql(self, checked):
+        # Remember whether filters are written in each database's own SQL
+        set_native_sql_enabled(checked)
+
+    def toggleProfiling(self, checked):
+        # Remember whether every layer of a filter operation is timed
+        self.filter_engine.profiling = checked
+
+    def toggleProfileDetails(self, checked):
+        # Remember whether profiles also time the extent and feature count
+        set_profile_details_enabled(checked)
+
+    def toggleProfileLog(self, checked):
+        # Choose the JSON-lines file profiles are appended to, or stop writing it
+        path = ''
+        if checked:
+            path = QFileDialog.getSaveFileName(self.iface.mainWindow(), 'Filter Profile Log', profile_log_path(),
+                                               'JSON Lines (*.jsonl)')[0]
+            if not path:
+                self.profile_log_action.blockSignals(True)
+                self.profile_log_action.setChecked(False)
+                self.profile_log_action.blockSignals(False)
+        set_profile_log_path(path)
+
+    def report_filter_result(self, result):
+        # Tell the user how the last filter went
+        if result.cancelled:
+            self.iface.messageBar().pushInfo('AutoFilter', 'Filtering was cancelled.')
+            return
+        if result.errors:
+            QMessageBox.warning(None, 'Warning', 'The filter was not applied to some layers:\n' + '\n'.join(result.errors))
+        message = f'Filter applied to {result.applied} layer(s), {result.skipped} unchanged layer(s) skipped.'
+        if self.fid_index.enabled:
+            message += f' Feature-ID index: {self.fid_index.stats()}.'
+        if self.result_cache.enabled:
+            message += f' Result cache: {self.result_cache.stats()}.'
+        if result.profile is not None and result.profile.layers:
+            slowest = result.profile.slowest(1)[0]
+            message += f" Slowest layer: {slowest['layer']} ({slowest['total_ms']:.0f} ms), details in the AutoFilter log."
+        self.iface.messageBar().pushSuccess('AutoFilter', message)
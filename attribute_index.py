@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Attribute indexes on the fields the filters are evaluated against.
+"""
+import os.path
+import sqlite3
+from contextlib import closing
+from xml.etree import ElementTree
+
+from qgis.PyQt.QtCore import QSettings
+from qgis.core import QgsDataSourceUri, QgsTask, QgsVectorDataProvider
+
+from .layer_sources import LayerWatcher, TaskSet, sqlite_location, unfiltered_source
+from .sql_dialect import quote_identifier
+from .value_table import postgres_connection, quote_sql
+
+# QSettings key for indexing filter fields the first time they are used
+AUTO_INDEX_SETTING = 'AutoFilter/auto_attribute_index'
+
+# Index states remembered per (layer source, field)
+INDEXED = 'indexed'
+MISSING = 'missing'
+PENDING = 'pending'
+UNSUPPORTED = 'unsupported'
+
+
+class CreateIndexTask(QgsTask):
+    """Check and create attribute indexes off the GUI thread.
+
+    Every field is checked first and indexed only if it lacks an index.
+    GeoPackage, SpatiaLite and PostgreSQL sources are reached through
+    connections of the task's own, never through the layer's provider.
+    Shapefile indexes are read from their sidecar file; the missing ones are
+    left for the provider to create on the main thread.
+    """
+
+    def __init__(self, description, jobs, callback=None):
+        super().__init__(description, QgsTask.CanCancel)
+        # [(key, kind, target, table, field)]
+        self.jobs = jobs
+        self.callback = callback
+        self.indexed = []
+        self.created = []
+        self.failed = []
+        # Shapefile fields without an index
+        self.missing = []
+
+    def run(self):
+        total = len(self.jobs) or 1
+        for i, (key, kind, target, table, field) in enumerate(self.jobs):
+            if self.isCanceled():
+                return False
+            try:
+                if kind == 'sqlite':
+                    if field in sqlite_indexed_columns(target, table):
+                        self.indexed.append(key)
+                    else:
+                        create_sqlite_index(target, table, field)
+                        self.created.append(key)
+                elif kind == 'postgres':
+                    if field in postgres_indexed_columns(target, table):
+                        self.indexed.append(key)
+                    else:
+                        create_postgres_index(target, table, field)
+                        self.created.append(key)
+                elif field.lower() in shapefile_indexed_fields(target):
+                    self.indexed.append(key)
+                else:
+                    self.missing.append(key)
+            except Exception as e:
+                self.failed.append((key, str(e)))
+            self.setProgress(100.0 * (i + 1) / total)
+        return True
+
+    def finished(self, result):
+        if self.callback:
+            self.callback(self, result)
+
+
+class AttributeIndexManager:
+    """Detect and create missing attribute indexes on filter fields.
+
+    The state of every (unfiltered layer source, field) pair is checked once,
+    in the background, and remembered, so filtering never inspects the data
+    source again; it is checked again after the layer commits edits or
+    changes its data source. Database sources are checked and indexed by a
+    CreateIndexTask; other providers that report the CreateAttributeIndex
+    capability (shapefiles, memory layers) are indexed through
+    QgsVectorDataProvider.createAttributeIndex().
+    """
+
+    def __init__(self, field_index):
+        self.field_index = field_index
+        # (unfiltered layer source, field) -> INDEXED / MISSING / PENDING / UNSUPPORTED
+        self._state = {}
+        # layer id -> the unfiltered source its states are remembered under
+        self._sources = {}
+        self.watcher = LayerWatcher(self.invalidate_layer)
+        self.tasks = TaskSet()
+
+    @property
+    def auto_index(self):
+        return QSettings().value(AUTO_INDEX_SETTING, False, type=bool)
+
+    @auto_index.setter
+    def auto_index(self, enabled):
+        QSettings().setValue(AUTO_INDEX_SETTING, bool(enabled))
+
+    def known_state(self, layer, field):
+        """Return the remembered index state of a layer field, or None without checking it."""
+        return self._state.get((unfiltered_source(layer), field))
+
+    def on_first_use(self, criterion):
+        """Index the fields of a criterion if automatic indexing is enabled."""
+        if self.auto_index:
+            self.create_missing([criterion])
+
+    def create_missing(self, criteria=None, on_finished=None):
+        """Index the criteria fields that lack an attribute index; on_finished(created, failed).
+
+        Fields whose state is not known yet are checked by the task that
+        creates the missing indexes, so the GUI thread never queries a data
+        source for them.
+        """
+        criteria = criteria if criteria is not None else self.field_index.criteria
+        jobs = []
+        direct = []
+        # key -> (layer, field) for the fields the provider indexes
+        layers = {}
+        for criterion in criteria:
+            for layer, fields in self.field_index.layers_for(criterion):
+                for field in fields:
+                    key = self._key(layer, field)
+                    if key in self._state:
+                        # Checked before, or queued by a running task
+                        continue
+                    target = index_target(layer)
+                    if target is None:
+                        self._state[key] = UNSUPPORTED
+                        continue
+                    # Do not queue the same index twice while a task is running
+                    self._state[key] = PENDING
+                    layers[key] = (layer, field)
+                    if target[0] == 'direct':
+                        # Memory layers: nothing to check, indexing is cheap
+                        direct.append(key)
+                    else:
+                        jobs.append((key,) + target + (field,))
+        if not jobs and not direct:
+            if on_finished:
+                on_finished(0, [])
+            return
+
+        def done(task, result):
+            self.tasks.discard(task)
+            for key in task.indexed:
+                self._state[key] = INDEXED
+            for key in task.created:
+                self._state[key] = INDEXED
+            for key, _error in task.failed:
+                self._state[key] = UNSUPPORTED
+            created = len(task.created) + self._create_direct({key: layers[key] for key in direct + task.missing})
+            # Jobs skipped by a cancellation are checked again next time
+            for job in task.jobs:
+                if self._state.get(job[0]) == PENDING:
+                    del self._state[job[0]]
+            if on_finished:
+                on_finished(created, task.failed)
+
+        task = CreateIndexTask('AutoFilter: Create attribute indexes', jobs, done)
+        if not jobs:
+            done(task, True)
+            return
+        self.tasks.start(task)
+
+    def _create_direct(self, pairs):
+        # pairs: {key: (layer, field)} for the provider to index
+        created = 0
+        for key, (layer, field) in pairs.items():
+            try:
+                field_index = layer.fields().indexOf(field)
+                indexed = field_index >= 0 and layer.dataProvider().createAttributeIndex(field_index)
+            except RuntimeError:
+                # The layer has been deleted since
+                self._state.pop(key, None)
+                continue
+            self._state[key] = INDEXED if indexed else UNSUPPORTED
+            created += int(indexed)
+        return created
+
+    def invalidate_layer(self, layer_id):
+        """Forget the index states of a layer's source so they are checked again."""
+        source = self._sources.pop(layer_id, None)
+        for key in [key for key in self._state if key[0] == source and self._state[key] != PENDING]:
+            del self._state[key]
+
+    def _key(self, layer, field):
+        # Keyed without the subset string, which changes with every filter
+        source = unfiltered_source(layer)
+        self._sources[layer.id()] = source
+        self.watcher.watch(layer)
+        return source, field
+
+    def unload(self):
+        self.tasks.cancel_all()
+        self.watcher.unload()
+
+
+def index_target(layer):
+    """Return (kind, target, table) locating a layer's indexes, or None if it cannot be indexed.
+
+    kind is 'sqlite', 'postgres' or 'shapefile', checked and indexed by a
+    CreateIndexTask, or 'direct' for providers indexed on the main thread
+    without a check.
+    """
+    provider = layer.dataProvider()
+    if not provider.capabilities() & QgsVectorDataProvider.CreateAttributeIndex:
+        return None
+    try:
+        location = sqlite_location(layer)
+    except sqlite3.Error:
+        return None
+    if location is not None:
+        return ('sqlite',) + location
+    if layer.providerType() == 'postgres':
+        uri = QgsDataSourceUri(layer.source())
+        return 'postgres', (layer.source(), uri.schema() or 'public'), uri.table()
+    if layer.providerType() == 'ogr' and provider.storageType() == 'ESRI Shapefile':
+        return 'shapefile', os.path.splitext(layer.source().split('|')[0])[0], None
+    return 'direct', None, None
+
+
+def shapefile_indexed_fields(base):
+    """Return the lower-case names of the fields OGR has indexed for a shapefile.
+
+    OGR keeps shapefile attribute indexes in a .ind file and lists the
+    indexed fields in the XML of a .idm file next to it.
+    """
+    if not os.path.exists(base + '.idm'):
+        return set()
+    root = ElementTree.parse(base + '.idm').getroot()
+    return {element.text.strip().lower() for element in root.iter('FieldName') if element.text}
+
+
+def sqlite_indexed_columns(path, table):
+    """Return the columns leading an index of a SQLite table."""
+    columns = set()
+    with closing(sqlite3.connect(path)) as connection:
+        for index in connection.execute(f'PRAGMA index_list({quote_identifier(table)})').fetchall():
+            info = connection.execute(f'PRAGMA index_info({quote_identifier(index[1])})').fetchall()
+            if info:
+                columns.add(info[0][2])
+    return columns
+
+
+def create_sqlite_index(path, table, field):
+    with closing(sqlite3.connect(path)) as connection, connection:
+        connection.execute(f'CREATE INDEX IF NOT EXISTS {quote_identifier(f"idx_{table}_{field}")} '
+                           f'ON {quote_identifier(table)} ({quote_identifier(field)})')
+
+
+def postgres_indexed_columns(target, table):
+    """Return the columns leading an index of a PostgreSQL table."""
+    connection, schema = postgres_connection(target)
+    rows = connection.executeSql(
+        'SELECT a.attname FROM pg_index i '
+        'JOIN pg_class c ON c.oid = i.indrelid '
+        'JOIN pg_namespace n ON n.oid = c.relnamespace '
+        'JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = i.indkey[0] '
+        f'WHERE i.indisvalid AND n.nspname = {quote_sql(schema)} AND c.relname = {quote_sql(table)}')
+    return {row[0] for row in rows}
+
+
+def create_postgres_index(target, table, field):
+    connection, schema = postgres_connection(target)
+    # One statement on its own, outside a transaction as CONCURRENTLY requires,
+    # so writers to the table are not blocked while the index is built
+    connection.executeSql(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote_identifier(f"idx_{table}_{field}")} '
+                          f'ON {quote_identifier(schema)}.{quote_identifier(table)} ({quote_identifier(field)})')
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Headless batch runner: filter projects and export the filtered layers.
+
+ Every (project, filter) pair is a job. Jobs run in a pool of processes,
+ each with its own QgsApplication, and write every filtered layer to one
+ GeoPackage per job. Run it with standalone PyQGIS from the directory that
+ holds the plugin:
+
+     python -m AutoFilter.batch a.qgz b.qgz --filter Exchange=BGD01 \\
+         --filter "Contractor=Alpha,Beta" --output-dir deliverables
+
+ or describe the work in a JSON spec (--spec):
+
+     {"projects": ["a.qgz"], "output_dir": "deliverables",
+      "filters": [{"name": "q1", "criterion": "Period Of Time",
+                   "values": ["2023-01-01", "2023-03-31"]}]}
+"""
+import argparse
+import atexit
+import json
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .criteria import SCHEMA
+
+_app = None
+
+
+def start_qgis():
+    """Start QGIS without a GUI in the current process (once)."""
+    global _app
+    if _app is None:
+        from qgis.core import QgsApplication
+        _app = QgsApplication([], False)
+        _app.initQgis()
+        atexit.register(_app.exitQgis)
+
+
+def parse_filter(text):
+    """Return a filter spec from 'CRITERION=VALUE[,VALUE...]'."""
+    criterion, separator, values = text.partition('=')
+    if not separator:
+        raise ValueError(f'Expected CRITERION=VALUE[,VALUE...], got "{text}"')
+    return {'criterion': criterion.strip(), 'values': [value.strip() for value in values.split(',') if value.strip()]}
+
+
+def check_filter(spec):
+    """Return a filter spec with its criterion resolved and a name, or raise ValueError."""
+    criterion = SCHEMA.resolve(spec.get('criterion'))
+    if criterion is None:
+        raise ValueError(f'Unknown criterion "{spec.get("criterion")}"')
+    values = [str(value) for value in spec.get('values') or []]
+    if not values:
+        raise ValueError(f'No values given for "{criterion.name}"')
+    error = criterion.check(values)
+    if error:
+        raise ValueError(error)
+    name = spec.get('name') or f'{criterion.name}-{"-".join(values)}'
+    return {'name': file_safe(name), 'criterion': criterion.name, 'values': values}
+
+
+def file_safe(text, limit=80):
+    """Return text usable in a file name."""
+    return re.sub(r'[^\w.-]+', '_', text).strip('_')[:limit] or 'filter'
+
+
+def make_jobs(projects, filters, output_dir):
+    """Return one job per (project, filter) pair."""
+    jobs = []
+    for project in projects:
+        stem = os.path.splitext(os.path.basename(project))[0]
+        for spec in filters:
+            output = os.path.join(output_dir, f'{file_safe(stem)}_{spec["name"]}.gpkg')
+            jobs.append({'project': os.path.abspath(project), 'filter': spec, 'output': os.path.abspath(output)})
+    return jobs
+
+
+def run_job(job):
+    """Filter one project and write its filtered layers to a GeoPackage.
+
+    Returns a summary with the job's timings; errors are reported in it
+    rather than raised, so one bad project does not stop the batch.
+    """
+    from qgis.core import QgsProject, QgsVectorFileWriter
+    from .field_index import FieldIndex
+    from .plans import filter_plan
+
+    start_qgis()
+    spec = job['filter']
+    summary = {'project': job['project'], 'filter': spec['name'], 'output': job['output'],
+               'status': 'ok', 'errors': [], 'layers': []}
+    started = time.perf_counter()
+    project = QgsProject()
+    temp_path = None
+    try:
+        # Read the project
+        if not project.read(job['project']):
+            raise RuntimeError(f'Cannot read project: {project.error()}')
+        summary['load_ms'] = elapsed_ms(started)
+
+        # Build the same plan the dialogs would
+        step = time.perf_counter()
+        field_index = FieldIndex(project)
+        plan, _native = filter_plan(field_index, spec['criterion'], spec['values'])
+        summary['plan_ms'] = elapsed_ms(step)
+
+        # Stream each filtered layer into a temporary GeoPackage next to the
+        # output, which replaces the output only once it is complete
+        step = time.perf_counter()
+        os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(suffix='.gpkg', prefix='.autofilter-', dir=os.path.dirname(job['output']))
+        os.close(handle)
+        # The writer creates the GeoPackage; only the unique name is needed
+        os.remove(temp_path)
+        names = set()
+        for layer_id, expression in plan.items():
+            layer = project.mapLayer(layer_id)
+            layer_started = time.perf_counter()
+            if not layer.setSubsetString(expression):
+                summary['errors'].append(f'{layer.name()}: invalid filter {expression}')
+                continue
+            options = QgsVectorFileWriter.SaveVectorOptions()
+            options.driverName = 'GPKG'
+            options.fileEncoding = 'UTF-8'
+            options.layerName = unique_name(file_safe(layer.name(), 60), names)
+            options.actionOnExistingFile = (QgsVectorFileWriter.CreateOrOverwriteLayer if os.path.exists(temp_path)
+                                            else QgsVectorFileWriter.CreateOrOverwriteFile)
+            error, message, _, _ = QgsVectorFileWriter.writeAsVectorFormatV3(
+                layer, temp_path, project.transformContext(), options)
+            if error != QgsVectorFileWriter.NoError:
+                summary['errors'].append(f'{layer.name()}: {message}')
+                continue
+            summary['layers'].append({'layer': options.layerName, 'features': layer.featureCount(),
+                                      'ms': elapsed_ms(layer_started)})
+        if os.path.exists(temp_path):
+            os.replace(temp_path, job['output'])
+        summary['export_ms'] = elapsed_ms(step)
+        field_index.unload()
+    except Exception as e:
+        summary['errors'].append(str(e))
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+        project.clear()
+    if summary['errors']:
+        summary['status'] = 'failed' if not summary['layers'] else 'partial'
+    summary['features'] = sum(layer['features'] for layer in summary['layers'])
+    summary['total_ms'] = elapsed_ms(started)
+    return summary
+
+
+def run_batch(jobs, workers=None):
+    """Run jobs across a pool of processes and return their summaries in order."""
+    if workers == 1 or len(jobs) <= 1:
+        return [run_job(job) for job in jobs]
+    # QGIS is not fork-safe: every worker starts a fresh interpreter
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=start_qgis) as pool:
+        return list(pool.map(run_job, jobs))
+
+
+def unique_name(name, names):
+    """Return name, suffixed if already in names, and add it to names."""
+    candidate = name
+    number = 1
+    while candidate.lower() in names:
+        number += 1
+        candidate = f'{name}_{number}'
+    names.add(candidate.lower())
+    return candidate
+
+
+def elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000.0, 1)
+
+
+def print_summary(summaries, total_ms, stream=sys.stdout):
+    """Print one line per job and the batch total."""
+    columns = ('project', 'filter', 'layers', 'features', 'load_ms', 'plan_ms', 'export_ms', 'total_ms', 'status')
+    rows = [[os.path.basename(summary['project']), summary['filter'], str(len(summary['layers'])),
+             str(summary['features'])] + [str(summary.get(key, '-')) for key in columns[4:8]] + [summary['status']]
+            for summary in summaries]
+    widths = [max(len(column), *(len(row[i]) for row in rows)) if rows else len(column)
+              for i, column in enumerate(columns)]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)), file=stream)
+    for row in rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)), file=stream)
+    for summary in summaries:
+        for error in summary['errors']:
+            print(f'{os.path.basename(summary["project"])} / {summary["filter"]}: {error}', file=stream)
+    print(f'{len(summaries)} jobs in {total_ms / 1000.0:.1f} s', file=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m AutoFilter.batch',
+                                     description='Filter QGIS projects and export the filtered layers to GeoPackages.')
+    parser.add_argument('projects', nargs='*', help='.qgz/.qgs projects to filter')
+    parser.add_argument('--filter', action='append', default=[], metavar='CRITERION=VALUE[,VALUE...]',
+                        help='filter to apply to every project (repeatable)')
+    parser.add_argument('--spec', help='JSON file with "projects", "filters" and optionally "output_dir"')
+    parser.add_argument('--output-dir', help='directory for the GeoPackages (default: current directory)')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--summary', help='write the per-job timing summary to this JSON file')
+    args = parser.parse_args(argv)
+
+    spec = {}
+    if args.spec:
+        with open(args.spec, encoding='utf-8') as spec_file:
+            spec = json.load(spec_file)
+    projects = list(spec.get('projects', [])) + args.projects
+    try:
+        filters = [check_filter(item) for item in spec.get('filters', [])]
+        filters += [check_filter(parse_filter(text)) for text in args.filter]
+    except ValueError as e:
+        parser.error(str(e))
+    if not projects or not filters:
+        parser.error('at least one project and one filter are needed')
+    output_dir = args.output_dir or spec.get('output_dir') or os.getcwd()
+
+    started = time.perf_counter()
+    summaries = run_batch(make_jobs(projects, filters, output_dir), args.workers)
+    total_ms = elapsed_ms(started)
+    print_summary(summaries, total_ms)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as summary_file:
+            json.dump({'total_ms': total_ms, 'jobs': summaries}, summary_file, indent=2)
+    return 1 if any(summary['status'] != 'ok' for summary in summaries) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Time Single-Filter, Multi-Filter and Clear Filters end to end on synthetic
+projects, headless under QgsApplication([], False).
+
+For every provider a project of --layers layers with --features features
+each is generated (see synthetic.py). The plugin's own components then run
+the same steps as its actions, without the dialogs: build the plan, record
+the session, validate and apply it through the FilterEngine, and for Clear
+Filters restore the original filters and drop the lookup tables.
+
+Each operation is repeated --repeat times; the median, minimum and maximum
+are reported with the applied/skipped/error counts of the last run.
+'count_ms' is the time to count the features left by the filter, i.e. the
+first query the providers run with the new subset strings.
+
+    python benchmarks/bench_filters.py --providers memory,gpkg --layers 300 \\
+        --features 2000 --multi-sizes 2,100,10000,100000 --output run.json
+"""
+import argparse
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import Timer, load_plugin, start_qgis, write_json  # noqa: E402
+
+MULTI_SIZES = (2, 10, 100, 1000, 10000, 100000)
+
+
+class Harness:
+    """The plugin's filtering components, wired as AutoFilter wires them."""
+
+    def __init__(self, project, background=False, profiling=False):
+        from AutoFilter.field_index import FieldIndex
+        from AutoFilter.filter_engine import FilterEngine
+        from AutoFilter.session import FilterSession
+        from AutoFilter.value_table import ValueListStore
+
+        self.project = project
+        self.field_index = FieldIndex(project)
+        self.value_store = ValueListStore()
+        self.filter_engine = FilterEngine(project, value_store=self.value_store)
+        self.session = FilterSession(project)
+        self.background = background
+        self.filter_engine.background = background
+        self.filter_engine.profiling = profiling
+
+    def single_filter(self, criterion, value):
+        from AutoFilter.plans import single_filter_plan
+        plan, native = single_filter_plan(self.field_index, criterion, value)
+        return self.apply_plan('Single-Filter', plan, native), plan
+
+    def multi_filter(self, criterion, values):
+        from AutoFilter.plans import multi_filter_plan
+        plan, native = multi_filter_plan(self.field_index, criterion, values, self.value_store)
+        return self.apply_plan('Multi-Filter', plan, native), plan
+
+    def clear_filters(self):
+        plan = self.session.clear_plan()
+        result = self.apply_plan('Clear Filters', plan, set(plan))
+        self.value_store.clear(self.session.expressions())
+        return result
+
+    def apply_plan(self, description, plan, native):
+        # Same sequence as AutoFilter.apply_plan, waiting for the result
+        self.session.remember(plan)
+        results = []
+        self.filter_engine.submit(description, plan, results.append, native)
+        if self.background:
+            from qgis.core import QgsApplication
+            while not results:
+                QgsApplication.processEvents()
+                time.sleep(0.001)
+        if not results[0].cancelled:
+            self.session.commit()
+        return results[0]
+
+    def count(self, plan):
+        return sum(max(self.project.mapLayer(layer_id).featureCount(), 0) for layer_id in plan)
+
+    def unload(self):
+        self.filter_engine.cancel()
+        self.field_index.unload()
+        self.session.unload()
+        self.value_store.clear()
+
+
+def multi_values(size):
+    """Return size cabinet values, existing ones first."""
+    from synthetic import cabinet_value
+    return [cabinet_value(number) for number in range(size)]
+
+
+def summarise(times):
+    return {'median_ms': round(statistics.median(times), 2), 'min_ms': round(min(times), 2),
+            'max_ms': round(max(times), 2), 'runs': len(times)}
+
+
+def run_operation(harness, repeat, operation):
+    """Run operation/clear pairs and return (operation entry, clear entry)."""
+    times, count_times, clear_times = [], [], []
+    for _ in range(repeat):
+        with Timer() as timer:
+            result, plan = operation()
+        times.append(timer.ms)
+        with Timer() as counted:
+            features = harness.count(plan)
+        count_times.append(counted.ms)
+        with Timer() as cleared:
+            clear_result = harness.clear_filters()
+        clear_times.append(cleared.ms)
+    entry = dict(summarise(times), count_ms=round(statistics.median(count_times), 2), layers=len(plan),
+                 features=features, applied=result.applied, skipped=result.skipped, errors=len(result.errors))
+    clear_entry = dict(summarise(clear_times), applied=clear_result.applied, errors=len(clear_result.errors))
+    return entry, clear_entry
+
+
+def bench_provider(args, provider, directory):
+    from synthetic import generate_project
+
+    entries = []
+    base = dict(provider=provider, layers_in_project=args.layers, features_per_layer=args.features, schema=args.schema)
+    with Timer() as generated:
+        project = generate_project(os.path.join(directory, provider), args.layers, args.features, provider,
+                                   args.schema, args.seed)
+    entries.append(dict(base, operation='generate', ms=round(generated.ms, 2)))
+
+    harness = Harness(project, args.background, args.profile)
+    with Timer() as built:
+        harness.field_index.ensure_built()
+    entries.append(dict(base, operation='field_index_build', ms=round(built.ms, 2)))
+
+    entry, clear_entry = run_operation(harness, args.repeat,
+                                       lambda: harness.single_filter('Cabinet ID', multi_values(1)[0]))
+    entries.append(dict(base, operation='single_filter', criterion='Cabinet ID', values=1, **entry))
+    entries.append(dict(base, operation='clear_filters', after='single_filter', values=1, **clear_entry))
+
+    for size in args.multi_sizes:
+        values = multi_values(size)
+        entry, clear_entry = run_operation(harness, args.repeat, lambda: harness.multi_filter('Cabinet ID', values))
+        entries.append(dict(base, operation='multi_filter', criterion='Cabinet ID', values=size, **entry))
+        entries.append(dict(base, operation='clear_filters', after='multi_filter', values=size, **clear_entry))
+
+    harness.unload()
+    project.clear()
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--providers', default='memory,gpkg,shapefile,spatialite')
+    parser.add_argument('--layers', type=int, default=50)
+    parser.add_argument('--features', type=int, default=1000, help='features per layer')
+    parser.add_argument('--schema', default='rotate', help='rotate, first or sparse (see synthetic.py)')
+    parser.add_argument('--multi-sizes', default=','.join(map(str, MULTI_SIZES)),
+                        help='comma-separated Multi-Filter value counts')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--background', action='store_true', help='validate plans in the task manager')
+    parser.add_argument('--profile', action='store_true', help='time every layer as the plugin profiler does')
+    parser.add_argument('--keep', help='generate the projects in this directory and keep them')
+    parser.add_argument('--output', help='JSON file to write (default: stdout)')
+    args = parser.parse_args()
+    args.multi_sizes = [int(size) for size in args.multi_sizes.split(',') if size]
+
+    start_qgis()
+    # Keep the benchmark's settings away from the user's QGIS profile
+    from qgis.PyQt.QtCore import QCoreApplication
+    QCoreApplication.setOrganizationName('AutoFilterBenchmark')
+    load_plugin()
+    from qgis.core import Qgis
+
+    results = {'qgis_version': Qgis.QGIS_VERSION, 'python': platform.python_version(), 'config': {
+        key: value for key, value in vars(args).items() if key not in ('output', 'keep')}, 'results': []}
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = args.keep or temporary
+        for provider in args.providers.split(','):
+            results['results'].extend(bench_provider(args, provider.strip(), directory))
+    write_json(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the streaming value importer with the former pandas import.
+
+Synthetic CSV and XLSX files of --rows rows (a value column with --distinct
+distinct values plus --extra-columns filler columns) are written to a
+temporary directory. Each file is then read by:
+
+  - streaming: value_import.read_values(), as the Multi-Filter dialog does
+  - pandas: pd.read_excel(path, header=None) (pd.read_csv for CSV, which
+    read_excel cannot open), then the first column deduplicated
+
+Wall-clock time and peak traced allocations (tracemalloc, measured in a
+second run) are reported as JSON. openpyxl is needed for XLSX files,
+pandas for the pandas runs.
+
+    python benchmarks/bench_import.py [--rows 200000] [--output import.json]
+"""
+import argparse
+import csv
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import Timer, load_plugin, write_json  # noqa: E402
+
+
+def write_csv(path, rows, distinct, extra_columns):
+    with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        for row in range(rows):
+            writer.writerow([f'CAB-{row % distinct:06d}'] + [row * column for column in range(extra_columns)])
+
+
+def write_xlsx(path, rows, distinct, extra_columns):
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Values')
+    for row in range(rows):
+        worksheet.append([f'CAB-{row % distinct:06d}'] + [row * column for column in range(extra_columns)])
+    workbook.save(path)
+
+
+def pandas_values(path):
+    import pandas as pd
+    if path.endswith('.csv'):
+        data = pd.read_csv(path, header=None)
+    else:
+        data = pd.read_excel(path, header=None)
+    values = list(dict.fromkeys(str(value).strip() for value in data.iloc[:, 0].dropna()))
+    return [value for value in values if value]
+
+
+def measure(function, path):
+    """Return (milliseconds, peak MiB, number of values) for one import.
+
+    Time and memory are taken from separate runs, since tracing every
+    allocation slows the importers down.
+    """
+    gc.collect()
+    with Timer() as timer:
+        values = function(path)
+    gc.collect()
+    tracemalloc.start()
+    function(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return timer.ms, peak / 2 ** 20, len(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--distinct', type=int, default=5000)
+    parser.add_argument('--extra-columns', type=int, default=5)
+    parser.add_argument('--formats', default='csv,xlsx', help='comma-separated: csv, xlsx')
+    parser.add_argument('--output', help='JSON file to write (default: stdout)')
+    args = parser.parse_args()
+
+    value_import = __import__(load_plugin().__name__ + '.value_import', fromlist=['read_values'])
+    importers = {'streaming': lambda path: value_import.read_values(path)[0]}
+    try:
+        import pandas  # noqa: F401
+        importers['pandas'] = pandas_values
+    except ImportError:
+        pass
+
+    writers = {'csv': write_csv, 'xlsx': write_xlsx}
+    results = {'rows': args.rows, 'distinct': args.distinct, 'extra_columns': args.extra_columns, 'runs': []}
+    with tempfile.TemporaryDirectory() as directory:
+        for kind in args.formats.split(','):
+            path = os.path.join(directory, f'values.{kind}')
+            try:
+                writers[kind](path, args.rows, args.distinct, args.extra_columns)
+            except ImportError as e:
+                results['runs'].append({'format': kind, 'skipped': str(e)})
+                continue
+            for name, importer in importers.items():
+                ms, peak, count = measure(importer, path)
+                results['runs'].append({'format': kind, 'importer': name, 'ms': round(ms, 1),
+                                        'peak_mib': round(peak, 2), 'values': count,
+                                        'file_mib': round(os.path.getsize(path) / 2 ** 20, 2)})
+    write_json(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Measure what AutoFilter adds to QGIS startup and how long its dialogs take
+to open.
+
+In-process (default), under a headless QgsApplication with a mocked iface:
+plugin import, classFactory(), initGui(), and the first and reused opening
+of the Single-Filter and Multi-Filter dialogs. It also reports whether
+pandas was imported by any of these steps.
+
+With --qgis PATH, QGIS itself is also started --repeat times with and
+without plugins (--noplugins) and closed as soon as its main window is up,
+giving the end-to-end startup cost.
+
+    python benchmarks/bench_startup.py [--qgis /usr/bin/qgis] [--output startup.json]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import Timer, load_plugin, start_qgis, write_json  # noqa: E402
+
+# Script run by QGIS once started, closing it straight away
+EXIT_SCRIPT = """
+from qgis.PyQt.QtCore import QTimer
+from qgis.utils import iface
+QTimer.singleShot(0, iface.mainWindow().close)
+"""
+
+
+def time_qgis_startup(qgis, repeat, extra_args):
+    """Return startup times in milliseconds for repeat runs of QGIS."""
+    with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as script:
+        script.write(EXIT_SCRIPT)
+    times = []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([qgis, '--nologo', '--noversioncheck', *extra_args, '--code', script.name],
+                           check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append((time.perf_counter() - start) * 1000.0)
+    finally:
+        os.unlink(script.name)
+    return times
+
+
+def open_dialog(app, dialog):
+    """Show a dialog the way the plugin does, then hide it."""
+    dialog.prepare()
+    dialog.show()
+    app.processEvents()
+    dialog.hide()
+
+
+def time_in_process():
+    app = start_qgis(gui=True)
+    from qgis.testing.mocked import get_iface
+    iface = get_iface()
+    results = {}
+
+    with Timer() as timer:
+        package = load_plugin()
+        plugin_module = __import__(package.__name__ + '.AutoFilter', fromlist=['AutoFilter'])
+    results['import_ms'] = timer.ms
+
+    with Timer() as timer:
+        plugin = package.classFactory(iface)
+    results['class_factory_ms'] = timer.ms
+
+    with Timer() as timer:
+        plugin.initGui()
+    results['init_gui_ms'] = timer.ms
+    results['pandas_loaded_at_startup'] = 'pandas' in sys.modules
+
+    dialogs = __import__(package.__name__ + '.dialogs', fromlist=['SingleFilterDialog'])
+    for name, dialog_class in (('single', dialogs.SingleFilterDialog), ('multi', dialogs.MultiFilterDialog)):
+        with Timer() as timer:
+            dialog = dialog_class(plugin, iface.mainWindow())
+            open_dialog(app, dialog)
+        results[f'{name}_dialog_first_open_ms'] = timer.ms
+        reopen = []
+        for _ in range(10):
+            with Timer() as timer:
+                open_dialog(app, dialog)
+            reopen.append(timer.ms)
+        results[f'{name}_dialog_reopen_ms'] = statistics.median(reopen)
+        dialog.deleteLater()
+
+    plugin.unload()
+    del plugin_module
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--qgis', help='QGIS executable for end-to-end startup timings')
+    parser.add_argument('--repeat', type=int, default=5, help='QGIS starts per configuration')
+    parser.add_argument('--output', help='JSON file to write (default: stdout)')
+    args = parser.parse_args()
+
+    results = {'in_process': time_in_process()}
+    if args.qgis:
+        with_plugins = time_qgis_startup(args.qgis, args.repeat, [])
+        without_plugins = time_qgis_startup(args.qgis, args.repeat, ['--noplugins'])
+        results['qgis_startup'] = {
+            'with_plugins_ms': statistics.median(with_plugins),
+            'without_plugins_ms': statistics.median(without_plugins),
+            'plugin_cost_ms': statistics.median(with_plugins) - statistics.median(without_plugins),
+            'runs': args.repeat,
+        }
+    write_json(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
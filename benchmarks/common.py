@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the AutoFilter benchmarks.
+
+The benchmarks run under standalone PyQGIS. The plugin directory is imported
+as the AutoFilter package whatever the checkout is called.
+"""
+import importlib.util
+import json
+import os
+import sys
+import time
+
+# Directory holding the plugin's __init__.py
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_app = None
+
+
+def load_plugin(name='AutoFilter'):
+    """Import the plugin directory as a package and return it."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PLUGIN_DIR, '__init__.py'),
+                                                  submodule_search_locations=[PLUGIN_DIR])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def start_qgis(gui=False):
+    """Start (once) and return a headless QgsApplication."""
+    global _app
+    if _app is None:
+        if gui:
+            # Widgets need a platform plugin even without a display
+            os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from qgis.core import QgsApplication
+        _app = QgsApplication([], gui)
+        _app.initQgis()
+    return _app
+
+
+class Timer:
+    """Context manager measuring wall-clock time in milliseconds."""
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.ms = None
+        return self
+
+    def __exit__(self, *exc_info):
+        self.ms = (time.perf_counter() - self.start) * 1000.0
+        return False
+
+
+def write_json(results, path=None):
+    """Write benchmark results as JSON to a file, or to stdout."""
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if path:
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write(text + '\n')
+    else:
+        print(text)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic projects for the AutoFilter benchmarks.
+
+generate_project() writes (or, for memory layers, builds) a project of point
+layers whose schemas use the field aliases of the filter criteria. With the
+'rotate' schema each layer takes the next alias of every criterion, so all
+aliases appear across the project; 'first' always uses the first alias and
+'sparse' gives each layer a random half of the criteria.
+
+Shapefiles truncate field names to 10 characters, so long aliases do not
+match on that provider, as in real data.
+"""
+import os
+import random
+
+from qgis.PyQt.QtCore import QDate, QVariant
+from qgis.core import (QgsCoordinateReferenceSystem, QgsDataSourceUri, QgsFeature, QgsField, QgsFields,
+                       QgsGeometry, QgsPointXY, QgsProject, QgsVectorFileWriter, QgsVectorLayer, QgsWkbTypes)
+
+from common import load_plugin
+
+PROVIDERS = ('memory', 'gpkg', 'shapefile', 'spatialite')
+SCHEMAS = ('rotate', 'first', 'sparse')
+
+# Distribution of the synthetic values: features per cabinet and per route,
+# number of exchanges, and the values cycled through for the other criteria
+CABINET_SIZE = 10
+ROUTE_SIZE = 50
+EXCHANGE_COUNT = 20
+CONTRACTORS = ('Alpha', 'Beta', 'Gamma', 'Delta')
+DATA_PROVIDERS = ('Survey', 'Contractor', 'Office')
+COORDINATORS = ('North', 'South', 'East', 'West')
+
+# Criteria sharing their fields with another one
+SHARED_CRITERIA = ('Period Of Time',)
+
+WRITE_BATCH = 5000
+
+
+def layer_schema(criteria_fields, layer_number, schema, rng):
+    """Return {criterion: field name} for one layer."""
+    criteria = [criterion for criterion in criteria_fields if criterion not in SHARED_CRITERIA]
+    if schema == 'sparse':
+        criteria = rng.sample(criteria, max(1, len(criteria) // 2))
+    names = {}
+    for criterion in criteria:
+        aliases = criteria_fields[criterion]
+        names[criterion] = aliases[0] if schema == 'first' else aliases[layer_number % len(aliases)]
+    return names
+
+
+def layer_fields(names):
+    fields = QgsFields()
+    for criterion, name in names.items():
+        field_type = QVariant.Date if criterion == 'Date' else QVariant.String
+        fields.append(QgsField(name, field_type))
+    return fields
+
+
+def cabinet_value(number):
+    return f'CAB-{number:06d}'
+
+
+def feature_values(criterion, index, rng):
+    """Return the synthetic value of a criterion for the index-th feature."""
+    if criterion == 'Exchange':
+        return f'EX{index % EXCHANGE_COUNT:02d}'
+    if criterion == 'Route':
+        return f'R-{index // ROUTE_SIZE:05d}'
+    if criterion == 'Cabinet ID':
+        return cabinet_value(index // CABINET_SIZE)
+    if criterion == 'Data Provider':
+        return DATA_PROVIDERS[index % len(DATA_PROVIDERS)]
+    if criterion == 'Contractor':
+        return CONTRACTORS[index % len(CONTRACTORS)]
+    if criterion == 'Coordinator':
+        return COORDINATORS[index % len(COORDINATORS)]
+    if criterion == 'Rework':
+        return 'Yes' if rng.random() < 0.1 else 'No'
+    if criterion == 'Date':
+        return QDate(2023, 1, 1).addDays(index % 365)
+    return None
+
+
+def features(fields, names, count, rng):
+    """Yield count point features with values for every schema field."""
+    for index in range(count):
+        feature = QgsFeature(fields)
+        feature.setAttributes([feature_values(criterion, index, rng) for criterion in names])
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(44.0 + rng.random(), 33.0 + rng.random())))
+        yield feature
+
+
+def write_features(sink, iterable):
+    batch = []
+    for feature in iterable:
+        batch.append(feature)
+        if len(batch) == WRITE_BATCH:
+            sink.addFeatures(batch)
+            batch = []
+    if batch:
+        sink.addFeatures(batch)
+
+
+def generate_project(directory, layers=50, features_per_layer=1000, provider='gpkg', schema='rotate', seed=0):
+    """Build a project of synthetic layers and return it.
+
+    Data files go to directory, and unless the provider is 'memory' the
+    project is saved there as project.qgz.
+    """
+    load_plugin()
+    from AutoFilter.criteria import CRITERIA_FIELDS
+
+    if provider not in PROVIDERS:
+        raise ValueError(f'Unknown provider {provider}')
+    rng = random.Random(seed)
+    crs = QgsCoordinateReferenceSystem('EPSG:4326')
+    project = QgsProject()
+    project.setCrs(crs)
+    os.makedirs(directory, exist_ok=True)
+    database = os.path.join(directory, 'layers.gpkg' if provider == 'gpkg' else 'layers.sqlite')
+    map_layers = []
+
+    for number in range(layers):
+        name = f'layer_{number:03d}'
+        names = layer_schema(CRITERIA_FIELDS, number, schema, rng)
+        fields = layer_fields(names)
+        if provider == 'memory':
+            layer = QgsVectorLayer('Point?crs=EPSG:4326', name, 'memory')
+            layer.dataProvider().addAttributes(fields.toList())
+            layer.updateFields()
+            write_features(layer.dataProvider(), features(layer.fields(), names, features_per_layer, rng))
+            map_layers.append(layer)
+            continue
+
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.fileEncoding = 'UTF-8'
+        if provider == 'shapefile':
+            options.driverName = 'ESRI Shapefile'
+            path = os.path.join(directory, f'{name}.shp')
+        else:
+            options.driverName = 'GPKG' if provider == 'gpkg' else 'SQLite'
+            if provider == 'spatialite':
+                options.datasourceOptions = ['SPATIALITE=YES']
+            options.layerName = name
+            options.actionOnExistingFile = (QgsVectorFileWriter.CreateOrOverwriteLayer if os.path.exists(database)
+                                            else QgsVectorFileWriter.CreateOrOverwriteFile)
+            path = database
+        writer = QgsVectorFileWriter.create(path, fields, QgsWkbTypes.Point, crs, project.transformContext(), options)
+        if writer.hasError() != QgsVectorFileWriter.NoError:
+            raise RuntimeError(f'{name}: {writer.errorMessage()}')
+        write_features(writer, features(fields, names, features_per_layer, rng))
+        del writer  # Flush and close the file
+
+        if provider == 'shapefile':
+            layer = QgsVectorLayer(path, name, 'ogr')
+        elif provider == 'gpkg':
+            layer = QgsVectorLayer(f'{path}|layername={name}', name, 'ogr')
+        else:
+            uri = QgsDataSourceUri()
+            uri.setDatabase(path)
+            uri.setDataSource('', name, 'GEOMETRY')
+            layer = QgsVectorLayer(uri.uri(), name, 'spatialite')
+        if not layer.isValid():
+            raise RuntimeError(f'{name}: the generated layer cannot be opened')
+        map_layers.append(layer)
+
+    project.addMapLayers(map_layers)
+    if provider != 'memory':
+        project.write(os.path.join(directory, 'project.qgz'))
+    return project
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Cascading filters: carry a filter over to linked layers through key columns.
+
+ Layers are linked by project relations (referenced layer to referencing
+ layer) and by the fields of the cascade criteria of the schema, such as
+ "Cabinet ID": a filtered layer carrying one of those fields passes its key
+ values on to every unfiltered layer carrying one too.
+"""
+from qgis.PyQt.QtCore import QSettings
+from qgis.core import Qgis, QgsFeatureRequest, QgsMessageLog, QgsTask
+
+from .criteria import EQUALS_TEMPLATE, NO_MATCH, SCHEMA, field_kind, typed_value
+from .layer_sources import TaskSet, open_reader, reader_source
+from .profiler import LOG_TAG
+from .sql_dialect import dialect_for
+from .value_catalog import catalog_text
+
+# QSettings key for cascading filters to linked layers
+CASCADE_SETTING = 'AutoFilter/cascade_filters'
+
+
+def key_expression(fields, field_names, keys, dialect):
+    """Return the subset string keeping the features whose key is in keys."""
+    parts = []
+    for name in field_names:
+        index = fields.indexOf(name)
+        kind = field_kind(fields.at(index)) if index >= 0 else 'text'
+        typed = sorted({value for value in (typed_value(kind, key) for key in keys) if value is not None})
+        if not typed:
+            continue
+        column = dialect.column(name)
+        if len(typed) == 1:
+            parts.append(EQUALS_TEMPLATE.format(field=column, value=dialect.literal(kind, typed[0])))
+        else:
+            parts.append(dialect.membership(column, kind, typed))
+    return ' OR '.join(parts) if parts else NO_MATCH
+
+
+class CascadeTask(QgsTask):
+    """Follow the links from the filtered layers, one level at a time.
+
+    Every parent layer is read once, without geometry and with only its key
+    fields, on a provider of the task's own with its new subset string set;
+    its keys are gathered into hash sets and turn into the filters of its
+    unfiltered children, which are the parents of the next level. No layer
+    is read or filtered twice.
+    """
+
+    def __init__(self, description, plan, layers, links, callback=None):
+        super().__init__(description, QgsTask.CanCancel)
+        # Subset strings of the layers filtered by the user
+        self.plan = plan
+        # layer id -> (reader source, QgsFields, dialect)
+        self.layers = layers
+        # parent id -> [(parent fields, child id, child fields)]
+        self.links = links
+        self.callback = callback
+        # Subset strings and native ids of the linked layers
+        self.children = {}
+        self.native = set()
+        # Layers read and key values gathered, for the message log
+        self.scanned = 0
+        self.keys = 0
+
+    def run(self):
+        filtered = dict(self.plan)
+        frontier = [layer_id for layer_id in self.plan if layer_id in self.links]
+        while frontier:
+            # child id -> child fields -> keys of every parent linked to it
+            keys = {}
+            for parent_id in frontier:
+                links = [link for link in self.links.get(parent_id, []) if link[1] not in filtered]
+                if not links:
+                    continue
+                values = self.read_keys(parent_id, filtered[parent_id], {field for fields, _child, _ in links for field in fields})
+                if values is None:
+                    return False
+                for parent_fields, child_id, child_fields in links:
+                    child_keys = keys.setdefault(child_id, {}).setdefault(tuple(child_fields), set())
+                    for field in parent_fields:
+                        child_keys.update(values[field])
+
+            # Filter every child on the keys of all its parents
+            frontier = []
+            for child_id, by_fields in keys.items():
+                _source, fields, dialect = self.layers[child_id]
+                parts = [key_expression(fields, child_fields, child_keys, dialect)
+                         for child_fields, child_keys in by_fields.items()]
+                self.keys += sum(len(child_keys) for child_keys in by_fields.values())
+                expression = parts[0] if len(parts) == 1 else ' OR '.join(f'({part})' for part in parts)
+                filtered[child_id] = self.children[child_id] = expression
+                if dialect.native:
+                    self.native.add(child_id)
+                frontier.append(child_id)
+        return True
+
+    def read_keys(self, layer_id, expression, field_names):
+        """Return {field: set of key texts} of the features matching expression, or None."""
+        source, _fields, _dialect = self.layers[layer_id]
+        values = {field: set() for field in field_names}
+        provider = open_reader(source, expression)
+        if provider is None:
+            # An unreadable parent passes no keys on
+            return values
+        request = QgsFeatureRequest()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes(sorted(field_names), provider.fields())
+        indexes = [(field, provider.fields().lookupField(field)) for field in field_names]
+        for count, feature in enumerate(provider.getFeatures(request), 1):
+            if count % 1000 == 0 and self.isCanceled():
+                return None
+            for field, index in indexes:
+                text = catalog_text(feature.attribute(index))
+                if text is not None:
+                    values[field].add(text)
+        self.scanned += 1
+        return values
+
+    def finished(self, result):
+        if self.callback:
+            self.callback(self, result)
+
+
+class Cascade:
+    """Extend filter plans to the layers linked to the filtered ones."""
+
+    def __init__(self, field_index, project):
+        self.field_index = field_index
+        self.project = project
+        # Incremented by every expansion so superseded ones are dropped
+        self.generation = 0
+        self.tasks = TaskSet()
+
+    @property
+    def enabled(self):
+        return QSettings().value(CASCADE_SETTING, False, type=bool)
+
+    @enabled.setter
+    def enabled(self, enabled):
+        QSettings().setValue(CASCADE_SETTING, bool(enabled))
+
+    def links(self):
+        """Return {parent id: [(parent fields, child id, child fields)]} for the project."""
+        links = {}
+
+        def add(parent_id, parent_fields, child_id, child_fields):
+            if parent_id != child_id and parent_fields and child_fields:
+                links.setdefault(parent_id, []).append((list(parent_fields), child_id, list(child_fields)))
+
+        # Project relations lead from the referenced layer to the referencing one
+        for relation in self.project.relationManager().relations().values():
+            if not relation.isValid():
+                continue
+            pairs = relation.fieldPairs()
+            if len(pairs) != 1:
+                # Composite keys are not followed
+                continue
+            (child_field, parent_field), = pairs.items()
+            add(relation.referencedLayerId(), [parent_field], relation.referencingLayerId(), [child_field])
+
+        # Cascade criteria link every pair of layers carrying their fields
+        for criterion in SCHEMA.cascade:
+            carriers = self.field_index.layers_for(criterion)
+            for parent, parent_fields in carriers:
+                for child, child_fields in carriers:
+                    add(parent.id(), parent_fields, child.id(), child_fields)
+        return links
+
+    def expand(self, plan, on_ready):
+        """Gather the filters of the layers linked to a plan in the background.
+
+        Calls on_ready(child plan, child native ids) on the main thread,
+        with an empty child plan if the task fails, unless a newer
+        expansion or cancel() supersedes this one.
+        """
+        self.cancel()
+        links = self.links()
+        layers = {}
+        for layer_id in set(links) | {child_id for targets in links.values() for _, child_id, _ in targets}:
+            layer = self.project.mapLayer(layer_id)
+            if layer is None:
+                continue
+            layers[layer_id] = (reader_source(layer), layer.fields(), dialect_for(layer))
+        links = {parent_id: [link for link in targets if link[1] in layers]
+                 for parent_id, targets in links.items() if parent_id in layers}
+        if not any(layer_id in links for layer_id in plan):
+            on_ready({}, set())
+            return
+
+        def done(task, result):
+            self.tasks.discard(task)
+            if task.generation != self.generation:
+                return
+            if not result:
+                # Failed, or cancelled from the task manager: the plan goes on without linked layers
+                QgsMessageLog.logMessage('Cascade: linked layers could not be read, none were filtered',
+                                         LOG_TAG, Qgis.Warning)
+                on_ready({}, set())
+                return
+            QgsMessageLog.logMessage(f'Cascade: read {task.scanned} layers, {task.keys} keys, '
+                                     f'filtered {len(task.children)} linked layers', LOG_TAG, Qgis.Info)
+            on_ready(task.children, task.native)
+
+        task = CascadeTask('AutoFilter: Cascade to linked layers', dict(plan), layers, links, done)
+        task.generation = self.generation
+        self.tasks.start(task)
+
+    def cancel(self):
+        """Cancel the expansions still running; their plans are dropped."""
+        self.generation += 1
+        self.tasks.cancel_all()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Filter criteria and the layer fields each of them is matched against.
+
+ The criteria are declared in criteria.json next to this file, or in the
+ JSON or YAML file named by the AUTOFILTER_CRITERIA environment variable,
+ and compiled once into typed expression templates.
+"""
+import datetime
+import json
+import os.path
+
+from qgis.PyQt.QtCore import QVariant
+
+from .sql_dialect import EXPRESSION_DIALECT
+
+# Environment variable naming a criteria file to use instead of criteria.json
+CRITERIA_ENV = 'AUTOFILTER_CRITERIA'
+DEFAULT_CRITERIA_FILE = os.path.join(os.path.dirname(__file__), 'criteria.json')
+
+VALUE_TYPES = ('text', 'int', 'date')
+OPERATORS = ('equals', 'between')
+
+# Expression templates, filled with quoted column references and literals
+EQUALS_TEMPLATE = '{field} = {value}'
+BETWEEN_TEMPLATE = '{field} BETWEEN {low} AND {high}'
+RANGE_TEMPLATE = '({field} >= {low} AND {field} < {high})'
+
+# Filter matching nothing, for layers where no value fits the field type
+NO_MATCH = '1 = 0'
+
+INTEGER_TYPES = (QVariant.Int, QVariant.UInt, QVariant.LongLong, QVariant.ULongLong)
+
+
+def parse_date(value):
+    """Return a datetime.date for an ISO date (or date-time) value, or None."""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return datetime.date.fromisoformat(str(value).strip()[:10])
+    except ValueError:
+        return None
+
+
+def parse_int(value):
+    """Return an int for an integral value, or None."""
+    text = str(value).strip()
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        number = float(text)
+    except ValueError:
+        return None
+    return int(number) if number.is_integer() else None
+
+
+def field_kind(field):
+    """Return 'int', 'real', 'date', 'datetime' or 'text' for a QgsField."""
+    if field.type() in INTEGER_TYPES:
+        return 'int'
+    if field.isNumeric():
+        return 'real'
+    if field.type() == QVariant.Date:
+        return 'date'
+    if field.type() == QVariant.DateTime:
+        return 'datetime'
+    return 'text'
+
+
+def typed_value(kind, value):
+    """Return a value converted for a field kind, or None if it cannot match."""
+    if kind == 'int':
+        return parse_int(value)
+    if kind == 'real':
+        try:
+            return float(str(value).strip())
+        except ValueError:
+            return None
+    if kind in ('date', 'datetime'):
+        return parse_date(value)
+    return str(value)
+
+
+class Criterion:
+    """One filter criterion: its field aliases, value type and operator."""
+
+    def __init__(self, name, fields, value_type='text', operator='equals', choices=None):
+        if not fields:
+            raise ValueError(f'Criterion "{name}" has no fields')
+        if value_type not in VALUE_TYPES:
+            raise ValueError(f'Criterion "{name}": unknown type "{value_type}"')
+        if operator not in OPERATORS:
+            raise ValueError(f'Criterion "{name}": unknown operator "{operator}"')
+        self.name = name
+        self.fields = list(fields)
+        self.value_type = value_type
+        self.operator = operator
+        self.choices = list(choices) if choices else None
+
+    @property
+    def is_range(self):
+        return self.operator == 'between'
+
+    def check(self, values):
+        """Return an error message for values this criterion rejects, or None."""
+        if self.is_range and len(values) != 2:
+            return f'"{self.name}" takes a start and an end date.'
+        for value in values:
+            if self.choices and value not in self.choices:
+                return 'Please enter ' + ' or '.join(f'"{choice}"' for choice in self.choices) + f' for the "{self.name}" field.'
+            if self.value_type == 'date' and parse_date(value) is None:
+                return f'"{value}" is not a date (YYYY-MM-DD).'
+            if self.value_type == 'int' and parse_int(value) is None:
+                return f'"{value}" is not a whole number.'
+        return None
+
+    def expression(self, layer_fields, field_names, values, dialect=EXPRESSION_DIALECT):
+        """Return the subset string matching values on the given fields of a layer.
+
+        Literals are typed by each field's type so providers compare
+        without casting every row; values that cannot fit a field are left
+        out for that field. dialect gives the quoting and set membership
+        syntax (QGIS expressions by default, see sql_dialect).
+        """
+        parts = []
+        for name in field_names:
+            index = layer_fields.indexOf(name)
+            kind = field_kind(layer_fields.at(index)) if index >= 0 else 'text'
+            part = self.field_expression(dialect.column(name), kind, values, dialect)
+            if part:
+                parts.append(part)
+        return ' OR '.join(parts) if parts else NO_MATCH
+
+    def field_expression(self, field, kind, values, dialect=EXPRESSION_DIALECT):
+        def literal(value):
+            return dialect.literal(kind, value)
+
+        typed = [typed_value(kind, value) for value in values]
+        if self.is_range:
+            if None in typed:
+                return None
+            # Bounds are put in order whichever date was entered first
+            low, high = sorted(typed)
+            if kind == 'datetime':
+                return RANGE_TEMPLATE.format(field=field, low=literal(low), high=literal(high + datetime.timedelta(days=1)))
+            return BETWEEN_TEMPLATE.format(field=field, low=literal(low), high=literal(high))
+        typed = list(dict.fromkeys(value for value in typed if value is not None))
+        if not typed:
+            return None
+        if kind == 'datetime':
+            # A date matches the whole day of a date-time field
+            return ' OR '.join(RANGE_TEMPLATE.format(field=field, low=literal(day), high=literal(day + datetime.timedelta(days=1)))
+                               for day in typed)
+        if len(typed) == 1:
+            return EQUALS_TEMPLATE.format(field=field, value=literal(typed[0]))
+        return dialect.membership(field, kind, typed)
+
+
+class CriteriaSchema:
+    """Every criterion of a criteria file, the Multi-Filter labels and the cascade keys."""
+
+    def __init__(self, criteria, multi_filter, cascade=()):
+        self.criteria = {criterion.name: criterion for criterion in criteria}
+        for label, name in multi_filter.items():
+            if name not in self.criteria:
+                raise ValueError(f'Multi-Filter label "{label}" refers to unknown criterion "{name}"')
+        self.multi_filter = dict(multi_filter)
+        for name in cascade:
+            if name not in self.criteria:
+                raise ValueError(f'Cascade key "{name}" is not a criterion')
+        # Criteria whose fields link layers for cascading filters
+        self.cascade = list(cascade)
+
+    def __getitem__(self, name):
+        return self.criteria[name]
+
+    def resolve(self, name):
+        """Return the criterion of a name or Multi-Filter label, or None."""
+        return self.criteria.get(self.multi_filter.get(name, name))
+
+
+def read_config(path):
+    """Read a JSON or YAML criteria file."""
+    with open(path, encoding='utf-8') as config_file:
+        if path.lower().endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f'PyYAML is needed to read {path}')
+            return yaml.safe_load(config_file)
+        return json.load(config_file)
+
+
+def load_schema(path=None):
+    """Load and compile a criteria file (the configured one by default)."""
+    path = path or os.environ.get(CRITERIA_ENV) or DEFAULT_CRITERIA_FILE
+    config = read_config(path)
+    try:
+        criteria = [Criterion(item['name'], item['fields'], item.get('type', 'text'), item.get('operator', 'equals'),
+                              item.get('choices')) for item in config['criteria']]
+    except KeyError as e:
+        raise ValueError(f'{path}: every criterion needs a {e}')
+    return CriteriaSchema(criteria, config.get('multi_filter', {}), config.get('cascade', []))
+
+
+SCHEMA = load_schema()
+
+# Field aliases checked for each Single-Filter criterion, in priority order
+CRITERIA_FIELDS = {name: criterion.fields for name, criterion in SCHEMA.criteria.items()}
+
+# Criteria offered by the Single-Filter dialog
+SINGLE_FILTER_CRITERIA = list(CRITERIA_FIELDS)
+
+# Multi-Filter labels and the criterion whose fields they filter
+MULTI_FILTER_CRITERIA = SCHEMA.multi_filter
+
+# Date criteria, entered with date pickers rather than typed values
+DATE_CRITERIA = tuple(name for name, criterion in SCHEMA.criteria.items() if criterion.value_type == 'date')
@@ -0,0 +1,711 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Filter and export dialogs, built once and reused.
+"""
+import os.path
+
+from qgis.PyQt.QtCore import Qt, QDate, QStringListModel, QTimer
+from qgis.PyQt.QtWidgets import QMessageBox, QVBoxLayout, QHBoxLayout, QLabel, QDialog, QComboBox, QLineEdit, QPushButton, QDateEdit, QFileDialog, QCompleter, QInputDialog, QApplication, QCheckBox, QWidget, QDoubleSpinBox
+from qgis.core import QgsProject
+
+from .criteria import SCHEMA, SINGLE_FILTER_CRITERIA, MULTI_FILTER_CRITERIA
+from .export import layers_reading
+from .match_preview import MatchPreviewWidget, input_key
+from .profiler import SlowLayersWidget
+from .live_filter import LIVE_FILTER_DELAY_MS
+from .value_import import SPREADSHEET_FILTER, column_label, header_row, read_values, sheet_names
+
+# Number of value line edits in the Multi-Filter dialog
+MULTI_FILTER_INPUTS = 30
+
+# Number of criterion rows in the Composite Filter dialog
+COMPOSITE_FILTER_ROWS = 6
+
+# Values listed when Multi-Filter values exist in no layer
+MISSING_VALUES_SHOWN = 20
+
+
+def catalog_completer(catalog, parent, line_edit, criterion):
+    """Build a completer fed from the value catalog by prefix search."""
+    completer = QCompleter(parent)
+    completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+    model = QStringListModel(completer)
+    completer.setModel(model)
+    line_edit.textEdited.connect(lambda text: model.setStringList(catalog.complete(criterion(), text)))
+    return completer
+
+
+class SingleFilterDialog(QDialog):
+    """Dialog choosing one criterion and one value (or date range)."""
+
+    def __init__(self, plugin, parent=None):
+        super().__init__(parent)
+        self.plugin = plugin
+        # Value read when the dialog was accepted
+        self.filter_value = None
+        self.setWindowTitle('Select Filter Criteria')
+
+        # Create a combo box for choosing filter criteria
+        self.combo_box = QComboBox(self)
+        self.combo_box.addItems(SINGLE_FILTER_CRITERIA)
+        self.combo_box.setEditable(False)
+        self.combo_box.setCurrentIndex(0)
+
+        # Create a QLineEdit for entering the filter value
+        self.value_input = QLineEdit(self)
+
+        # Offer catalogued values of the selected criterion as the user types
+        self.value_input.setCompleter(catalog_completer(plugin.value_catalog, self, self.value_input, self.criterion))
+
+        # Create a QDateEdit widget for entering the date
+        self.date_input = QDateEdit(QDate.currentDate(), self)
+        self.date_input.setCalendarPopup(True)
+        self.date_input.setDateRange(QDate(1900, 1, 1), QDate.currentDate())
+
+        # Create a QDateEdit widget for entering the start date
+        self.start_date_input = QDateEdit(QDate.currentDate(), self)
+        self.start_date_input.setCalendarPopup(True)
+        self.start_date_input.setDateRange(QDate(1900, 1, 1), QDate.currentDate())
+
+        # Create a QDateEdit widget for entering the end date
+        self.end_date_input = QDateEdit(QDate.currentDate(), self)
+        self.end_date_input.setCalendarPopup(True)
+        self.end_date_input.setDateRange(QDate(1900, 1, 1), QDate.currentDate())
+
+        # Connect the combo_box's currentIndexChanged signal to the update_input_widgets function
+        self.combo_box.currentIndexChanged.connect(self.update_input_widgets)
+
+        # Live mode: filter the map shortly after the input stops changing
+        self.live_checkbox = QCheckBox('Live filter (update the map while typing)', self)
+        self.live_checkbox.setChecked(plugin.live_filter.enabled)
+        self.live_checkbox.toggled.connect(self.toggle_live)
+        self.live_timer = QTimer(self)
+        self.live_timer.setSingleShot(True)
+        self.live_timer.setInterval(LIVE_FILTER_DELAY_MS)
+        self.live_timer.timeout.connect(self.apply_live)
+        self.combo_box.currentIndexChanged.connect(self.input_changed)
+        self.value_input.textEdited.connect(self.input_changed)
+        for date_input in (self.date_input, self.start_date_input, self.end_date_input):
+            date_input.dateChanged.connect(self.input_changed)
+
+        # Add a label below the combo box
+        label = QLabel('Powered By © Hasan Sami', self)
+        label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+
+        # Create a QPushButton for confirming the filter
+        self.confirm_button = QPushButton('OK', self)
+        self.confirm_button.clicked.connect(self.confirm)
+
+        # Preview of the number of matches per layer
+        self.preview = MatchPreviewWidget(plugin.field_index, self.preview_plan, self)
+
+        # Slowest layers of the last filter operation
+        self.slow_layers = SlowLayersWidget(self)
+
+        # Create a layout for the dialog
+        layout = QVBoxLayout()
+        layout.addWidget(self.combo_box)
+        layout.addWidget(self.value_input)
+        layout.addWidget(self.end_date_input)
+        layout.addWidget(self.start_date_input)
+        layout.addWidget(self.date_input)
+        layout.addWidget(self.live_checkbox)
+        layout.addWidget(self.preview)
+        layout.addWidget(self.slow_layers)
+        layout.addWidget(self.confirm_button)
+        layout.addWidget(label)
+
+        # Set the layout for the dialog
+        self.setLayout(layout)
+
+        # Set the initial visibility based on the default selection
+        self.update_input_widgets()
+
+    def criterion(self):
+        return self.combo_box.currentText()
+
+    def prepare(self):
+        """Reset per-use state before the dialog is shown again."""
+        self.filter_value = None
+        self.preview.reset()
+        self.slow_layers.show_profile(self.plugin.filter_engine.last_profile)
+        self.update_input_widgets()
+
+    def update_input_widgets(self):
+        # Update the visibility of input widgets based on combo_box selection
+        selected_criteria = self.combo_box.currentText()
+        criterion = SCHEMA[selected_criteria]
+        if criterion.value_type == 'date' and not criterion.is_range:
+            self.value_input.hide()
+            self.start_date_input.hide()
+            self.end_date_input.hide()
+            self.date_input.show()
+        elif criterion.value_type == 'date':
+            self.value_input.hide()
+            self.start_date_input.show()
+            self.end_date_input.show()
+            self.date_input.hide()
+        else:
+            self.value_input.show()
+            self.start_date_input.hide()
+            self.end_date_input.hide()
+            self.date_input.hide()
+            self.value_input.setPlaceholderText(f'Enter {selected_criteria}')
+            # Collect the criterion's distinct values in the background
+            self.plugin.value_catalog.prepare(selected_criteria)
+
+    def read_filter_value(self, quiet=False):
+        """Read and check the filter value entered in the dialog, or None.
+
+        With quiet, invalid input returns None without a warning.
+        """
+        def warn(message):
+            if not quiet:
+                QMessageBox.warning(None, 'Warning', message)
+
+        filter_criteria = self.combo_box.currentText()
+        criterion = SCHEMA[filter_criteria]
+        if criterion.value_type == 'date' and not criterion.is_range:
+            value_to_filter = self.date_input.date().toString("yyyy-MM-dd")
+            values = [value_to_filter]
+        elif criterion.value_type == 'date':
+            start_date = self.start_date_input.date().toString("yyyy-MM-dd")
+            end_date = self.end_date_input.date().toString("yyyy-MM-dd")
+            if not start_date or not end_date:
+                warn(f'Please select both start and end dates for the "{filter_criteria}" filter.')
+                return None
+            value_to_filter = values = [start_date, end_date]
+        else:
+            value_to_filter = self.value_input.text().strip()
+            if not value_to_filter:
+                warn('Please enter a value for the filter field.')
+                return None
+            values = [value_to_filter]
+
+        # Type and choices declared for the criterion in the schema
+        error = criterion.check(values)
+        if error:
+            warn(error)
+            return None
+        if criterion.value_type != 'date' and self.plugin.value_catalog.contains(filter_criteria, value_to_filter) is False:
+            warn(f'No layer has the {filter_criteria} "{value_to_filter}".')
+            return None
+        return value_to_filter
+
+    def toggle_live(self, checked):
+        # Remember the live mode and filter the current input straight away
+        self.plugin.live_filter.enabled = checked
+        if checked:
+            self.input_changed()
+        else:
+            self.stop_live()
+
+    def input_changed(self, *args):
+        # Every change cancels the live filter in flight and restarts the delay
+        if not self.live_checkbox.isChecked():
+            return
+        self.plugin.live_filter.cancel()
+        self.live_timer.start()
+
+    def apply_live(self):
+        # Filter the visible layers with the current input, if it is valid
+        value_to_filter = self.read_filter_value(quiet=True)
+        if value_to_filter is None:
+            return
+        plan, native = self.plugin.single_filter_plan(self.criterion(), value_to_filter)
+        self.plugin.live_filter.preview(plan, native)
+
+    def stop_live(self):
+        """Stop the pending and in-flight live filter."""
+        self.live_timer.stop()
+        self.plugin.live_filter.cancel()
+
+    def preview_plan(self):
+        # Plan of the current input for the match-count preview
+        value_to_filter = self.read_filter_value()
+        if value_to_filter is None:
+            return None
+        plan, _native = self.plugin.single_filter_plan(self.criterion(), value_to_filter)
+        return plan, self.criterion(), input_key(self.criterion(), value_to_filter)
+
+    def confirm(self):
+        # Close the dialog only once the input is valid
+        self.filter_value = self.read_filter_value()
+        if self.filter_value is not None:
+            self.accept()
+
+
+class MultiFilterDialog(QDialog):
+    """Dialog choosing one criterion and a list of values."""
+
+    def __init__(self, plugin, parent=None):
+        super().__init__(parent)
+        self.plugin = plugin
+        # Values read when the dialog was accepted
+        self.filter_values = None
+        self.setWindowTitle('Multi-Filter')
+
+        # Create a combo box for choosing filter criteria
+        self.combo_box = QComboBox(self)
+        self.combo_box.addItems(list(MULTI_FILTER_CRITERIA))
+        self.combo_box.setEditable(False)
+        self.combo_box.setCurrentIndex(0)
+
+        # Create a label for choosing the number of values
+        num_values_label = QLabel('Number of Values:', self)
+
+        # Create a combo box for choosing the number of values
+        self.num_values_combo = QComboBox(self)
+        self.num_values_combo.addItems([str(number) for number in range(2, MULTI_FILTER_INPUTS + 1)])
+        self.num_values_combo.setEditable(False)
+        self.num_values_combo.setCurrentIndex(0)
+
+        # Create a list of line edit widgets for entering filter values
+        self.value_inputs = [QLineEdit(self) for _ in range(MULTI_FILTER_INPUTS)]
+
+        # Offer catalogued values of the selected criterion as the user types
+        for value_input in self.value_inputs:
+            value_input.setCompleter(catalog_completer(plugin.value_catalog, self, value_input, self.criterion))
+        self.combo_box.currentIndexChanged.connect(lambda _index: plugin.value_catalog.prepare(self.criterion()))
+
+        # Values imported from a file too long for the line edits
+        self.imported_values = []
+        self.imported_label = QLabel(self)
+        self.imported_label.hide()
+
+        # Create a QLabel for the powered by message
+        powered_by_label = QLabel('Powered By © Hasan Sami', self)
+        powered_by_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+
+        # Create a QPushButton for confirming the multi-filter
+        self.confirm_button = QPushButton('OK', self)
+        self.confirm_button.clicked.connect(self.confirm)
+
+        # Create a QPushButton for importing values from Excel
+        import_excel_button = QPushButton('Import Values from Excel', self)
+        import_excel_button.clicked.connect(self.import_values_from_excel)
+
+        # Preview of the number of matches per layer
+        self.preview = MatchPreviewWidget(plugin.field_index, self.preview_plan, self)
+
+        # Slowest layers of the last filter operation
+        self.slow_layers = SlowLayersWidget(self)
+
+        # Create a layout for the dialog
+        layout = QVBoxLayout()
+        layout.addWidget(self.combo_box)
+        layout.addWidget(num_values_label)
+        layout.addWidget(self.num_values_combo)
+        for value_input in self.value_inputs:
+            layout.addWidget(value_input)
+        layout.addWidget(self.imported_label)
+        layout.addWidget(import_excel_button)  # Add the import Excel button
+        layout.addWidget(self.preview)
+        layout.addWidget(self.slow_layers)
+        layout.addWidget(self.confirm_button)
+        layout.addWidget(powered_by_label)  # Add the powered by label
+
+        # Set the layout for the dialog
+        self.setLayout(layout)
+
+        # Connect the num_values_combo's currentIndexChanged signal to the update_value_inputs function
+        self.num_values_combo.currentIndexChanged.connect(self.update_value_inputs)
+
+        # Set the initial visibility based on the default selection
+        self.update_value_inputs()
+
+    def criterion(self):
+        return MULTI_FILTER_CRITERIA[self.combo_box.currentText()]
+
+    def prepare(self):
+        """Reset per-use state before the dialog is shown again."""
+        self.filter_values = None
+        self.preview.reset()
+        self.slow_layers.show_profile(self.plugin.filter_engine.last_profile)
+        self.plugin.value_catalog.prepare(self.criterion())
+
+    def update_value_inputs(self):
+        # Typing values by hand replaces any imported list
+        self.imported_values.clear()
+        self.imported_label.hide()
+        # Update the visibility of value input widgets based on the selected number of values
+        num_values = int(self.num_values_combo.currentText())
+        for i, input_widget in enumerate(self.value_inputs):
+            input_widget.setVisible(i < num_values)
+
+    def import_values_from_excel(self):
+        file_dialog = QFileDialog.getOpenFileName(self, 'Select Excel File', '', SPREADSHEET_FILTER)[0]
+        if not file_dialog:
+            return
+
+        try:
+            # Let the user pick the sheet and column when there is a choice
+            sheet = None
+            sheets = sheet_names(file_dialog)
+            if len(sheets) > 1:
+                sheet, ok = QInputDialog.getItem(self, 'Import Values', 'Sheet:', sheets, 0, False)
+                if not ok:
+                    return
+            column = 0
+            header = header_row(file_dialog, sheet)
+            if len(header) > 1:
+                columns = [f'{column_label(i)}: {text}' for i, text in enumerate(header)]
+                choice, ok = QInputDialog.getItem(self, 'Import Values', 'Column:', columns, 0, False)
+                if not ok:
+                    return
+                column = columns.index(choice)
+
+            # Rows are streamed; only the distinct values are kept
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                values, _ = read_values(file_dialog, column, sheet)
+            finally:
+                QApplication.restoreOverrideCursor()
+            num_rows = len(values)
+
+            if num_rows > len(self.value_inputs):
+                # Too many values for the line edits: keep the list aside
+                for input_widget in self.value_inputs:
+                    input_widget.hide()
+                self.imported_values[:] = values
+                self.imported_label.setText(f'{num_rows} values imported from {os.path.basename(file_dialog)}')
+                self.imported_label.show()
+                return
+
+            self.num_values_combo.setCurrentIndex(max(num_rows - 2, 0))  # Set the combo box to the number of rows minus 2 (to account for 2 as the minimum)
+
+            for i, value_input in enumerate(self.value_inputs):
+                if i < num_rows:
+                    value_input.setText(values[i])
+
+        except Exception as e:
+            QMessageBox.warning(None, 'Error', f'An error occurred while importing values from Excel: {str(e)}')
+
+    def read_filter_values(self, confirm=False):
+        """Read and check the values entered in the dialog, or None.
+
+        Values no layer carries are dropped once the catalog is complete;
+        with confirm, the user is shown them and may go back instead.
+        """
+        filter_criteria = self.combo_box.currentText()
+        num_values = int(self.num_values_combo.currentText())
+        values = list(self.imported_values) or [value_input.text() for value_input in self.value_inputs[:num_values]]
+        values = list(dict.fromkeys(value.strip() for value in values if value.strip()))
+        if not values:
+            QMessageBox.warning(None, 'Warning', 'Please enter at least one value for the filter.')
+            return None
+        criterion = self.criterion()
+        error = SCHEMA[criterion].check(values)
+        if error:
+            QMessageBox.warning(None, 'Warning', error)
+            return None
+
+        # Drop values that no layer carries, once the catalog is complete
+        missing = self.plugin.value_catalog.missing(criterion, values)
+        if missing:
+            if len(missing) == len(values):
+                QMessageBox.warning(None, 'Warning', f'None of the values exist in any {filter_criteria} field.')
+                return None
+            if confirm:
+                shown = ', '.join(missing[:MISSING_VALUES_SHOWN])
+                if len(missing) > MISSING_VALUES_SHOWN:
+                    shown += f' and {len(missing) - MISSING_VALUES_SHOWN} more'
+                answer = QMessageBox.question(
+                    self, 'Values Not Found',
+                    f'{len(missing)} of the {len(values)} values exist in no {filter_criteria} field and will be left out:\n'
+                    f'{shown}\n\nFilter by the other {len(values) - len(missing)} values?')
+                if answer != QMessageBox.Yes:
+                    return None
+            missing = set(missing)
+            values = [value for value in values if value not in missing]
+        return values
+
+    def preview_plan(self):
+        # Plan of the current input for the match-count preview
+        values = self.read_filter_values()
+        if values is None:
+            return None
+        plan, _native = self.plugin.multi_filter_plan(self.criterion(), values, preview=True)
+        return plan, self.criterion(), input_key(self.criterion(), values)
+
+    def confirm(self):
+        # Close the dialog only once the input is valid and dropped values are agreed to
+        self.filter_values = self.read_filter_values(confirm=True)
+        if self.filter_values is not None:
+            self.accept()
+
+
+class CriterionRow(QWidget):
+    """One criterion of the Composite Filter dialog and its value(s)."""
+
+    def __init__(self, plugin, parent=None):
+        super().__init__(parent)
+        self.plugin = plugin
+
+        # Create a combo box for choosing the criterion
+        self.combo_box = QComboBox(self)
+        self.combo_box.addItems(SINGLE_FILTER_CRITERIA)
+        self.combo_box.setEditable(False)
+
+        # Comma-separated values for text and number criteria
+        self.value_input = QLineEdit(self)
+        self.value_input.setCompleter(catalog_completer(plugin.value_catalog, self, self.value_input, self.criterion))
+
+        # A date, or the start and end of a period
+        self.start_date_input = QDateEdit(QDate.currentDate(), self)
+        self.start_date_input.setCalendarPopup(True)
+        self.start_date_input.setDateRange(QDate(1900, 1, 1), QDate.currentDate())
+        self.end_date_input = QDateEdit(QDate.currentDate(), self)
+        self.end_date_input.setCalendarPopup(True)
+        self.end_date_input.setDateRange(QDate(1900, 1, 1), QDate.currentDate())
+
+        self.combo_box.currentIndexChanged.connect(self.update_input_widgets)
+
+        layout = QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.combo_box)
+        layout.addWidget(self.value_input)
+        layout.addWidget(self.start_date_input)
+        layout.addWidget(self.end_date_input)
+        self.setLayout(layout)
+        self.update_input_widgets()
+
+    def criterion(self):
+        return self.combo_box.currentText()
+
+    def update_input_widgets(self):
+        # Show the inputs of the selected criterion's type
+        criterion = SCHEMA[self.criterion()]
+        is_date = criterion.value_type == 'date'
+        self.value_input.setVisible(not is_date)
+        self.start_date_input.setVisible(is_date)
+        self.end_date_input.setVisible(criterion.is_range)
+        if not is_date:
+            self.value_input.setPlaceholderText(f'Enter {self.criterion()} (comma-separated)')
+            # Catalogued values complete the input and inform the planner
+            self.plugin.value_catalog.prepare(self.criterion())
+
+    def read(self):
+        """Return ((criterion, values), error message or None)."""
+        criterion = SCHEMA[self.criterion()]
+        if criterion.is_range:
+            values = [self.start_date_input.date().toString("yyyy-MM-dd"), self.end_date_input.date().toString("yyyy-MM-dd")]
+        elif criterion.value_type == 'date':
+            values = [self.start_date_input.date().toString("yyyy-MM-dd")]
+        else:
+            values = list(dict.fromkeys(value.strip() for value in self.value_input.text().split(',') if value.strip()))
+            if not values:
+                return None, f'Please enter a value for the "{criterion.name}" filter.'
+        return (criterion.name, values), criterion.check(values)
+
+
+class CompositeFilterDialog(QDialog):
+    """Dialog combining several criteria with AND or OR."""
+
+    def __init__(self, plugin, parent=None):
+        super().__init__(parent)
+        self.plugin = plugin
+        # (criterion, values) pairs and operator read when the dialog was accepted
+        self.predicates = None
+        self.operator = 'AND'
+        self.setWindowTitle('Composite Filter')
+
+        # Create a combo box for choosing how the criteria combine
+        self.operator_combo = QComboBox(self)
+        self.operator_combo.addItem('Match all criteria (AND)', 'AND')
+        self.operator_combo.addItem('Match any criterion (OR)', 'OR')
+
+        # Create a combo box for choosing the number of criteria
+        num_criteria_label = QLabel('Number of Criteria:', self)
+        self.num_criteria_combo = QComboBox(self)
+        self.num_criteria_combo.addItems([str(number) for number in range(2, COMPOSITE_FILTER_ROWS + 1)])
+        self.num_criteria_combo.currentIndexChanged.connect(self.update_rows)
+
+        # One row per criterion, each starting on a different criterion
+        self.rows = [CriterionRow(plugin, self) for _ in range(COMPOSITE_FILTER_ROWS)]
+        for i, row in enumerate(self.rows):
+            row.combo_box.setCurrentIndex(i % len(SINGLE_FILTER_CRITERIA))
+
+        # Create a QLabel for the powered by message
+        powered_by_label = QLabel('Powered By © Hasan Sami', self)
+        powered_by_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+
+        # Create a QPushButton for confirming the composite filter
+        self.confirm_button = QPushButton('OK', self)
+        self.confirm_button.clicked.connect(self.confirm)
+
+        # Preview of the number of matches per layer
+        self.preview = MatchPreviewWidget(plugin.field_index, self.preview_plan, self)
+
+        # Slowest layers of the last filter operation
+        self.slow_layers = SlowLayersWidget(self)
+
+        # Create a layout for the dialog
+        layout = QVBoxLayout()
+        layout.addWidget(self.operator_combo)
+        layout.addWidget(num_criteria_label)
+        layout.addWidget(self.num_criteria_combo)
+        for row in self.rows:
+            layout.addWidget(row)
+        layout.addWidget(self.preview)
+        layout.addWidget(self.slow_layers)
+        layout.addWidget(self.confirm_button)
+        layout.addWidget(powered_by_label)
+        self.setLayout(layout)
+
+        # Set the initial visibility based on the default selection
+        self.update_rows()
+
+    def prepare(self):
+        """Reset per-use state before the dialog is shown again."""
+        self.predicates = None
+        self.preview.reset()
+        self.slow_layers.show_profile(self.plugin.filter_engine.last_profile)
+        for row in self.rows:
+            row.update_input_widgets()
+
+    def update_rows(self):
+        # Show as many rows as criteria were chosen
+        num_criteria = int(self.num_criteria_combo.currentText())
+        for i, row in enumerate(self.rows):
+            row.setVisible(i < num_criteria)
+
+    def read_predicates(self):
+        """Read and check the criteria entered in the dialog, or None."""
+        num_criteria = int(self.num_criteria_combo.currentText())
+        predicates = []
+        for row in self.rows[:num_criteria]:
+            predicate, error = row.read()
+            if error:
+                QMessageBox.warning(None, 'Warning', error)
+                return None
+            predicates.append(predicate)
+        return predicates
+
+    def preview_plan(self):
+        # Plan of the current input for the match-count preview
+        predicates = self.read_predicates()
+        if predicates is None:
+            return None
+        operator = self.operator_combo.currentData()
+        plan, _native = self.plugin.composite_plan(predicates, operator)
+        return plan, predicates[0][0], input_key(operator, predicates)
+
+    def confirm(self):
+        # Close the dialog only once the input is valid
+        self.predicates = self.read_predicates()
+        self.operator = self.operator_combo.currentData()
+        if self.predicates is not None:
+            self.accept()
+
+
+class ExportDialog(QDialog):
+    """Dialog choosing the GeoPackage and options of an export of the filtered layers."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('Export Filtered Layers')
+
+        # Number of layers that will be exported
+        self.layers_label = QLabel(self)
+
+        # Create a line edit and a button for choosing the GeoPackage
+        self.path_input = QLineEdit(self)
+        self.path_input.setPlaceholderText('GeoPackage to write')
+        browse_button = QPushButton('Browse...', self)
+        browse_button.clicked.connect(self.browse)
+        path_layout = QHBoxLayout()
+        path_layout.addWidget(self.path_input)
+        path_layout.addWidget(browse_button)
+
+        # Export options
+        self.attributes_only_check = QCheckBox('Attributes only (no geometry)', self)
+        self.simplify_check = QCheckBox('Simplify geometries, tolerance in layer units:', self)
+        self.tolerance_input = QDoubleSpinBox(self)
+        self.tolerance_input.setDecimals(6)
+        self.tolerance_input.setRange(0.0, 1e9)
+        self.tolerance_input.setValue(1.0)
+        self.attributes_only_check.toggled.connect(self.update_options)
+        self.simplify_check.toggled.connect(self.update_options)
+        simplify_layout = QHBoxLayout()
+        simplify_layout.addWidget(self.simplify_check)
+        simplify_layout.addWidget(self.tolerance_input)
+
+        # Create a QPushButton for confirming the export
+        self.confirm_button = QPushButton('Export', self)
+        self.confirm_button.clicked.connect(self.confirm)
+
+        # Create a layout for the dialog
+        layout = QVBoxLayout()
+        layout.addWidget(self.layers_label)
+        layout.addLayout(path_layout)
+        layout.addWidget(self.attributes_only_check)
+        layout.addLayout(simplify_layout)
+        layout.addWidget(self.confirm_button)
+        self.setLayout(layout)
+        self.update_options()
+
+    def prepare(self, layer_count):
+        """Show how many layers the export will write."""
+        self.layers_label.setText(f'{layer_count} filtered layer(s) will be written to one GeoPackage.')
+
+    @property
+    def path(self):
+        return self.path_input.text().strip()
+
+    @property
+    def attributes_only(self):
+        return self.attributes_only_check.isChecked()
+
+    @property
+    def tolerance(self):
+        # Simplification tolerance, or None to keep geometries as they are
+        if self.attributes_only or not self.simplify_check.isChecked():
+            return None
+        return self.tolerance_input.value() or None
+
+    def update_options(self, *args):
+        # Geometry options do not apply to an attribute-only export
+        self.simplify_check.setEnabled(not self.attributes_only)
+        self.tolerance_input.setEnabled(not self.attributes_only and self.simplify_check.isChecked())
+
+    def browse(self):
+        path = QFileDialog.getSaveFileName(self, 'Export Filtered Layers', self.path, 'GeoPackage (*.gpkg)')[0]
+        if path:
+            if not path.lower().endswith('.gpkg'):
+                path += '.gpkg'
+            self.path_input.setText(path)
+
+    def confirm(self):
+        # Close the dialog only once a GeoPackage is chosen
+        if not self.path:
+            QMessageBox.warning(None, 'Warning', 'Please choose the GeoPackage to write.')
+            return
+        if not os.path.isdir(os.path.dirname(os.path.abspath(self.path))):
+            QMessageBox.warning(None, 'Warning', 'The folder of the GeoPackage does not exist.')
+            return
+        # Replacing a file the project reads from would pull the data from under its layers
+        readers = layers_reading(QgsProject.instance(), self.path)
+        if readers:
+            QMessageBox.warning(None, 'Warning', 'The project reads layers from this GeoPackage:\n'
+                                + '\n'.join(readers) + '\n\nPlease choose another file.')
+            return
+        self.accept()
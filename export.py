@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Export the current filtered view: every filtered vector layer into one
+ GeoPackage.
+"""
+import os
+import os.path
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from qgis.core import (Qgis, QgsFeatureRequest, QgsMessageLog, QgsProviderRegistry, QgsTask, QgsVectorFileWriter,
+                       QgsVectorLayer, QgsWkbTypes)
+
+from .batch import file_safe, unique_name
+from .layer_sources import open_reader, reader_source
+from .profiler import LOG_TAG
+
+# Features handed from a reader to the writer at a time
+EXPORT_BATCH_SIZE = 1000
+
+# Batches a reader may get ahead of the writer, per layer
+EXPORT_QUEUE_BATCHES = 4
+
+# Concurrent layer readers
+EXPORT_WORKERS = 4
+
+# Seconds between checks for cancellation while a queue is full or empty
+POLL_SECONDS = 0.2
+
+
+def filtered_layers(project):
+    """Return the vector layers of a project that have a subset string."""
+    return [layer for layer in project.mapLayers().values()
+            if isinstance(layer, QgsVectorLayer) and layer.isValid() and layer.subsetString()]
+
+
+def same_file(path, other):
+    return os.path.normcase(os.path.realpath(path)) == os.path.normcase(os.path.realpath(other))
+
+
+def layers_reading(project, path):
+    """Return the names of the project layers whose data source is the file at path."""
+    names = []
+    for layer in project.mapLayers().values():
+        source_path = QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source()).get('path')
+        if source_path and same_file(source_path, path):
+            names.append(layer.name())
+    return names
+
+
+def export_job(layer):
+    """Return what an ExportTask needs to read and write a layer off the GUI thread."""
+    return {'name': layer.name(), 'source': reader_source(layer), 'subset': layer.subsetString(),
+            'fields': layer.dataProvider().fields(), 'wkb_type': layer.wkbType(), 'crs': layer.crs()}
+
+
+class ExportTask(QgsTask):
+    """Read filtered layers concurrently and write them to one GeoPackage.
+
+    The GeoPackage is written to a temporary file next to the target and
+    only replaces it once every layer has been written, so a cancelled or
+    failed export leaves an existing file as it was.
+
+    Every layer is read on a provider of its own by a pool of reader
+    threads, which convert its features (dropping or simplifying the
+    geometry) and hand them on in batches through a bounded queue per
+    layer. The task's own thread is the only writer: it writes the layers
+    one after the other, so GeoPackage writes are serialized while the
+    next layers are already being read, and memory stays bounded by the
+    queues.
+    """
+
+    def __init__(self, description, path, jobs, transform_context, attributes_only=False, tolerance=None,
+                 workers=EXPORT_WORKERS, callback=None):
+        super().__init__(description, QgsTask.CanCancel)
+        self.path = path
+        # Written first, then moved over path
+        self.temp_path = None
+        self.jobs = jobs
+        self.transform_context = transform_context
+        self.attributes_only = attributes_only
+        # Douglas-Peucker tolerance in layer units, or None to keep geometries as they are
+        self.tolerance = tolerance
+        self.workers = workers
+        self.callback = callback
+        # Set when the export stops early, so readers give up
+        self.stop = threading.Event()
+        # Per-layer outcome: name, layer in the GeoPackage, features, seconds, features per second
+        self.layers = []
+        self.errors = []
+        self.seconds = 0.0
+
+    def run(self):
+        started = time.perf_counter()
+        try:
+            handle, self.temp_path = tempfile.mkstemp(suffix='.gpkg', prefix='.autofilter-',
+                                                      dir=os.path.dirname(os.path.abspath(self.path)))
+            os.close(handle)
+            # The writer creates the GeoPackage; only the unique name is needed
+            os.remove(self.temp_path)
+            if not self.write_all():
+                return False
+            if not os.path.exists(self.temp_path):
+                self.errors.append('No layer could be written.')
+                return True
+            os.replace(self.temp_path, self.path)
+        except OSError as e:
+            self.errors.append(f'Cannot write {self.path}: {e}')
+            return True
+        finally:
+            if self.temp_path and os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+        self.seconds = time.perf_counter() - started
+        return True
+
+    def write_all(self):
+        """Read and write every layer to the temporary file; return False if cancelled."""
+        queues = [queue.Queue(maxsize=EXPORT_QUEUE_BATCHES) for _ in self.jobs]
+        names = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # Readers start in layer order, the order the writer takes them in
+            for job, batches in zip(self.jobs, queues):
+                pool.submit(self.read, job, batches)
+            try:
+                for i, (job, batches) in enumerate(zip(self.jobs, queues)):
+                    if not self.write(job, batches, unique_name(file_safe(job['name'], 60), names)):
+                        return False
+                    self.setProgress(100.0 * (i + 1) / len(self.jobs))
+            finally:
+                self.stop.set()
+        return True
+
+    def read(self, job, batches):
+        """Reader thread: put batches of converted features, then None (or an exception)."""
+        if self.stop.is_set():
+            return
+        try:
+            provider = open_reader(job['source'])
+            if provider is None:
+                raise RuntimeError('cannot open the data source')
+            if not provider.setSubsetString(job['subset'], False):
+                raise RuntimeError(f'invalid filter {job["subset"]}')
+            request = QgsFeatureRequest()
+            if self.attributes_only:
+                request.setFlags(QgsFeatureRequest.NoGeometry)
+            batch = []
+            for feature in provider.getFeatures(request):
+                if self.attributes_only:
+                    feature.clearGeometry()
+                elif self.tolerance and feature.hasGeometry():
+                    feature.setGeometry(feature.geometry().simplify(self.tolerance))
+                batch.append(feature)
+                if len(batch) >= EXPORT_BATCH_SIZE:
+                    if not self.put(batches, batch):
+                        return
+                    batch = []
+            if batch and not self.put(batches, batch):
+                return
+            self.put(batches, None)
+        except Exception as e:
+            self.put(batches, e)
+
+    def put(self, batches, item):
+        # Wait for room in the queue unless the export has stopped
+        while not self.stop.is_set():
+            try:
+                batches.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def write(self, job, batches, layer_name):
+        """Write one layer's batches as they arrive; return False if cancelled."""
+        started = time.perf_counter()
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = 'GPKG'
+        options.fileEncoding = 'UTF-8'
+        options.layerName = layer_name
+        options.actionOnExistingFile = (QgsVectorFileWriter.CreateOrOverwriteLayer if os.path.exists(self.temp_path)
+                                        else QgsVectorFileWriter.CreateOrOverwriteFile)
+        wkb_type = QgsWkbTypes.NoGeometry if self.attributes_only else job['wkb_type']
+        writer = QgsVectorFileWriter.create(self.temp_path, job['fields'], wkb_type, job['crs'], self.transform_context, options)
+        error = writer.errorMessage() if writer.hasError() != QgsVectorFileWriter.NoError else None
+        features = 0
+        try:
+            while True:
+                if self.isCanceled():
+                    return False
+                try:
+                    batch = batches.get(timeout=POLL_SECONDS)
+                except queue.Empty:
+                    continue
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    error = str(batch)
+                    break
+                # Keep draining after a write error so the reader can finish
+                if error is None:
+                    if writer.addFeatures(batch):
+                        features += len(batch)
+                    else:
+                        error = writer.errorMessage() or 'cannot write features'
+        finally:
+            # Closing the writer flushes the layer to the GeoPackage
+            del writer
+        if error:
+            self.errors.append(f'{job["name"]}: {error}')
+            return True
+        seconds = time.perf_counter() - started
+        self.layers.append({'layer': job['name'], 'table': layer_name, 'features': features, 'seconds': seconds,
+                            'features_per_s': features / seconds if seconds else 0.0})
+        return True
+
+    def finished(self, result):
+        if self.callback:
+            self.callback(self, result)
+
+
+def report(task):
+    """Return the per-layer throughput of a finished export as text, and log it."""
+    lines = [f'{layer["layer"]}: {layer["features"]} features in {layer["seconds"]:.1f} s '
+             f'({layer["features_per_s"]:.0f} features/s)' for layer in task.layers]
+    total = sum(layer['features'] for layer in task.layers)
+    lines.append(f'{total} features from {len(task.layers)} layer(s) in {task.seconds:.1f} s')
+    for line in lines:
+        QgsMessageLog.logMessage(f'Export: {line}', LOG_TAG, Qgis.Info)
+    for error in task.errors:
+        QgsMessageLog.logMessage(f'Export: {error}', LOG_TAG, Qgis.Warning)
+    return '\n'.join(lines)
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ In-memory inverted index from criteria values to feature ids.
+"""
+import sys
+from array import array
+from collections import OrderedDict
+
+from qgis.PyQt.QtCore import QSettings, QVariant
+from qgis.core import QgsExpression, QgsFeatureRequest, QgsTask
+
+from .criteria import field_kind, typed_value
+from .layer_sources import LayerWatcher, TaskSet, open_reader, reader_source
+from .value_catalog import catalog_text
+
+# QSettings keys for the feature-id index
+FID_INDEX_SETTING = 'AutoFilter/fid_index'
+FID_INDEX_BUDGET_SETTING = 'AutoFilter/fid_index_budget_mb'
+
+# Default memory budget shared by every layer index, in megabytes
+DEFAULT_BUDGET_MB = 256
+
+# Integer field types usable as a feature-id key in a subset string
+INTEGER_TYPES = (QVariant.Int, QVariant.UInt, QVariant.LongLong, QVariant.ULongLong)
+
+# Field types whose values are indexed
+INDEXED_TYPES = INTEGER_TYPES + (QVariant.String,)
+
+
+class LayerFidIndex:
+    """Feature ids of one layer keyed by field and value text."""
+
+    def __init__(self, postings, kinds):
+        # field -> {value text: array of feature ids}
+        self.postings = postings
+        # field -> field kind, to bring looked-up values to the indexed text form
+        self.kinds = kinds
+        self.memory = estimate_memory(postings)
+
+    def lookup(self, fields, values):
+        """Return the sorted feature ids where any field equals any value.
+
+        None means one of the fields is not indexed.
+        """
+        if any(field not in self.postings for field in fields):
+            return None
+        fids = set()
+        for field in fields:
+            field_postings = self.postings[field]
+            for value in values:
+                # "012" or "12.0" find the integer 12, as they do in the filter expression
+                value = typed_value(self.kinds[field], value)
+                if value is not None:
+                    fids.update(field_postings.get(str(value), ()))
+        return sorted(fids)
+
+
+def estimate_memory(postings):
+    """Return an estimate of the bytes held by a postings mapping."""
+    total = 0
+    for field_postings in postings.values():
+        total += sys.getsizeof(field_postings)
+        for value, fids in field_postings.items():
+            total += sys.getsizeof(value) + sys.getsizeof(fids)
+    return total
+
+
+class FidIndexTask(QgsTask):
+    """Build the inverted index of one layer in a single attribute-only scan.
+
+    The source is reopened without its subset string through a provider of
+    the task's own, so the index covers every feature whatever the layer's
+    current filter is.
+    """
+
+    def __init__(self, description, layer_id, source, fields, callback=None):
+        super().__init__(description, QgsTask.CanCancel)
+        self.layer_id = layer_id
+        # Provider key and unfiltered source, or a cloned provider
+        self.source = source
+        self.fields = fields
+        self.callback = callback
+        self.index = None
+
+    def run(self):
+        provider = open_reader(self.source)
+        if provider is None:
+            return False
+        self.index = build_layer_index(provider, self.fields, self)
+        return self.index is not None
+
+    def finished(self, result):
+        if self.callback:
+            self.callback(self, result)
+
+
+def build_layer_index(source, fields, task=None):
+    """Scan a provider or feature source once and return a LayerFidIndex."""
+    provider_fields = source.fields()
+    indices = {}
+    for field in fields:
+        index = provider_fields.lookupField(field)
+        # Only text and integer values compare exactly with the entered text
+        if index >= 0 and provider_fields.at(index).type() in INDEXED_TYPES:
+            indices[field] = index
+    request = QgsFeatureRequest()
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes(list(indices.values()))
+    postings = {field: {} for field in indices}
+    total = source.featureCount() or 1
+    for i, feature in enumerate(source.getFeatures(request)):
+        if task is not None and i % 1000 == 0:
+            if task.isCanceled():
+                return None
+            task.setProgress(min(100.0, 100.0 * i / total))
+        attributes = feature.attributes()
+        fid = feature.id()
+        for field, index in indices.items():
+            value = catalog_text(attributes[index])
+            if value is not None:
+                postings[field].setdefault(value, array('q')).append(fid)
+    kinds = {field: field_kind(provider_fields.at(index)) for field, index in indices.items()}
+    return LayerFidIndex(postings, kinds)
+
+
+def fid_subset_string(layer, fids):
+    """Return (subset string, native) keeping only the given feature ids.
+
+    The subset string is None when the provider has no way to filter on
+    feature ids; native is True for OGR's FID special field, which QGIS
+    expressions do not know.
+    """
+    fid_list = ','.join(str(fid) for fid in fids) or '-1'
+    provider = layer.providerType()
+    if provider == 'memory':
+        return f'$id IN ({fid_list})', False
+    pk_attributes = layer.primaryKeyAttributes()
+    if len(pk_attributes) == 1:
+        pk_field = layer.fields().at(pk_attributes[0])
+        if pk_field.type() in INTEGER_TYPES:
+            return f'{QgsExpression.quotedColumnRef(pk_field.name())} IN ({fid_list})', False
+    if provider == 'ogr':
+        return f'FID IN ({fid_list})', True
+    return None, False
+
+
+class FidIndex:
+    """Per-layer inverted indexes under a shared memory budget.
+
+    Each layer is indexed once in the background on first use and then
+    resolves filter values to feature ids without querying the provider.
+    Layers beyond the budget are evicted least recently used first. An
+    index is dropped when its layer commits edits or changes data source.
+    """
+
+    def __init__(self, field_index):
+        self.field_index = field_index
+        # layer id -> LayerFidIndex, least recently used first
+        self._indexes = OrderedDict()
+        # Layers being indexed by a running task
+        self._pending = set()
+        self.watcher = LayerWatcher(self.invalidate_layer)
+        self.tasks = TaskSet()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return QSettings().value(FID_INDEX_SETTING, False, type=bool)
+
+    @enabled.setter
+    def enabled(self, enabled):
+        QSettings().setValue(FID_INDEX_SETTING, bool(enabled))
+        if not enabled:
+            self.clear()
+
+    @property
+    def budget(self):
+        """Return the memory budget in bytes."""
+        return QSettings().value(FID_INDEX_BUDGET_SETTING, DEFAULT_BUDGET_MB, type=int) * 1024 * 1024
+
+    @property
+    def memory(self):
+        """Return the estimated bytes held by every layer index."""
+        return sum(index.memory for index in self._indexes.values())
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def lookup(self, layer, fields, values):
+        """Return the matching feature ids, or None if the layer cannot answer yet.
+
+        A miss schedules the layer for indexing in the background.
+        """
+        index = self._indexes.get(layer.id())
+        fids = index.lookup(fields, values) if index is not None else None
+        if fids is None:
+            self.misses += 1
+            self.build(layer)
+            return None
+        self.hits += 1
+        self._indexes.move_to_end(layer.id())
+        return fids
+
+    def build(self, layer):
+        """Index a layer in the background unless it is indexed or pending."""
+        layer_id = layer.id()
+        if layer_id in self._indexes or layer_id in self._pending:
+            return
+        fields = self.field_index.criteria_fields(layer_id)
+        if not fields:
+            return
+        revision = self.watcher.watch(layer)
+
+        def done(task, result):
+            self.tasks.discard(task)
+            self._pending.discard(task.layer_id)
+            # An index read before an edit was committed is stale
+            if result and task.index is not None and revision == self.watcher.revision(task.layer_id):
+                self._store(task.layer_id, task.index)
+
+        task = FidIndexTask(f'AutoFilter: Index {layer.name()}', layer_id, reader_source(layer), fields, done)
+        self._pending.add(layer_id)
+        self.tasks.start(task)
+
+    def invalidate_layer(self, layer_id):
+        self._indexes.pop(layer_id, None)
+
+    def clear(self):
+        self._indexes.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Return a one-line summary of memory use and hit rate."""
+        return (f'{len(self._indexes)} layer(s) indexed, {self.memory / 1048576:.1f} MB of '
+                f'{self.budget / 1048576:.0f} MB, hit rate {self.hit_rate:.0%}')
+
+    def unload(self):
+        self.tasks.cancel_all()
+        self.watcher.unload()
+        self.clear()
+
+    def _store(self, layer_id, index):
+        self._indexes[layer_id] = index
+        self._indexes.move_to_end(layer_id)
+        # Evict least recently used layers until the budget is met
+        while len(self._indexes) > 1 and self.memory > self.budget:
+            self._indexes.popitem(last=False)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Index of the fields each filter criterion resolves to on every layer.
+"""
+from qgis.core import QgsVectorLayer
+
+from .criteria import CRITERIA_FIELDS
+
+
+class FieldIndex:
+    """Resolve filter criteria to the matching fields of each vector layer.
+
+    The index is built once from the project and then kept current through the
+    project's layersAdded/layersRemoved signals and each layer's
+    attributeAdded/attributeDeleted signals, so applying a filter only visits
+    layers that actually carry one of the criterion's fields.
+    """
+
+    def __init__(self, project, criteria=None):
+        self.project = project
+        self.criteria = criteria if criteria is not None else CRITERIA_FIELDS
+        # criterion -> {layer id: [matching field names]}
+        self._matches = {criterion: {} for criterion in self.criteria}
+        # layer id -> (layer, slot) for every layer we listen to
+        self._connections = {}
+        self._built = False
+
+    def ensure_built(self):
+        """Build the index on first use."""
+        if not self._built:
+            self.build()
+
+    def build(self):
+        """Index every layer in the project and start tracking changes."""
+        self.unload()
+        for layer in self.project.mapLayers().values():
+            self._add_layer(layer)
+        self.project.layersAdded.connect(self._on_layers_added)
+        self.project.layersRemoved.connect(self._on_layers_removed)
+        self._built = True
+
+    def unload(self):
+        """Disconnect from the project and from every tracked layer."""
+        if self._built:
+            try:
+                self.project.layersAdded.disconnect(self._on_layers_added)
+                self.project.layersRemoved.disconnect(self._on_layers_removed)
+            except (RuntimeError, TypeError):
+                pass
+        for layer, slot in self._connections.values():
+            try:
+                layer.attributeAdded.disconnect(slot)
+                layer.attributeDeleted.disconnect(slot)
+            except (RuntimeError, TypeError):
+                # The layer has already been deleted
+                pass
+        self._connections.clear()
+        self._matches = {criterion: {} for criterion in self.criteria}
+        self._built = False
+
+    def fields_for(self, criterion, layer_id):
+        """Return the fields of a layer matching a criterion (empty if none)."""
+        self.ensure_built()
+        return self._matches.get(criterion, {}).get(layer_id, [])
+
+    def criteria_fields(self, layer_id):
+        """Return every criteria field of a layer, in index order."""
+        self.ensure_built()
+        fields = []
+        for matches in self._matches.values():
+            for field in matches.get(layer_id, []):
+                if field not in fields:
+                    fields.append(field)
+        return fields
+
+    def layers_for(self, criterion):
+        """Return (layer, fields) pairs for every layer matching a criterion."""
+        self.ensure_built()
+        matches = []
+        for layer_id, fields in self._matches.get(criterion, {}).items():
+            layer = self.project.mapLayer(layer_id)
+            if layer is not None:
+                matches.append((layer, fields))
+        return matches
+
+    def _add_layer(self, layer):
+        if not isinstance(layer, QgsVectorLayer):
+            return
+        layer_id = layer.id()
+        if layer_id not in self._connections:
+            # Re-index the layer whenever its schema changes
+            slot = lambda _index, layer_id=layer_id: self._reindex_layer(layer_id)
+            layer.attributeAdded.connect(slot)
+            layer.attributeDeleted.connect(slot)
+            self._connections[layer_id] = (layer, slot)
+        self._index_layer(layer)
+
+    def _index_layer(self, layer):
+        layer_id = layer.id()
+        field_names = set(layer.fields().names())
+        for criterion, aliases in self.criteria.items():
+            matching = [alias for alias in aliases if alias in field_names]
+            if matching:
+                self._matches[criterion][layer_id] = matching
+            else:
+                self._matches[criterion].pop(layer_id, None)
+
+    def _reindex_layer(self, layer_id):
+        layer = self.project.mapLayer(layer_id)
+        if layer is not None:
+            self._index_layer(layer)
+
+    def _remove_layer(self, layer_id):
+        self._connections.pop(layer_id, None)
+        for matches in self._matches.values():
+            matches.pop(layer_id, None)
+
+    def _on_layers_added(self, layers):
+        for layer in layers:
+            self._add_layer(layer)
+
+    def _on_layers_removed(self, layer_ids):
+        for layer_id in layer_ids:
+            self._remove_layer(layer_id)
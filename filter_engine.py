@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Prepare filter plans in the background and apply them in one batch.
+"""
+from qgis.PyQt.QtCore import QSettings
+from qgis.core import QgsApplication, QgsExpression, QgsFeatureRequest, QgsTask
+
+from .profiler import PROFILE_SETTING, FilterProfile
+from .sql_dialect import validate_group, validation_target
+from .value_table import write_list
+
+# QSettings key for the background execution mode
+BACKGROUND_SETTING = 'AutoFilter/background_filtering'
+
+
+class PrepareFilterTask(QgsTask):
+    """Validate the subset string of every layer of a plan off the GUI thread.
+
+    The task only works on plain data (layer ids, field names and expression
+    strings) captured on the main thread, so it never touches a layer.
+    Provider-native subset strings are checked by their database instead,
+    one query per database for all the layers it holds. The lookup lists
+    the plan's semi-joins read (see ValueListStore.take_writes) are written
+    first; where one cannot be, its semi-joins are replaced by their inline
+    form.
+    """
+
+    def __init__(self, description, requests, callback=None, native_groups=None, writes=()):
+        super().__init__(description, QgsTask.CanCancel)
+        # [(layer id, layer name, field names, expression)]
+        self.requests = requests
+        # {group key: (source, [(layer id, layer name, table SQL, expression)])}
+        self.native_groups = native_groups or {}
+        # [(key, kind, target, list id, values, {semi-join: inline form})]
+        self.writes = writes
+        self.callback = callback
+        self.plan = {}
+        self.errors = []
+        # (key, list id) of the lookup lists written, and of those that could not be
+        self.written = []
+        self.unwritten = []
+
+    def run(self):
+        for key, kind, target, list_id, values, fallbacks in self.writes:
+            if self.isCanceled():
+                return False
+            try:
+                write_list(kind, target, list_id, values)
+                self.written.append((key, list_id))
+            except Exception:
+                # Read-only or unreachable database: the values stay inline
+                self.unwritten.append((key, list_id))
+                self.inline(fallbacks)
+        total = (len(self.requests) + len(self.native_groups)) or 1
+        for i, (layer_id, layer_name, field_names, expression) in enumerate(self.requests):
+            if self.isCanceled():
+                return False
+            error = validate_expression(expression, field_names)
+            if error:
+                self.errors.append(f'{layer_name}: {error}')
+            else:
+                self.plan[layer_id] = expression
+            self.setProgress(100.0 * (i + 1) / total)
+        for i, (key, (source, items)) in enumerate(self.native_groups.items()):
+            if self.isCanceled():
+                return False
+            try:
+                errors = validate_group(key, source, items)
+            except Exception:
+                # Database unreachable from here: the provider checks on apply
+                errors = {}
+            for layer_id, error in errors.items():
+                self.plan.pop(layer_id, None)
+                self.errors.append(error)
+            self.setProgress(100.0 * (len(self.requests) + i + 1) / total)
+        return True
+
+    def inline(self, fallbacks):
+        """Replace semi-joins by their inline form, {semi-join: inline form}, in every expression."""
+        def replaced(expression):
+            for semi_join, inline in fallbacks.items():
+                expression = expression.replace(semi_join, inline)
+            return expression
+
+        self.requests = [request[:3] + (replaced(request[3]),) for request in self.requests]
+        self.native_groups = {key: (source, [item[:3] + (replaced(item[3]),) for item in items])
+                              for key, (source, items) in self.native_groups.items()}
+
+    def finished(self, result):
+        # Called on the main thread once run() has returned or was cancelled
+        if self.callback:
+            self.callback(self, result)
+
+
+def validate_expression(expression, field_names):
+    """Return an error message for an invalid subset string, or None."""
+    if not expression or field_names is None:
+        return None
+    parsed = QgsExpression(expression)
+    if parsed.hasParserError():
+        return parsed.parserErrorString()
+    missing = set(parsed.referencedColumns()) - set(field_names) - {QgsFeatureRequest.ALL_ATTRIBUTES}
+    if missing:
+        return 'unknown field(s) ' + ', '.join(sorted(missing))
+    return None
+
+
+class FilterResult:
+    """Outcome of a submitted filter plan."""
+
+    def __init__(self):
+        # Layers whose subset string was set
+        self.applied = 0
+        # Layers already showing the requested subset string
+        self.skipped = 0
+        # 'layer name: reason' for layers left untouched because of an error
+        self.errors = []
+        self.cancelled = False
+        # Name of the operation, and its per-layer timings when profiling
+        self.description = ''
+        self.profile = None
+
+
+class FilterEngine:
+    """Apply a filter plan ({layer id: subset string}) to the project.
+
+    In background mode the plan is validated by a PrepareFilterTask with
+    progress and cancellation in the QGIS task manager; the plan is then
+    committed on the main thread with the map canvas frozen and refreshed
+    once, instead of repainting after every layer.
+
+    Setting a subset string always reloads the layer, even when it is the
+    current one, so layers whose filter would not change are skipped.
+
+    A filter set from the result cache, or from the feature ids offered for
+    it (see offers), shows as a feature-id subset string on its layer;
+    subset_string() gives back the filter it stands for, which is what the
+    session records and compares.
+    """
+
+    def __init__(self, project, canvas=None, result_cache=None, value_store=None):
+        self.project = project
+        self.canvas = canvas
+        # Feature ids of filters applied before (see result_cache), or None
+        self.result_cache = result_cache
+        # Lookup lists for long value lists, written by the task preparing the plan, or None
+        self.value_store = value_store
+        self.task = None
+        # layer id -> (feature-id subset string set in place of a filter, the filter it stands for)
+        self.substitutes = {}
+        # (layer id, filter) -> feature-id subset string selecting the same features, offered by
+        # the feature-ID index for the plan built last and used by the next submit only
+        self.offers = {}
+        # Per-layer timings of the last operation that changed a layer
+        self.last_profile = None
+
+    @property
+    def background(self):
+        return QSettings().value(BACKGROUND_SETTING, True, type=bool)
+
+    @background.setter
+    def background(self, enabled):
+        QSettings().setValue(BACKGROUND_SETTING, bool(enabled))
+
+    @property
+    def profiling(self):
+        return QSettings().value(PROFILE_SETTING, False, type=bool)
+
+    @profiling.setter
+    def profiling(self, enabled):
+        QSettings().setValue(PROFILE_SETTING, bool(enabled))
+
+    def subset_string(self, layer):
+        """Return a layer's subset string, or the filter its cached feature-id subset string stands for."""
+        subset = layer.subsetString()
+        substitute = self.substitutes.get(layer.id())
+        if substitute is not None and substitute[0] == subset:
+            return substitute[1]
+        return subset
+
+    def submit(self, description, plan, on_finished=None, native=(), profile=None, trusted=()):
+        """Validate and apply a plan, then call on_finished(FilterResult).
+
+        Layers listed in native carry provider SQL (such as a lookup-table
+        semi-join) that QGIS expressions cannot parse; they are validated
+        by their database, grouped per connection. Layers listed in trusted
+        get back a subset string they already had and skip validation.
+        profile overrides the profiling setting for this plan. Filters with
+        offered feature ids are set as those. With a result cache, filters
+        applied before are set from their cached feature ids, and the ids
+        kept by new ones are cached once applied.
+        Returns the task preparing the plan, or None if it ran right away.
+        """
+        # A newer filter supersedes whatever is still being prepared
+        self.cancel()
+        result = FilterResult()
+        result.description = description
+        requests = []
+        native_groups = {}
+        # Filters to cache once applied: {layer id: expression}
+        uncached = {}
+        # Filters set as feature ids: {layer id: (feature-id subset string, expression)}
+        substitutes = {}
+        plan = dict(plan)
+        trusted = set(trusted)
+        # Offers are only good until the layers change, so they are not kept for later plans
+        offers, self.offers = self.offers, {}
+        for layer_id, expression in plan.items():
+            layer = self.project.mapLayer(layer_id)
+            if layer is None:
+                continue
+            if self.subset_string(layer) == expression:
+                result.skipped += 1
+                continue
+            offered = offers.get((layer_id, expression))
+            if offered is not None:
+                # The ids resolve the filter already; they need no validation
+                substitutes[layer_id] = (offered, expression)
+                plan[layer_id] = expression = offered
+                trusted.add(layer_id)
+            elif self.result_cache is not None and expression:
+                cached = self.result_cache.lookup(layer, expression)
+                if cached is None:
+                    uncached[layer_id] = expression
+                else:
+                    # Set the ids the filter kept last time; they need no validation
+                    substitutes[layer_id] = (cached, expression)
+                    plan[layer_id] = expression = cached
+                    trusted.add(layer_id)
+            field_names = None if layer_id in native or layer_id in trusted else layer.fields().names()
+            requests.append((layer_id, layer.name(), field_names, expression))
+            if layer_id in native and layer_id not in trusted and expression:
+                # Layers of one database are checked together in one query
+                target = validation_target(layer)
+                if target is not None:
+                    key, source, table = target
+                    native_groups.setdefault(key, (source, []))[1].append((layer_id, layer.name(), table, expression))
+
+        writes = self.value_store.take_writes() if self.value_store is not None and requests else []
+        task = PrepareFilterTask(description, requests, native_groups=native_groups, writes=writes)
+        task.uncached = uncached
+        task.substitutes = substitutes
+        if not self.background or not requests:
+            # Foreground mode: validate synchronously, still commit in one batch
+            self._commit(task, task.run(), result, on_finished, profile)
+            return None
+
+        task.callback = lambda task, success: self._commit(task, success, result, on_finished, profile)
+        # Keep a reference so the task is not garbage collected while running
+        self.task = task
+        QgsApplication.taskManager().addTask(task)
+        return task
+
+    def cancel(self, task=None):
+        """Cancel the plan currently being prepared, if any, or only if it is task."""
+        if task is not None and task is not self.task:
+            return
+        if self.task is not None:
+            try:
+                self.task.cancel()
+            except RuntimeError:
+                # The task has already been deleted by the task manager
+                pass
+            self.task = None
+
+    def apply(self, plan, result=None, profile=None):
+        """Set every changed subset string of a plan and refresh the canvas once."""
+        result = result if result is not None else FilterResult()
+        changed = []
+        for layer_id, expression in plan.items():
+            layer = self.project.mapLayer(layer_id)
+            if layer is None:
+                continue
+            # The layer may have changed while the plan was being prepared
+            if layer.subsetString() == expression:
+                result.skipped += 1
+            else:
+                changed.append((layer, expression))
+                # Whatever the layer stood for is replaced
+                self.substitutes.pop(layer_id, None)
+        if not changed:
+            return result
+
+        # Time every layer when profiling, to find the slow sources
+        if profile is None:
+            profile = self.profiling
+        profiler = FilterProfile(result.description) if profile else None
+        if self.canvas is not None:
+            self.canvas.freeze(True)
+        try:
+            for layer, expression in changed:
+                if profiler is None:
+                    applied = layer.setSubsetString(expression)
+                else:
+                    applied = profiler.apply(layer, expression)
+                if applied:
+                    result.applied += 1
+                else:
+                    result.errors.append(f'{layer.name()}: the provider rejected the filter')
+        finally:
+            if self.canvas is not None:
+                self.canvas.freeze(False)
+                self.canvas.refresh()
+        if profiler is not None:
+            profiler.log()
+            result.profile = self.last_profile = profiler
+        return result
+
+    def _commit(self, task, success, result, on_finished, profile=None):
+        if self.task is task:
+            self.task = None
+        if self.value_store is not None:
+            self.value_store.finished(task.written, task.unwritten)
+        result.errors.extend(task.errors)
+        result.cancelled = not success or task.isCanceled()
+        if not result.cancelled:
+            self.apply(task.plan, result, profile)
+            for layer_id, (subset, expression) in task.substitutes.items():
+                layer = self.project.mapLayer(layer_id)
+                if layer is not None and layer.subsetString() == subset:
+                    self.substitutes[layer_id] = (subset, expression)
+            if self.result_cache is not None and task.uncached:
+                self.result_cache.collect({layer_id: expression for layer_id, expression in task.uncached.items()
+                                           if task.plan.get(layer_id) == expression})
+        if on_finished:
+            on_finished(result)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Filter scope: the layers a filter or clear may change.
+"""
+from qgis.PyQt import sip
+from qgis.PyQt.QtCore import QSettings
+
+# QSettings keys for the filter scope and the map theme used as a layer set
+SCOPE_SETTING = 'AutoFilter/scope'
+SCOPE_THEME_SETTING = 'AutoFilter/scope_theme'
+
+# Scopes and their menu labels
+SCOPE_ALL = 'all'
+SCOPE_VISIBLE = 'visible'
+SCOPE_GROUP = 'group'
+SCOPE_LAYER_SET = 'layer_set'
+SCOPES = {
+    SCOPE_ALL: 'All Layers',
+    SCOPE_VISIBLE: 'Visible Layers',
+    SCOPE_GROUP: 'Selected Layer Tree Group',
+    SCOPE_LAYER_SET: 'Saved Layer Set (Map Theme)...',
+}
+
+
+class LayerScope:
+    """Resolve the filter scope to a set of layer ids, from cached lookups.
+
+    The visible layers, the layers of every group asked for and the layers
+    of every map theme are worked out once and kept until the layer tree
+    or the map themes change, so resolving the scope does not walk the tree
+    on every filter. current_group() returns the group selected in the
+    layer tree, or None.
+    """
+
+    def __init__(self, project, current_group=None):
+        self.project = project
+        self.current_group = current_group
+        # Visible layer ids, or None until needed
+        self._visible = None
+        # group node (its C++ address) -> layer ids below it
+        self._groups = {}
+        # map theme -> visible layer ids of the theme
+        self._themes = {}
+        self._collection = None
+        self._connected = False
+
+    @property
+    def scope(self):
+        scope = QSettings().value(SCOPE_SETTING, SCOPE_ALL)
+        return scope if scope in SCOPES else SCOPE_ALL
+
+    @scope.setter
+    def scope(self, scope):
+        QSettings().setValue(SCOPE_SETTING, scope)
+
+    @property
+    def theme(self):
+        return QSettings().value(SCOPE_THEME_SETTING, '')
+
+    @theme.setter
+    def theme(self, theme):
+        QSettings().setValue(SCOPE_THEME_SETTING, theme)
+
+    def describe(self):
+        """Return the scope as shown to the user."""
+        if self.scope == SCOPE_LAYER_SET:
+            return f'Map theme "{self.theme}"'
+        return SCOPES[self.scope]
+
+    def layer_ids(self):
+        """Return the ids of the layers in scope, or None when every layer is."""
+        scope = self.scope
+        if scope == SCOPE_ALL:
+            return None
+        self._connect()
+        if scope == SCOPE_VISIBLE:
+            if self._visible is None:
+                self._visible = frozenset(node.layerId() for node in self.project.layerTreeRoot().findLayers()
+                                          if node.isVisible())
+            return self._visible
+        if scope == SCOPE_GROUP:
+            group = self.current_group() if self.current_group is not None else None
+            if group is None or group.parent() is None:
+                # Nothing selected, or the root: the whole tree
+                return None
+            # Nodes are removed before they are deleted, which clears the
+            # cache, so an address never outlives its group here
+            node = sip.unwrapinstance(group)
+            if node not in self._groups:
+                self._groups[node] = frozenset(group.findLayerIds())
+            return self._groups[node]
+        theme = self.theme
+        if theme not in self._themes:
+            collection = self.project.mapThemeCollection()
+            self._themes[theme] = frozenset(collection.mapThemeVisibleLayerIds(theme) if collection.hasMapTheme(theme) else ())
+        return self._themes[theme]
+
+    def restrict(self, plan):
+        """Return the part of a plan whose layers are in scope."""
+        layer_ids = self.layer_ids()
+        if layer_ids is None:
+            return plan
+        return {layer_id: expression for layer_id, expression in plan.items() if layer_id in layer_ids}
+
+    def invalidate(self, *args):
+        """Forget every cached lookup."""
+        self._visible = None
+        self._groups.clear()
+        self._themes.clear()
+
+    def unload(self):
+        if self._connected:
+            root = self.project.layerTreeRoot()
+            # Each on its own, so one that fails does not leave the others connected
+            for signal, slot in ((root.visibilityChanged, self._visibility_changed),
+                                 (root.addedChildren, self.invalidate),
+                                 (root.removedChildren, self.invalidate),
+                                 (self.project.mapThemeCollectionChanged, self._collection_changed),
+                                 (self.project.cleared, self.invalidate)):
+                try:
+                    signal.disconnect(slot)
+                except (RuntimeError, TypeError):
+                    pass
+            self._disconnect_themes()
+            self._connected = False
+        self.invalidate()
+
+    def _connect(self):
+        if self._connected:
+            return
+        root = self.project.layerTreeRoot()
+        root.visibilityChanged.connect(self._visibility_changed)
+        root.addedChildren.connect(self.invalidate)
+        root.removedChildren.connect(self.invalidate)
+        self.project.mapThemeCollectionChanged.connect(self._collection_changed)
+        self.project.cleared.connect(self.invalidate)
+        self._connect_themes()
+        self._connected = True
+
+    def _connect_themes(self):
+        self._collection = self.project.mapThemeCollection()
+        self._collection.mapThemesChanged.connect(self._themes_changed)
+        self._collection.mapThemeChanged.connect(self._themes_changed)
+
+    def _disconnect_themes(self):
+        for signal in ('mapThemesChanged', 'mapThemeChanged'):
+            try:
+                getattr(self._collection, signal).disconnect(self._themes_changed)
+            except (RuntimeError, TypeError):
+                # The collection has already been replaced and deleted
+                pass
+
+    def _collection_changed(self):
+        # The project replaced its map theme collection (for instance on read)
+        self._disconnect_themes()
+        self._connect_themes()
+        self._themes.clear()
+
+    def _visibility_changed(self, node):
+        # Group and theme contents do not depend on what is checked
+        self._visible = None
+
+    def _themes_changed(self, *args):
+        self._themes.clear()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Layer data sources read off the GUI thread, the revisions of the layers
+ whose data is cached, and the tasks reading them.
+"""
+import sqlite3
+from contextlib import closing
+
+from qgis.core import QgsApplication, QgsDataProvider, QgsDataSourceUri, QgsProviderRegistry
+
+
+def unfiltered_source(layer):
+    """Return the layer's data source without its subset string."""
+    source = layer.source()
+    if layer.providerType() == 'ogr':
+        return '|'.join(part for part in source.split('|') if not part.startswith('subset='))
+    uri = QgsDataSourceUri(source)
+    if uri.sql():
+        uri.setSql('')
+        return uri.uri(False)
+    return source
+
+
+def sqlite_location(layer):
+    """Return (database path, table) for GeoPackage/SpatiaLite layers, else None."""
+    if layer.providerType() == 'spatialite':
+        uri = QgsDataSourceUri(layer.source())
+        return uri.database(), uri.table()
+    if layer.providerType() == 'ogr' and layer.dataProvider().storageType() == 'GPKG':
+        parts = layer.source().split('|')
+        for part in parts[1:]:
+            if part.startswith('layername='):
+                return parts[0], part[len('layername='):]
+        with closing(sqlite3.connect(parts[0])) as connection:
+            row = connection.execute("SELECT table_name FROM gpkg_contents WHERE data_type = 'features' LIMIT 1").fetchone()
+        return (parts[0], row[0]) if row else None
+    return None
+
+
+def reader_source(layer):
+    """Return what a task needs to read every feature of a layer off the GUI thread.
+
+    That is the provider key and the unfiltered data source, reopened by
+    open_reader() in the task, or for memory layers, which cannot be
+    reopened, an independent and unfiltered clone of the provider made here
+    on the main thread.
+    """
+    if layer.providerType() == 'memory':
+        provider = layer.dataProvider().clone()
+        provider.setSubsetString('', False)
+        return provider
+    return layer.providerType(), unfiltered_source(layer)
+
+
+def open_reader(source, subset=''):
+    """Return a provider of the caller's own for a reader_source(), with subset set.
+
+    Returns None if the source cannot be opened or rejects the subset string.
+    """
+    provider = source
+    if isinstance(source, tuple):
+        provider = QgsProviderRegistry.instance().createProvider(source[0], source[1], QgsDataProvider.ProviderOptions())
+    if provider is None or not provider.isValid():
+        return None
+    if subset and not provider.setSubsetString(subset, False):
+        return None
+    return provider
+
+
+class LayerWatcher:
+    """Data source revisions of the layers a cache holds data for.
+
+    A watched layer moves on to a new revision, and on_change(layer id) is
+    called, whenever it commits edits or its data source changes. Data read
+    in the background is tagged with the revision it was read at, and
+    dropped on arrival if the layer has moved on since.
+    """
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        # layer id -> data source revision
+        self._revisions = {}
+        # layer id -> (layer, slot) for every layer we listen to
+        self._connections = {}
+
+    def watch(self, layer):
+        """Start listening to a layer, if not yet, and return its revision."""
+        layer_id = layer.id()
+        if layer_id not in self._connections:
+            slot = lambda layer_id=layer_id: self.changed(layer_id)
+            layer.afterCommitChanges.connect(slot)
+            layer.dataSourceChanged.connect(slot)
+            self._connections[layer_id] = (layer, slot)
+        return self.revision(layer_id)
+
+    def revision(self, layer_id):
+        return self._revisions.get(layer_id, 0)
+
+    def changed(self, layer_id):
+        self._revisions[layer_id] = self.revision(layer_id) + 1
+        if self.on_change:
+            self.on_change(layer_id)
+
+    def unload(self):
+        """Disconnect from every layer; revisions are kept so late results stay stale."""
+        for layer, slot in self._connections.values():
+            try:
+                layer.afterCommitChanges.disconnect(slot)
+                layer.dataSourceChanged.disconnect(slot)
+            except (RuntimeError, TypeError):
+                # The layer has already been deleted
+                pass
+        self._connections.clear()
+
+
+class TaskSet:
+    """The running background tasks of a cache or widget.
+
+    Tasks are referenced from start() until their callback calls discard(),
+    so they are not garbage collected while the task manager runs them.
+    """
+
+    def __init__(self):
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def start(self, task):
+        """Reference a task and hand it to the task manager."""
+        self._tasks.add(task)
+        QgsApplication.taskManager().addTask(task)
+
+    def discard(self, task):
+        self._tasks.discard(task)
+
+    def cancel_all(self):
+        """Cancel every running task; each is still referenced until its callback runs."""
+        for task in list(self._tasks):
+            try:
+                task.cancel()
+            except RuntimeError:
+                # The task has already been deleted by the task manager
+                self._tasks.discard(task)
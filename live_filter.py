@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Live filtering: apply filters while the user types, visible layers first.
+"""
+from qgis.PyQt.QtCore import QSettings
+from qgis.core import QgsCoordinateTransform, QgsCsException
+
+from .filter_engine import FilterResult, validate_expression
+
+# QSettings key for the live filter mode of the Single-Filter dialog
+LIVE_FILTER_SETTING = 'AutoFilter/live_filter'
+
+# Quiet time after the last keystroke before a live filter is applied
+LIVE_FILTER_DELAY_MS = 300
+
+LIVE_DESCRIPTION = 'AutoFilter: Live Filter'
+
+
+class LiveFilter:
+    """Apply filters as they are typed, cheapest-to-see layers first.
+
+    A live preview applies the layers that are visible in the layer tree and
+    intersect the map extent first, then the other visible layers; any
+    newer input cancels whatever has not started. Hidden layers are left
+    alone while typing. Once the filter is accepted their filters are kept
+    as deferred and set only when the layer is switched on, unless another
+    filter, undo or clear supersedes them first.
+    """
+
+    def __init__(self, engine, session, project, canvas=None):
+        self.engine = engine
+        self.session = session
+        self.project = project
+        self.canvas = canvas
+        # layer id -> (subset string, native) waiting for the layer to be shown
+        self.pending = {}
+        # layer id -> subset string before the live preview changed it
+        self.touched = {}
+        # Incremented by every new input so stale steps are dropped
+        self.generation = 0
+        # Task preparing the current preview step, so only that is cancelled
+        self.task = None
+        self._connected = False
+
+    @property
+    def enabled(self):
+        return QSettings().value(LIVE_FILTER_SETTING, False, type=bool)
+
+    @enabled.setter
+    def enabled(self, enabled):
+        QSettings().setValue(LIVE_FILTER_SETTING, bool(enabled))
+
+    def is_visible(self, layer):
+        """Return True if the layer is checked in the layer tree and in scale range."""
+        node = self.project.layerTreeRoot().findLayer(layer.id())
+        if node is None or not node.isVisible():
+            return False
+        if self.canvas is not None and layer.hasScaleBasedVisibility():
+            return layer.isInScaleRange(self.canvas.scale())
+        return True
+
+    def in_view(self, layer):
+        """Return True if the layer's extent intersects the map extent."""
+        if self.canvas is None:
+            return True
+        try:
+            transform = QgsCoordinateTransform(layer.crs(), self.canvas.mapSettings().destinationCrs(), self.project)
+            extent = transform.transformBoundingBox(layer.extent())
+        except QgsCsException:
+            return True
+        return extent.isEmpty() or extent.intersects(self.canvas.extent())
+
+    def split(self, plan):
+        """Return (in view, other visible, hidden) parts of a plan."""
+        in_view, visible, hidden = {}, {}, {}
+        for layer_id, expression in plan.items():
+            layer = self.project.mapLayer(layer_id)
+            if layer is None:
+                continue
+            if not self.is_visible(layer):
+                hidden[layer_id] = expression
+            elif self.in_view(layer):
+                in_view[layer_id] = expression
+            else:
+                visible[layer_id] = expression
+        return in_view, visible, hidden
+
+    def begin(self):
+        """Start a live session (the dialog is about to be shown)."""
+        self.touched.clear()
+        self.generation += 1
+
+    def preview(self, plan, native=()):
+        """Apply the visible layers of a plan, in view first."""
+        self.generation += 1
+        generation = self.generation
+        plan, native, trusted = self._with_restores(plan, native)
+        self.session.remember(plan)
+        for layer_id in plan:
+            layer = self.project.mapLayer(layer_id)
+            if layer is not None:
+                self.touched.setdefault(layer_id, self.engine.subset_string(layer))
+        in_view, visible, _hidden = self.split(plan)
+
+        def next_step(result):
+            # A newer input has superseded this preview
+            if generation == self.generation and not result.cancelled and visible:
+                self.task = self.engine.submit(LIVE_DESCRIPTION, visible, None, native, profile=False, trusted=trusted)
+
+        self.task = self.engine.submit(LIVE_DESCRIPTION, in_view, next_step, native, profile=False, trusted=trusted)
+
+    def accept(self, plan, native=()):
+        """Return (plan to apply now, deferred plan, native, trusted) for an accepted filter.
+
+        Layers changed by an earlier live preview but left out of the final
+        plan get their original filter back; those are trusted.
+        """
+        self.cancel()
+        plan, native, trusted = self._with_restores(plan, native)
+        self.touched.clear()
+        in_view, visible, hidden = self.split(plan)
+        in_view.update(visible)
+        return in_view, hidden, native, trusted
+
+    def cancel(self):
+        """Drop the live preview still in flight, leaving other filters alone."""
+        self.generation += 1
+        if self.task is not None:
+            self.engine.cancel(self.task)
+            self.task = None
+
+    def restore(self):
+        """Undo the live preview after the dialog was cancelled."""
+        self.cancel()
+        plan = {}
+        for layer_id, expression in self.touched.items():
+            layer = self.project.mapLayer(layer_id)
+            if layer is not None and self.engine.subset_string(layer) != expression:
+                plan[layer_id] = expression
+        self.touched.clear()
+        if plan:
+            self.task = self.engine.submit(LIVE_DESCRIPTION, plan, None, profile=False, trusted=set(plan))
+
+    def defer(self, plan, native=()):
+        """Keep the filters of hidden layers until the layers are shown."""
+        for layer_id, expression in plan.items():
+            self.pending[layer_id] = (expression, layer_id in native)
+        if self.pending and not self._connected:
+            self.project.layerTreeRoot().visibilityChanged.connect(self._on_visibility_changed)
+            self._connected = True
+
+    def discard(self):
+        """Forget deferred filters superseded by a newer operation."""
+        self.pending.clear()
+        self._disconnect()
+
+    def unload(self):
+        self.cancel()
+        self.discard()
+
+    def _with_restores(self, plan, native):
+        # Put back the layers a previous preview changed and this plan leaves out
+        plan = dict(plan)
+        trusted = set()
+        for layer_id, expression in self.touched.items():
+            if layer_id not in plan:
+                plan[layer_id] = expression
+                trusted.add(layer_id)
+        return plan, native, trusted
+
+    def _on_visibility_changed(self, node):
+        ready = {}
+        native = set()
+        for layer_id, (expression, is_native) in list(self.pending.items()):
+            layer = self.project.mapLayer(layer_id)
+            if layer is None:
+                del self.pending[layer_id]
+            elif self.is_visible(layer):
+                del self.pending[layer_id]
+                ready[layer_id] = expression
+                if is_native:
+                    native.add(layer_id)
+        if not self.pending:
+            self._disconnect()
+        # Few layers at a time: validate and set them right away
+        plan = {}
+        for layer_id, expression in ready.items():
+            layer = self.project.mapLayer(layer_id)
+            field_names = None if layer_id in native else layer.fields().names()
+            if validate_expression(expression, field_names) is None:
+                plan[layer_id] = expression
+        if plan:
+            result = FilterResult()
+            result.description = LIVE_DESCRIPTION
+            self.engine.apply(plan, result)
+
+    def _disconnect(self):
+        if self._connected:
+            try:
+                self.project.layerTreeRoot().visibilityChanged.disconnect(self._on_visibility_changed)
+            except (RuntimeError, TypeError):
+                pass
+            self._connected = False
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Per-layer match counts of a filter plan, computed before it is applied.
+"""
+from qgis.PyQt.QtWidgets import QCheckBox, QHBoxLayout, QPushButton, QTableWidget, QTableWidgetItem, QVBoxLayout, QWidget
+from qgis.core import QgsFeatureRequest, QgsTask
+
+from .criteria import NO_MATCH
+from .layer_sources import LayerWatcher, TaskSet, open_reader, reader_source
+
+
+def input_key(*parts):
+    """Return a hashable key for the input of a filter, such as its criterion and values."""
+    return tuple(input_key(*part) if isinstance(part, (list, tuple)) else part for part in parts)
+
+
+class CountMatchesTask(QgsTask):
+    """Count the features of one layer matching a subset string.
+
+    The count runs on a provider of the task's own with the subset string
+    set on it, reading no geometry and only the criterion attributes, so the
+    layer on the canvas is neither touched nor reloaded.
+    """
+
+    def __init__(self, description, layer_id, source, expression, fields, callback=None):
+        super().__init__(description, QgsTask.CanCancel)
+        self.layer_id = layer_id
+        # Provider key and unfiltered source, or a cloned provider
+        self.source = source
+        self.expression = expression
+        self.fields = fields
+        self.callback = callback
+        self.count = None
+
+    def run(self):
+        provider = open_reader(self.source, self.expression)
+        if provider is None:
+            return False
+        request = QgsFeatureRequest()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes(self.fields, provider.fields())
+        count = 0
+        for count, _feature in enumerate(provider.getFeatures(request), 1):
+            if count % 1000 == 0 and self.isCanceled():
+                return False
+        self.count = count
+        return True
+
+    def finished(self, result):
+        if self.callback:
+            self.callback(self, result)
+
+
+class MatchPreviewWidget(QWidget):
+    """Preview button, cancel button and streaming per-layer count table.
+
+    plan_provider is called when the preview starts and returns
+    (plan, criterion, input key) for the dialog's current input, or None if
+    the input is not valid. The input key (see input_key()) identifies the
+    criterion and values counted, which the plan applied later may express
+    differently, for instance through a lookup table. Counts are counted
+    concurrently, one task per layer, and rows are filled in as tasks
+    finish. A layer's count is dropped when it commits edits or changes data
+    source.
+    """
+
+    def __init__(self, field_index, plan_provider, parent=None):
+        super().__init__(parent)
+        self.field_index = field_index
+        self.plan_provider = plan_provider
+        # layer id -> (input key, count) of finished counts
+        self.counts = {}
+        self.watcher = LayerWatcher(lambda layer_id: self.counts.pop(layer_id, None))
+        self.tasks = TaskSet()
+        # Bumped on every start/cancel so stale counts are ignored
+        self.generation = 0
+        self._running = 0
+        self._rows = {}
+
+        self.preview_button = QPushButton('Preview Matches', self)
+        self.preview_button.clicked.connect(self.start)
+        self.cancel_button = QPushButton('Cancel Preview', self)
+        self.cancel_button.clicked.connect(self.cancel)
+        self.cancel_button.setEnabled(False)
+
+        self.table = QTableWidget(0, 2, self)
+        self.table.setHorizontalHeaderLabels(['Layer', 'Matches'])
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.hide()
+
+        self.skip_empty_check = QCheckBox('Empty layers with no matches without running their filter', self)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.preview_button)
+        buttons.addWidget(self.cancel_button)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(buttons)
+        layout.addWidget(self.table)
+        layout.addWidget(self.skip_empty_check)
+        self.setLayout(layout)
+
+    def start(self):
+        """Count the matches of the current input on every planned layer."""
+        self.cancel()
+        planned = self.plan_provider()
+        if planned is None:
+            return
+        plan, criterion, key = planned
+        project = self.field_index.project
+        self.counts.clear()
+        self._rows.clear()
+        self.table.setRowCount(0)
+        self.table.show()
+        for layer_id, expression in plan.items():
+            layer = project.mapLayer(layer_id)
+            if layer is None:
+                continue
+            row = self.table.rowCount()
+            self.table.insertRow(row)
+            self.table.setItem(row, 0, QTableWidgetItem(layer.name()))
+            self.table.setItem(row, 1, QTableWidgetItem('counting…'))
+            self._rows[layer_id] = row
+            task = CountMatchesTask(f'AutoFilter: Count matches in {layer.name()}', layer_id, reader_source(layer), expression,
+                                    self.field_index.fields_for(criterion, layer_id), self._count_finished)
+            task.generation = self.generation
+            task.key = key
+            task.revision = self.watcher.watch(layer)
+            self._running += 1
+            self.tasks.start(task)
+        self.cancel_button.setEnabled(self._running > 0)
+
+    def cancel(self):
+        """Cancel every count still running."""
+        self.tasks.cancel_all()
+        self.generation += 1
+        self._running = 0
+        self.cancel_button.setEnabled(False)
+
+    def reset(self):
+        """Cancel the preview and forget its counts."""
+        self.cancel()
+        self.counts.clear()
+        self._rows.clear()
+        self.table.setRowCount(0)
+        self.table.hide()
+
+    def unload(self):
+        """Cancel the preview and stop listening to layers."""
+        self.cancel()
+        self.watcher.unload()
+
+    def filter_plan(self, plan, key):
+        """Give layers previewed with no matches for the input key a trivial no-match filter, if asked to.
+
+        The layers still end up empty, as the filter would leave them, and
+        do not keep a filter from before, but the provider never evaluates
+        the real expression.
+        """
+        if not self.skip_empty_check.isChecked():
+            return plan
+        return {layer_id: NO_MATCH if self.counts.get(layer_id) == (key, 0) else expression
+                for layer_id, expression in plan.items()}
+
+    def _count_finished(self, task, result):
+        self.tasks.discard(task)
+        if task.generation != self.generation:
+            # The preview was cancelled or restarted meanwhile
+            return
+        self._running -= 1
+        self.cancel_button.setEnabled(self._running > 0)
+        row = self._rows.get(task.layer_id)
+        # A count read before an edit was committed is stale
+        if result and task.revision == self.watcher.revision(task.layer_id):
+            self.counts[task.layer_id] = (task.key, task.count)
+        if row is not None:
+            self.table.setItem(row, 1, QTableWidgetItem(str(task.count) if result else 'failed'))
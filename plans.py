@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Filter plans: the subset string each layer gets for a criterion and values.
+
+ Nothing here uses a dialog or the QGIS interface, so plans can be built by
+ the plugin and by the headless batch runner alike.
+"""
+from .criteria import SCHEMA
+from .sql_dialect import dialect_for
+
+
+def layers_in_scope(field_index, criterion, layer_ids=None):
+    """Return (layer, fields) pairs of a criterion, only those in layer_ids unless it is None."""
+    layers = field_index.layers_for(criterion)
+    if layer_ids is None:
+        return layers
+    return [(layer, fields) for layer, fields in layers if layer.id() in layer_ids]
+
+
+def single_filter_plan(field_index, filter_criteria, value_to_filter, layer_ids=None):
+    """Return ({layer id: subset string}, native layer ids) for one value.
+
+    value_to_filter is a [start, end] pair of ISO dates for range criteria
+    such as "Period Of Time". layer_ids, if given, limits the plan to those
+    layers.
+    """
+    plan = {}
+    native = set()
+    criterion = SCHEMA[filter_criteria]
+    values = list(value_to_filter) if criterion.is_range else [value_to_filter]
+    # Only visit the layers that carry one of the criterion's fields
+    for layer, fields in layers_in_scope(field_index, filter_criteria, layer_ids):
+        # Typed literals compared on every matching field
+        dialect = dialect_for(layer)
+        plan[layer.id()] = criterion.expression(layer.fields(), fields, values, dialect)
+        if dialect.native:
+            native.add(layer.id())
+    return plan, native
+
+
+def multi_filter_plan(field_index, criterion, values, value_store=None, layer_ids=None):
+    """Return ({layer id: subset string}, native layer ids) for a value list.
+
+    Without a value_store every list is inlined in the provider's set
+    membership syntax (IN (...), = ANY(ARRAY[...]), ...).
+    """
+    plan = {}
+    native = set()
+    compiled = SCHEMA[criterion]
+    # Only visit the layers that carry one of the criterion's fields
+    for layer, fields in layers_in_scope(field_index, criterion, layer_ids):
+        dialect = dialect_for(layer)
+        if dialect.native:
+            native.add(layer.id())
+        if value_store is None:
+            plan[layer.id()] = compiled.expression(layer.fields(), fields, values, dialect)
+            continue
+        filter_strings = []
+        for field in fields:
+            # Small lists are inlined, large ones go through a lookup table
+            expression, is_native = value_store.membership_expression(
+                layer, field, values, lambda field, values: compiled.expression(layer.fields(), [field], values, dialect))
+            filter_strings.append(expression)
+            if is_native:
+                native.add(layer.id())
+        plan[layer.id()] = ' OR '.join(filter_strings)
+    return plan, native
+
+
+def composite_plan(field_index, predicates, operator='AND', planner=None, layer_ids=None):
+    """Return ({layer id: subset string}, native layer ids) for several criteria.
+
+    predicates are (criterion, values) pairs, each matched like a
+    Multi-Filter value list (or a [start, end] pair for a range criterion)
+    and joined by operator ('AND' or 'OR'). Every layer is filtered on the
+    predicates whose fields it carries; a planner (see query_planner)
+    orders them for that layer, otherwise they keep the given order.
+    """
+    # layer id -> (layer, [(criterion, fields, values)])
+    per_layer = {}
+    for criterion, values in predicates:
+        for layer, fields in layers_in_scope(field_index, criterion, layer_ids):
+            per_layer.setdefault(layer.id(), (layer, []))[1].append((criterion, fields, list(values)))
+    plan = {}
+    native = set()
+    for layer_id, (layer, items) in per_layer.items():
+        if planner is not None:
+            items = planner.order(layer, items, operator)
+        dialect = dialect_for(layer)
+        parts = [SCHEMA[criterion].expression(layer.fields(), fields, values, dialect)
+                 for criterion, fields, values in items]
+        plan[layer_id] = parts[0] if len(parts) == 1 else f' {operator} '.join(f'({part})' for part in parts)
+        if dialect.native:
+            native.add(layer_id)
+    return plan, native
+
+
+def filter_plan(field_index, criterion, values):
+    """Return the plan of a criterion and its values, as the dialogs build it.
+
+    One value (or a [start, end] pair for a range criterion) gives a
+    Single-Filter plan, several values a Multi-Filter plan.
+    """
+    if SCHEMA[criterion].is_range:
+        return single_filter_plan(field_index, criterion, list(values))
+    if len(values) == 1:
+        return single_filter_plan(field_index, criterion, values[0])
+    return multi_filter_plan(field_index, criterion, values)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Per-layer timings of every applied filter and a slowest-layers summary.
+"""
+import datetime
+import json
+import time
+
+from qgis.PyQt.QtCore import QSettings
+from qgis.PyQt.QtWidgets import QAbstractItemView, QLabel, QTableWidget, QTableWidgetItem, QVBoxLayout, QWidget
+from qgis.core import Qgis, QgsMessageLog
+
+# QSettings keys: profiling on/off, extent and count timing, and the optional JSON-lines log file
+PROFILE_SETTING = 'AutoFilter/profile_filters'
+PROFILE_DETAILS_SETTING = 'AutoFilter/profile_extent_count'
+PROFILE_LOG_SETTING = 'AutoFilter/profile_log'
+
+# Characters of a subset string kept in the log; lookup and id lists can be huge
+LOGGED_EXPRESSION_LENGTH = 200
+
+# Tag of the AutoFilter tab in the QGIS log messages panel
+LOG_TAG = 'AutoFilter'
+
+# Layers listed in the slowest-layers summary
+SLOWEST_LAYERS = 5
+
+
+def profile_log_path():
+    """Return the JSON-lines file profiles are appended to ('' for none)."""
+    return QSettings().value(PROFILE_LOG_SETTING, '', type=str)
+
+
+def set_profile_log_path(path):
+    QSettings().setValue(PROFILE_LOG_SETTING, path or '')
+
+
+def profile_details_enabled():
+    """Return True if profiles also time the extent and feature count (extra provider queries)."""
+    return QSettings().value(PROFILE_DETAILS_SETTING, False, type=bool)
+
+
+def set_profile_details_enabled(enabled):
+    QSettings().setValue(PROFILE_DETAILS_SETTING, bool(enabled))
+
+
+def shorten(expression, length=LOGGED_EXPRESSION_LENGTH):
+    """Return a subset string cut to a loggable length."""
+    if len(expression) <= length:
+        return expression
+    return f'{expression[:length]}… ({len(expression)} characters)'
+
+
+def elapsed_ms(start):
+    return (time.perf_counter() - start) * 1000.0
+
+
+class FilterProfile:
+    """Per-layer timings of one apply or clear operation.
+
+    For every layer it records the provider, the time spent in
+    setSubsetString (which reloads the provider) and the start of the subset
+    string. With details, it also times recomputing the extent and counting
+    the features left by the filter; both query the provider again, so they
+    are off unless asked for.
+    """
+
+    def __init__(self, description, details=None):
+        self.description = description
+        self.details = profile_details_enabled() if details is None else details
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self.layers = []
+        self.total_ms = 0.0
+
+    def apply(self, layer, expression):
+        """Set a layer's subset string, timing it and what follows it."""
+        start = time.perf_counter()
+        applied = layer.setSubsetString(expression)
+        subset_ms = elapsed_ms(start)
+        if not applied:
+            # The provider rejected the filter; the engine reports it
+            return False
+
+        extent_ms = count_ms = 0.0
+        feature_count = None
+        if self.details:
+            start = time.perf_counter()
+            layer.updateExtents()
+            layer.extent()
+            extent_ms = elapsed_ms(start)
+
+            start = time.perf_counter()
+            feature_count = layer.featureCount()
+            count_ms = elapsed_ms(start)
+
+        self.layers.append({
+            'layer_id': layer.id(),
+            'layer': layer.name(),
+            'provider': layer.providerType(),
+            'subset_ms': round(subset_ms, 2),
+            'extent_ms': round(extent_ms, 2),
+            'count_ms': round(count_ms, 2),
+            'total_ms': round(subset_ms + extent_ms + count_ms, 2),
+            'feature_count': feature_count,
+            'expression': shorten(expression),
+            'applied': applied,
+        })
+        self.total_ms += subset_ms + extent_ms + count_ms
+        return applied
+
+    def slowest(self, count=SLOWEST_LAYERS):
+        return sorted(self.layers, key=lambda entry: entry['total_ms'], reverse=True)[:count]
+
+    def summary(self):
+        """Return a one-line summary naming the slowest layers."""
+        slowest = ', '.join(f"{entry['layer']} ({entry['provider']}) {entry['total_ms']:.0f} ms" for entry in self.slowest())
+        return f'{self.description}: {len(self.layers)} layer(s) in {self.total_ms:.0f} ms; slowest: {slowest}'
+
+    def log(self):
+        """Send the profile to the QGIS message log and the JSON-lines file, if set."""
+        if not self.layers:
+            return
+        QgsMessageLog.logMessage(self.summary(), LOG_TAG, Qgis.Info)
+        for entry in self.layers:
+            details = ''
+            if self.details:
+                details = (f"extent {entry['extent_ms']:.1f} ms, count {entry['count_ms']:.1f} ms, "
+                           f"{entry['feature_count']} feature(s), ")
+            QgsMessageLog.logMessage(
+                f"{entry['layer']} [{entry['provider']}]: setSubsetString {entry['subset_ms']:.1f} ms, "
+                f"{details}filter: {entry['expression']}", LOG_TAG, Qgis.Info)
+        path = profile_log_path()
+        if not path:
+            return
+        try:
+            with open(path, 'a', encoding='utf-8') as log_file:
+                for entry in self.layers:
+                    log_file.write(json.dumps(dict(entry, operation=self.description, time=self.started)) + '\n')
+        except OSError as e:
+            QgsMessageLog.logMessage(f'Cannot write the filter profile to {path}: {e}', LOG_TAG, Qgis.Warning)
+
+
+class SlowLayersWidget(QWidget):
+    """Table of the slowest layers of the last filter operation."""
+
+    COLUMNS = ('Layer', 'Provider', 'Filter ms', 'Extent ms', 'Count ms', 'Features')
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.title = QLabel(self)
+        self.table = QTableWidget(0, len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().hide()
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setMaximumHeight(150)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.title)
+        layout.addWidget(self.table)
+        self.setLayout(layout)
+        self.hide()
+
+    def show_profile(self, profile):
+        """Show the slowest layers of a profile, or hide the widget if there is none."""
+        if profile is None or not profile.layers:
+            self.hide()
+            return
+        self.title.setText(f'Slowest layers of the last operation ({profile.description}, '
+                           f'{len(profile.layers)} layer(s) in {profile.total_ms:.0f} ms):')
+        slowest = profile.slowest()
+        self.table.setRowCount(len(slowest))
+        for row, entry in enumerate(slowest):
+            cells = (entry['layer'], entry['provider'], f"{entry['subset_ms']:.0f}", f"{entry['extent_ms']:.0f}",
+                     f"{entry['count_ms']:.0f}", '-' if entry['feature_count'] is None else str(entry['feature_count']))
+            for column, text in enumerate(cells):
+                item = QTableWidgetItem(text)
+                if column == 0:
+                    item.setToolTip(entry['expression'])
+                self.table.setItem(row, column, item)
+        self.show()
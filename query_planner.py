@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Selectivity estimates that order the predicates of a composite filter.
+"""
+from bisect import bisect_left
+
+from qgis.core import QgsExpression, QgsExpressionContext, QgsFeatureRequest, QgsTask
+
+from .attribute_index import INDEXED
+from .criteria import SCHEMA
+from .layer_sources import LayerWatcher, TaskSet, open_reader, reader_source
+
+# Features read per layer to estimate predicates the catalog cannot. They
+# are the first features in provider order, not a random sample, so a layer
+# stored sorted or clustered by a filtered field can be misjudged.
+SAMPLE_SIZE = 1000
+
+# An index-backed AND predicate costs this share of an unindexed one
+INDEX_WEIGHT = 0.5
+
+# Operators a composite filter joins its predicates with
+COMPOSITE_OPERATORS = ('AND', 'OR')
+
+
+class SampleTask(QgsTask):
+    """Read the first features of a layer's unfiltered source, attributes only.
+
+    Providers return features in storage order, so this is a first-N read,
+    which is cheap on any provider, rather than a random sample.
+    """
+
+    def __init__(self, description, layer_id, source, fields, limit, callback=None):
+        super().__init__(description, QgsTask.CanCancel)
+        self.layer_id = layer_id
+        self.source = source
+        self.fields = fields
+        self.limit = limit
+        self.callback = callback
+        # (QgsFields of the features, features)
+        self.sample = None
+
+    def run(self):
+        provider = open_reader(self.source)
+        if provider is None:
+            return False
+        request = QgsFeatureRequest()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes(sorted(self.fields), provider.fields())
+        request.setLimit(self.limit)
+        features = []
+        for feature in provider.getFeatures(request):
+            if self.isCanceled():
+                return False
+            features.append(feature)
+        self.sample = (provider.fields(), features)
+        return True
+
+    def finished(self, result):
+        if self.callback:
+            self.callback(self, result)
+
+
+class SelectivityPlanner:
+    """Order the predicates of a composite filter for each layer.
+
+    The selectivity of a predicate is the estimated share of a layer's
+    features it keeps. Text and integer predicates are estimated from the
+    value catalog, as the share of a field's distinct values they ask for;
+    dates, ranges and fields not catalogued yet are evaluated on the first
+    sample_size features of the layer in provider order. That is only an
+    estimate: it misjudges layers whose storage order follows a filtered
+    field. The sample is read in the background once per layer and data
+    source revision; until it arrives such predicates count as keeping
+    every feature. Attribute indexes only count once their
+    state is known, so ordering never queries a database.
+
+    AND filters put the most selective predicates first, index-backed ones
+    weighted ahead, so both the provider and QGIS can discard rows early.
+    OR filters put the predicates keeping the most features first, since
+    the first true predicate decides a row.
+    """
+
+    def __init__(self, value_catalog=None, index_manager=None, sample_size=SAMPLE_SIZE):
+        self.value_catalog = value_catalog
+        self.index_manager = index_manager
+        self.sample_size = sample_size
+        # layer id -> (sampled fields, QgsFields, features)
+        self._samples = {}
+        # Layers being sampled by a running task
+        self._pending = set()
+        self.watcher = LayerWatcher(self.invalidate_layer)
+        self.tasks = TaskSet()
+
+    def order(self, layer, items, operator='AND'):
+        """Return (criterion, fields, values) items in evaluation order for a layer."""
+        if len(items) < 2:
+            return list(items)
+        sample = False
+        keyed = []
+        for position, (criterion, fields, values) in enumerate(items):
+            fraction = self.catalog_selectivity(layer, criterion, fields, values)
+            if fraction is None:
+                if sample is False:
+                    # One read per layer serves every predicate
+                    sample = self.sample(layer, {field for _criterion, fields, _values in items for field in fields})
+                fraction = self.sample_selectivity(layer, criterion, fields, values, sample)
+            if operator == 'OR':
+                cost = -fraction
+            else:
+                cost = fraction * (INDEX_WEIGHT if self.is_indexed(layer, fields) else 1.0)
+            keyed.append((cost, position))
+        keyed.sort()
+        return [items[position] for _cost, position in keyed]
+
+    def catalog_selectivity(self, layer, criterion, fields, values):
+        """Return the share of distinct values a predicate asks for, or None if unknown."""
+        compiled = SCHEMA[criterion]
+        if self.value_catalog is None or compiled.is_range or compiled.value_type == 'date':
+            return None
+        fraction = 0.0
+        for field in fields:
+            distinct = self.value_catalog.field_values(layer.id(), field)
+            if distinct is None:
+                return None
+            if not distinct:
+                continue
+            # Assume every distinct value is about as frequent as the others
+            hits = 0
+            for value in set(values):
+                position = bisect_left(distinct, value)
+                if position < len(distinct) and distinct[position] == value:
+                    hits += 1
+            fraction += hits / len(distinct)
+        return min(fraction, 1.0)
+
+    def sample(self, layer, fields):
+        """Return the cached (QgsFields, features) sample of a layer, or None if not read yet.
+
+        A missing sample, or one lacking some of the fields, is read in the
+        background for the next time.
+        """
+        cached = self._samples.get(layer.id())
+        if cached is not None and fields <= cached[0]:
+            return cached[1:]
+        if layer.id() in self._pending:
+            return None
+        if cached is not None:
+            fields = fields | cached[0]
+        revision = self.watcher.watch(layer)
+
+        def done(task, result):
+            self.tasks.discard(task)
+            self._pending.discard(task.layer_id)
+            # A sample read before an edit was committed is stale
+            if result and revision == self.watcher.revision(task.layer_id):
+                self._samples[task.layer_id] = (task.fields,) + task.sample
+
+        task = SampleTask(f'AutoFilter: Sample {layer.name()}', layer.id(), reader_source(layer), fields,
+                          self.sample_size, done)
+        self._pending.add(layer.id())
+        self.tasks.start(task)
+        return None
+
+    def sample_selectivity(self, layer, criterion, fields, values, sample):
+        """Return the share of sampled features a predicate keeps (1.0 without a sample)."""
+        if not sample or not sample[1]:
+            return 1.0
+        sample_fields, features = sample
+        expression = QgsExpression(SCHEMA[criterion].expression(layer.fields(), fields, values))
+        context = QgsExpressionContext()
+        context.setFields(sample_fields)
+        expression.prepare(context)
+        kept = 0
+        for feature in features:
+            context.setFeature(feature)
+            if expression.evaluate(context):
+                kept += 1
+        return kept / len(features)
+
+    def is_indexed(self, layer, fields):
+        """Return True if an attribute index is known to back any of the predicate's fields."""
+        if self.index_manager is None:
+            return False
+        return any(self.index_manager.known_state(layer, field) == INDEXED for field in fields)
+
+    def invalidate_layer(self, layer_id):
+        self._samples.pop(layer_id, None)
+
+    def unload(self):
+        self.tasks.cancel_all()
+        self._pending.clear()
+        self.watcher.unload()
+        self._samples.clear()
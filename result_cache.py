@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Cache of filter results: the feature ids each filter kept on each layer.
+"""
+import sys
+from array import array
+from collections import OrderedDict
+
+from qgis.PyQt.QtCore import QSettings
+from qgis.core import QgsFeatureRequest, QgsTask
+
+from .fid_index import fid_subset_string
+from .layer_sources import LayerWatcher, TaskSet, open_reader, reader_source
+
+# QSettings keys for the result cache
+RESULT_CACHE_SETTING = 'AutoFilter/result_cache'
+RESULT_CACHE_BUDGET_SETTING = 'AutoFilter/result_cache_mb'
+RESULT_CACHE_MAX_IDS_SETTING = 'AutoFilter/result_cache_max_ids'
+
+# Default memory cap of the cache, in megabytes
+DEFAULT_BUDGET_MB = 64
+
+# Default number of ids above which a filter is not cached: the id list
+# would cost the provider more to parse than the filter it replaces
+DEFAULT_MAX_IDS = 10000
+
+
+class CollectResultsTask(QgsTask):
+    """Read the ids of the features each filter keeps, without attributes or geometry.
+
+    Every layer is read on a provider of the task's own with the filter
+    set, so the layers on the canvas are neither touched nor reloaded.
+    """
+
+    def __init__(self, description, jobs, max_ids, callback=None):
+        super().__init__(description, QgsTask.CanCancel)
+        # [(layer id, revision, expression, reader source)]
+        self.jobs = jobs
+        # Filters keeping more features than this are left out
+        self.max_ids = max_ids
+        self.callback = callback
+        # (layer id, revision, expression) -> array of feature ids
+        self.results = {}
+
+    def run(self):
+        for i, (layer_id, revision, expression, source) in enumerate(self.jobs):
+            provider = open_reader(source, expression)
+            if provider is None:
+                continue
+            request = QgsFeatureRequest()
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+            request.setNoAttributes()
+            request.setLimit(self.max_ids + 1)
+            fids = array('q')
+            for count, feature in enumerate(provider.getFeatures(request), 1):
+                if count % 1000 == 0 and self.isCanceled():
+                    return False
+                fids.append(feature.id())
+            if len(fids) <= self.max_ids:
+                self.results[(layer_id, revision, expression)] = fids
+            self.setProgress(100.0 * (i + 1) / len(self.jobs))
+        return True
+
+    def finished(self, result):
+        if self.callback:
+            self.callback(self, result)
+
+
+class ResultCache:
+    """Feature ids per (layer id, data source revision, expression), least recently used first out.
+
+    After a filter is applied, the ids of the features it kept are read in
+    the background. Applying the same filter to the layer again then sets a
+    feature-id subset string instead, so the provider only looks up ids and
+    does not evaluate the filter again. A layer's revision moves on, and
+    its entries are dropped, when it commits edits or its data source
+    changes. Entries are evicted least recently used first to stay within
+    the memory budget.
+
+    The cache is off by default. Filters keeping more than max_ids features
+    are never cached, so a long id list does not replace a cheap filter.
+    """
+
+    def __init__(self, project):
+        self.project = project
+        # (layer id, revision, expression) -> array of feature ids, least recently used first
+        self._results = OrderedDict()
+        self.watcher = LayerWatcher(self.invalidate_layer)
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.tasks = TaskSet()
+
+    @property
+    def enabled(self):
+        return QSettings().value(RESULT_CACHE_SETTING, False, type=bool)
+
+    @enabled.setter
+    def enabled(self, enabled):
+        QSettings().setValue(RESULT_CACHE_SETTING, bool(enabled))
+        if not enabled:
+            self.clear()
+
+    @property
+    def budget(self):
+        """Memory cap of the cache, in bytes."""
+        return QSettings().value(RESULT_CACHE_BUDGET_SETTING, DEFAULT_BUDGET_MB, type=int) * 1024 * 1024
+
+    @property
+    def max_ids(self):
+        """Number of feature ids above which a filter is not cached."""
+        return QSettings().value(RESULT_CACHE_MAX_IDS_SETTING, DEFAULT_MAX_IDS, type=int)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def lookup(self, layer, expression):
+        """Return the cached feature-id subset string of a filter on a layer, or None."""
+        if not self.enabled or not expression:
+            return None
+        key = (layer.id(), self.watcher.revision(layer.id()), expression)
+        fids = self._results.get(key)
+        if fids is None:
+            self.misses += 1
+            return None
+        subset, _native = fid_subset_string(layer, fids)
+        if subset is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._results.move_to_end(key)
+        return subset
+
+    def collect(self, plan):
+        """Read and cache in the background the feature ids a plan's filters keep."""
+        if not self.enabled:
+            return
+        jobs = []
+        for layer_id, expression in plan.items():
+            layer = self.project.mapLayer(layer_id)
+            # Only filters applied as given, on layers that can be filtered by id
+            if layer is None or not expression or layer.subsetString() != expression:
+                continue
+            if fid_subset_string(layer, [])[0] is None:
+                continue
+            revision = self.watcher.watch(layer)
+            if (layer_id, revision, expression) in self._results:
+                continue
+            jobs.append((layer_id, revision, expression, reader_source(layer)))
+        if not jobs:
+            return
+
+        def done(task, result):
+            self.tasks.discard(task)
+            for key, fids in task.results.items():
+                # Results read before an edit was committed are stale
+                if key[1] == self.watcher.revision(key[0]):
+                    self._store(key, fids)
+
+        task = CollectResultsTask('AutoFilter: Cache filter results', jobs, self.max_ids, done)
+        self.tasks.start(task)
+
+    def invalidate_layer(self, layer_id):
+        """Drop the entries of a layer that has moved on to a new revision."""
+        for key in [key for key in self._results if key[0] == layer_id]:
+            self.memory -= entry_size(key, self._results.pop(key))
+
+    def clear(self):
+        self._results.clear()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Return a one-line summary of entries, memory use and hit rate."""
+        return (f'{len(self._results)} result(s), {self.memory / 1048576:.1f} MB of {self.budget / 1048576:.0f} MB, '
+                f'{self.hits} hit(s), {self.misses} miss(es), hit rate {self.hit_rate:.0%}')
+
+    def unload(self):
+        self.tasks.cancel_all()
+        self.watcher.unload()
+        self.clear()
+
+    def _store(self, key, fids):
+        size = entry_size(key, fids)
+        if size > self.budget:
+            return
+        if key in self._results:
+            self.memory -= entry_size(key, self._results.pop(key))
+        self._results[key] = fids
+        self.memory += size
+        # Evict least recently used results until the budget is met
+        while self.memory > self.budget:
+            evicted_key, evicted = self._results.popitem(last=False)
+            self.memory -= entry_size(evicted_key, evicted)
+
+
+def entry_size(key, fids):
+    """Return the approximate memory used by a cache entry, its expression included."""
+    return sys.getsizeof(fids) + sys.getsizeof(key[2])
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Filter session: original subset strings and undo/redo snapshots.
+"""
+
+
+class FilterSession:
+    """Track the layers AutoFilter changes and the filters it applied.
+
+    The first time a layer is part of a plan its current subset string is
+    kept as its original. Every applied plan then pushes a snapshot of the
+    subset strings of all touched layers. Clearing restores only touched
+    layers to their originals, and undo/redo plan only the layers whose
+    subset string differs from the target snapshot.
+
+    subset_string(layer), if given, returns the filter a layer shows as it
+    was asked for (see FilterEngine.subset_string), so snapshots never hold
+    the feature-id lists the result cache sets in its place.
+    """
+
+    def __init__(self, project, subset_string=None):
+        self.project = project
+        self.subset_string = subset_string or (lambda layer: layer.subsetString())
+        # layer id -> subset string before AutoFilter first changed it
+        self.originals = {}
+        # [{layer id: subset string}] after each applied plan
+        self.snapshots = []
+        # Index of the snapshot the layers are in; -1 is the original state
+        self.position = -1
+        self.project.cleared.connect(self.reset)
+
+    def reset(self):
+        """Forget every original and snapshot (for instance on a new project)."""
+        self.originals.clear()
+        self.snapshots.clear()
+        self.position = -1
+
+    def unload(self):
+        try:
+            self.project.cleared.disconnect(self.reset)
+        except (RuntimeError, TypeError):
+            pass
+
+    def remember(self, plan):
+        """Record the original subset string of layers a plan is about to change."""
+        for layer_id in plan:
+            if layer_id not in self.originals:
+                layer = self.project.mapLayer(layer_id)
+                if layer is not None:
+                    self.originals[layer_id] = self.subset_string(layer)
+
+    def commit(self, deferred=None, amend=None):
+        """Push the current subset strings of every touched layer as a snapshot.
+
+        deferred holds filters that belong to the snapshot but are only set
+        later, such as those of hidden layers in live mode. amend, if given,
+        lists layers whose current filters complete the latest snapshot
+        instead, such as the linked layers of the filter it was taken for.
+        """
+        snapshot = self._current()
+        if amend is not None and self.position >= 0:
+            self.snapshots[self.position].update(
+                {layer_id: snapshot[layer_id] for layer_id in amend if layer_id in snapshot})
+            return
+        snapshot.update(deferred or {})
+        if self.position >= 0 and self.snapshots[self.position] == snapshot:
+            return
+        # A new filter discards whatever could have been redone
+        del self.snapshots[self.position + 1:]
+        self.snapshots.append(snapshot)
+        self.position = len(self.snapshots) - 1
+
+    def clear_plan(self):
+        """Return the plan restoring touched layers to their original filters."""
+        return self._diff(self.originals)
+
+    def can_undo(self):
+        return self.position >= 0
+
+    def can_redo(self):
+        return self.position < len(self.snapshots) - 1
+
+    def undo_plan(self):
+        """Return the plan going back one snapshot, or None."""
+        if not self.can_undo():
+            return None
+        return self._diff(self._state(self.position - 1))
+
+    def redo_plan(self):
+        """Return the plan going forward one snapshot, or None."""
+        if not self.can_redo():
+            return None
+        return self._diff(self._state(self.position + 1))
+
+    def moved(self, step):
+        """Move the position after an undo (-1) or redo (+1) plan was applied."""
+        self.position = max(-1, min(len(self.snapshots) - 1, self.position + step))
+
+    def expressions(self):
+        """Return every subset string an undo or redo could still restore."""
+        expressions = set(self.originals.values())
+        for snapshot in self.snapshots:
+            expressions.update(snapshot.values())
+        return expressions
+
+    def _state(self, position):
+        # Layers touched after a snapshot was taken are still in their original state
+        state = dict(self.originals)
+        if position >= 0:
+            state.update(self.snapshots[position])
+        return state
+
+    def _current(self):
+        current = {}
+        for layer_id in self.originals:
+            layer = self.project.mapLayer(layer_id)
+            if layer is not None:
+                current[layer_id] = self.subset_string(layer)
+        return current
+
+    def _diff(self, target):
+        plan = {}
+        for layer_id, expression in target.items():
+            layer = self.project.mapLayer(layer_id)
+            if layer is not None and self.subset_string(layer) != expression:
+                plan[layer_id] = expression
+        return plan
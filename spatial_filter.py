@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Spatial filtering: filter layers without criteria fields by location.
+
+ The geometries of the features a plan keeps are merged into one area, and
+ every layer that carries no criteria field is filtered to the features
+ intersecting it. Candidates come from a QgsSpatialIndex per layer, built
+ once in the background and dropped when the layer's data changes.
+"""
+from qgis.PyQt.QtCore import QSettings
+from qgis.core import (Qgis, QgsCoordinateTransform, QgsCsException, QgsFeatureRequest, QgsFeedback,
+                       QgsGeometry, QgsMessageLog, QgsSpatialIndex, QgsTask, QgsVectorLayer, QgsWkbTypes)
+
+from .fid_index import fid_subset_string
+from .layer_sources import LayerWatcher, TaskSet, open_reader, reader_source
+from .profiler import LOG_TAG
+
+# QSettings key for filtering layers without criteria fields by location
+SPATIAL_FILTER_SETTING = 'AutoFilter/spatial_filter'
+
+
+class SpatialIndexTask(QgsTask):
+    """Bulk-load the spatial index of one layer's features, all of them."""
+
+    def __init__(self, description, layer_id, source, callback=None):
+        super().__init__(description, QgsTask.CanCancel)
+        self.layer_id = layer_id
+        self.source = source
+        self.callback = callback
+        self.feedback = QgsFeedback()
+        self.index = None
+
+    def run(self):
+        provider = open_reader(self.source)
+        if provider is None:
+            return False
+        request = QgsFeatureRequest()
+        request.setNoAttributes()
+        index = QgsSpatialIndex(provider.getFeatures(request), self.feedback)
+        if self.feedback.isCanceled():
+            return False
+        self.index = index
+        return True
+
+    def cancel(self):
+        self.feedback.cancel()
+        super().cancel()
+
+    def finished(self, result):
+        if self.callback:
+            self.callback(self, result)
+
+
+class SpatialIndexCache:
+    """One QgsSpatialIndex per layer, built on first use.
+
+    A layer's index is dropped when it commits edits or its data source
+    changes, and is rebuilt the next time a spatial filter needs it.
+    """
+
+    def __init__(self):
+        # layer id -> QgsSpatialIndex
+        self._indexes = {}
+        # layer id -> callbacks waiting for the index being built
+        self._pending = {}
+        self.watcher = LayerWatcher(self.invalidate_layer)
+        self.tasks = TaskSet()
+
+    def get(self, layer_id):
+        return self._indexes.get(layer_id)
+
+    def ensure(self, layers, on_ready):
+        """Build the missing indexes of layers, then call on_ready()."""
+        waiting = set()
+
+        def built(layer_id):
+            waiting.discard(layer_id)
+            if not waiting:
+                on_ready()
+
+        for layer in layers:
+            if layer.id() in self._indexes:
+                continue
+            waiting.add(layer.id())
+            if layer.id() in self._pending:
+                self._pending[layer.id()].append(built)
+                continue
+            self._pending[layer.id()] = [built]
+            task = SpatialIndexTask(f'AutoFilter: Spatial index of {layer.name()}', layer.id(), reader_source(layer), self._built)
+            task.revision = self.watcher.watch(layer)
+            self.tasks.start(task)
+        if not waiting:
+            on_ready()
+
+    def invalidate_layer(self, layer_id):
+        self._indexes.pop(layer_id, None)
+
+    def unload(self):
+        self.tasks.cancel_all()
+        self._pending.clear()
+        self.watcher.unload()
+        self._indexes.clear()
+
+    def _built(self, task, result):
+        self.tasks.discard(task)
+        # An index read before an edit was committed is stale
+        if result and task.index is not None and task.revision == self.watcher.revision(task.layer_id):
+            self._indexes[task.layer_id] = task.index
+        # Waiting filters go ahead either way; a layer without index is skipped
+        for callback in self._pending.pop(task.layer_id, []):
+            callback(task.layer_id)
+
+
+class SpatialFilterTask(QgsTask):
+    """Merge the kept geometries and find the intersecting features of every target.
+
+    sources are (reader, subset string, CRS, polygons) for the filtered
+    layers; targets are (layer id, reader, CRS, spatial index). Geometries
+    are merged in the project CRS and transformed to each target's CRS.
+    """
+
+    def __init__(self, description, sources, targets, crs, transform_context, callback=None):
+        super().__init__(description, QgsTask.CanCancel)
+        self.sources = sources
+        self.targets = targets
+        self.crs = crs
+        self.transform_context = transform_context
+        self.callback = callback
+        # layer id -> ids of the features intersecting the area
+        self.fids = {}
+
+    def run(self):
+        area = self.filter_area()
+        if area is None or area.isEmpty():
+            return True
+        for layer_id, source, crs, index in self.targets:
+            if self.isCanceled():
+                return False
+            geometry = QgsGeometry(area)
+            try:
+                geometry.transform(QgsCoordinateTransform(self.crs, crs, self.transform_context))
+            except QgsCsException:
+                continue
+            # Bounding-box candidates from the index, then the exact test
+            candidates = index.intersects(geometry.boundingBox())
+            fids = []
+            if candidates:
+                engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+                engine.prepareGeometry()
+                provider = open_reader(source)
+                if provider is None:
+                    continue
+                request = QgsFeatureRequest()
+                request.setFilterFids(candidates)
+                request.setNoAttributes()
+                for feature in provider.getFeatures(request):
+                    if feature.hasGeometry() and engine.intersects(feature.geometry().constGet()):
+                        fids.append(feature.id())
+            self.fids[layer_id] = fids
+        return True
+
+    def filter_area(self):
+        """Return the merged geometry of the kept features, or None."""
+        # Zone polygons when there are any, else the hull of whatever was kept
+        polygons_only = any(polygons for _source, _expression, _crs, polygons in self.sources)
+        geometries = []
+        for source, expression, crs, polygons in self.sources:
+            if polygons_only and not polygons:
+                continue
+            provider = open_reader(source, expression)
+            if provider is None:
+                continue
+            transform = QgsCoordinateTransform(crs, self.crs, self.transform_context)
+            request = QgsFeatureRequest()
+            request.setNoAttributes()
+            for count, feature in enumerate(provider.getFeatures(request), 1):
+                if count % 1000 == 0 and self.isCanceled():
+                    return None
+                if not feature.hasGeometry():
+                    continue
+                geometry = feature.geometry()
+                try:
+                    geometry.transform(transform)
+                except QgsCsException:
+                    continue
+                geometries.append(geometry)
+        if not geometries:
+            return None
+        if polygons_only:
+            return QgsGeometry.unaryUnion(geometries)
+        # The hull needs no union: collecting the parts is enough
+        return QgsGeometry.collectGeometry(geometries).convexHull()
+
+    def finished(self, result):
+        if self.callback:
+            self.callback(self, result)
+
+
+class SpatialFilter:
+    """Extend filter plans to the layers without criteria fields, by location."""
+
+    def __init__(self, field_index, project):
+        self.field_index = field_index
+        self.project = project
+        self.indexes = SpatialIndexCache()
+        # Incremented by every expansion so superseded ones are dropped
+        self.generation = 0
+        self.tasks = TaskSet()
+
+    @property
+    def enabled(self):
+        return QSettings().value(SPATIAL_FILTER_SETTING, False, type=bool)
+
+    @enabled.setter
+    def enabled(self, enabled):
+        QSettings().setValue(SPATIAL_FILTER_SETTING, bool(enabled))
+
+    def targets(self, plan):
+        """Return the spatial layers outside the plan that carry no criteria field."""
+        return [layer for layer_id, layer in self.project.mapLayers().items()
+                if isinstance(layer, QgsVectorLayer) and layer.isSpatial() and layer_id not in plan
+                and not self.field_index.criteria_fields(layer_id)]
+
+    def expand(self, plan, on_ready):
+        """Find the filters of the layers intersecting a plan's features in the background.
+
+        Calls on_ready(child plan, child native ids) on the main thread,
+        with an empty child plan if the task fails, unless a newer
+        expansion or cancel() supersedes this one.
+        """
+        self.cancel()
+        generation = self.generation
+        sources = []
+        for layer_id, expression in plan.items():
+            layer = self.project.mapLayer(layer_id)
+            if isinstance(layer, QgsVectorLayer) and layer.isSpatial():
+                sources.append((reader_source(layer), expression, layer.crs(),
+                                layer.geometryType() == QgsWkbTypes.PolygonGeometry))
+        targets = self.targets(plan)
+        if not sources or not targets:
+            on_ready({}, set())
+            return
+
+        def indexed():
+            # A newer filter, undo or clear came first
+            if generation != self.generation:
+                return
+            readers = [(layer.id(), reader_source(layer), layer.crs(), self.indexes.get(layer.id()))
+                       for layer in targets if self.indexes.get(layer.id()) is not None]
+            task = SpatialFilterTask('AutoFilter: Filter layers by location', sources, readers, self.project.crs(),
+                                     self.project.transformContext(), done)
+            task.generation = generation
+            self.tasks.start(task)
+
+        def done(task, result):
+            self.tasks.discard(task)
+            if task.generation != self.generation:
+                return
+            if not result:
+                # Failed, or cancelled from the task manager: the plan goes on without these layers
+                QgsMessageLog.logMessage('Spatial filter: layers could not be read, none were filtered by location',
+                                         LOG_TAG, Qgis.Warning)
+                on_ready({}, set())
+                return
+            children = {}
+            native = set()
+            for layer_id, fids in task.fids.items():
+                layer = self.project.mapLayer(layer_id)
+                if layer is None:
+                    continue
+                expression, is_native = fid_subset_string(layer, fids)
+                if expression is None:
+                    QgsMessageLog.logMessage(f'{layer.name()}: cannot filter by feature id', LOG_TAG, Qgis.Warning)
+                    continue
+                children[layer_id] = expression
+                if is_native:
+                    native.add(layer_id)
+            QgsMessageLog.logMessage(f'Spatial filter: {len(children)} layers filtered by location', LOG_TAG, Qgis.Info)
+            on_ready(children, native)
+
+        # Indexes are built once per layer; later filters reuse them
+        self.indexes.ensure(targets, indexed)
+
+    def cancel(self):
+        """Cancel the expansions still running; their plans are dropped."""
+        self.generation += 1
+        self.tasks.cancel_all()
+
+    def unload(self):
+        self.cancel()
+        self.indexes.unload()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Provider-native SQL for subset strings, and grouped validation per database.
+"""
+import datetime
+import sqlite3
+from contextlib import closing
+
+from qgis.PyQt.QtCore import QSettings
+from qgis.core import QgsDataSourceUri, QgsExpression, QgsProviderRegistry
+
+from .layer_sources import sqlite_location
+
+# QSettings key for provider-native subset strings
+NATIVE_SQL_SETTING = 'AutoFilter/native_sql'
+
+# Oracle accepts at most this many items in one IN list
+ORACLE_IN_LIMIT = 1000
+
+
+def native_sql_enabled():
+    return QSettings().value(NATIVE_SQL_SETTING, True, type=bool)
+
+
+def set_native_sql_enabled(enabled):
+    QSettings().setValue(NATIVE_SQL_SETTING, bool(enabled))
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_text(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class ExpressionDialect:
+    """QGIS expression syntax, understood by every provider QGIS can filter."""
+
+    native = False
+
+    def column(self, name):
+        return QgsExpression.quotedColumnRef(name)
+
+    def literal(self, kind, value):
+        """Quote a value already converted for a field kind ('int', 'date', ...)."""
+        if isinstance(value, datetime.date):
+            value = value.isoformat()
+        return QgsExpression.quotedValue(value)
+
+    def membership(self, field, kind, values):
+        return f'{field} IN (' + ','.join(self.literal(kind, value) for value in values) + ')'
+
+
+class SqliteDialect(ExpressionDialect):
+    """GeoPackage and SpatiaLite: dates are stored as ISO text."""
+
+    native = True
+
+    def column(self, name):
+        return quote_identifier(name)
+
+    def literal(self, kind, value):
+        if isinstance(value, datetime.date):
+            return quote_text(value.isoformat())
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return repr(value)
+        return quote_text(value)
+
+
+class PostgresDialect(SqliteDialect):
+    """PostgreSQL/PostGIS: typed date literals and = ANY(ARRAY[...])."""
+
+    def literal(self, kind, value):
+        if isinstance(value, datetime.date):
+            if kind == 'datetime':
+                return f"TIMESTAMP '{value.isoformat()} 00:00:00'"
+            return f"DATE '{value.isoformat()}'"
+        return super().literal(kind, value)
+
+    def membership(self, field, kind, values):
+        return f'{field} = ANY(ARRAY[' + ','.join(self.literal(kind, value) for value in values) + '])'
+
+
+class OracleDialect(PostgresDialect):
+    """Oracle: typed date literals and IN lists of at most 1000 items."""
+
+    def membership(self, field, kind, values):
+        values = list(values)
+        chunks = [values[start:start + ORACLE_IN_LIMIT] for start in range(0, len(values), ORACLE_IN_LIMIT)]
+        parts = [f'{field} IN (' + ','.join(self.literal(kind, value) for value in chunk) + ')' for chunk in chunks]
+        return parts[0] if len(parts) == 1 else '(' + ' OR '.join(parts) + ')'
+
+
+EXPRESSION_DIALECT = ExpressionDialect()
+SQLITE_DIALECT = SqliteDialect()
+POSTGRES_DIALECT = PostgresDialect()
+ORACLE_DIALECT = OracleDialect()
+
+
+def dialect_for(layer):
+    """Return the SQL dialect of a layer's provider (QGIS expressions by default)."""
+    if not native_sql_enabled():
+        return EXPRESSION_DIALECT
+    provider = layer.dataProvider().name()
+    if provider == 'postgres':
+        return POSTGRES_DIALECT
+    if provider == 'oracle':
+        return ORACLE_DIALECT
+    if provider == 'spatialite' or (provider == 'ogr' and layer.dataProvider().storageType() in ('GPKG', 'SQLite')):
+        return SQLITE_DIALECT
+    return EXPRESSION_DIALECT
+
+
+def validation_target(layer):
+    """Return (group key, source, table SQL) to validate a layer's filter with, or None.
+
+    Layers with the same group key share a database and are validated
+    together in one query.
+    """
+    provider = layer.dataProvider().name()
+    if provider in ('postgres', 'oracle'):
+        uri = QgsDataSourceUri(layer.source())
+        if not uri.table() or uri.table().startswith('('):
+            # SQL query layers are left to the provider
+            return None
+        table = (quote_identifier(uri.schema()) + '.' if uri.schema() else '') + quote_identifier(uri.table())
+        return (provider, uri.connectionInfo(False)), layer.source(), table
+    if provider in ('ogr', 'spatialite') and dialect_for(layer) is SQLITE_DIALECT:
+        location = sqlite_location(layer)
+        if location is None:
+            return None
+        path, table = location
+        return ('sqlite', path), path, quote_identifier(table)
+    return None
+
+
+def probe_sql(table, expression):
+    """Return a query that compiles an expression against a table without reading rows."""
+    return f'SELECT 1 FROM {table} WHERE ({expression}) AND 1 = 0'
+
+
+def validate_group(key, source, items):
+    """Validate the filters of layers sharing a database in one round trip.
+
+    key and source come from validation_target() for any layer of the
+    group; items are (layer id, layer name, table SQL, expression).
+    Returns {layer id: error}. Only when the combined query fails is each
+    layer checked on its own, to tell which filter is wrong.
+    """
+    provider = key[0]
+    if provider == 'sqlite':
+        with closing(sqlite3.connect(source)) as connection:
+            def run(sql):
+                connection.execute('EXPLAIN ' + sql)
+            return _validate(run, items)
+    connection = QgsProviderRegistry.instance().providerMetadata(provider).createConnection(source, {})
+    return _validate(connection.executeSql, items)
+
+
+def _validate(run, items):
+    combined = ' UNION ALL '.join(probe_sql(table, expression) for _layer_id, _name, table, expression in items)
+    try:
+        run(combined)
+        return {}
+    except Exception:
+        pass
+    errors = {}
+    for layer_id, name, table, expression in items:
+        try:
+            run(probe_sql(table, expression))
+        except Exception as e:
+            errors[layer_id] = f'{name}: {str(e).strip()}'
+    return errors
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+Import the plugin directory as the AutoFilter package, whatever the checkout
+is called, as the benchmarks do.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from common import load_plugin  # noqa: E402
+
+load_plugin()
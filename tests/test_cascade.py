@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+key_expression: the subset string a linked layer is filtered by.
+"""
+import pytest
+
+pytest.importorskip('qgis')
+
+from qgis.PyQt.QtCore import QVariant  # noqa: E402
+from qgis.core import QgsField, QgsFields  # noqa: E402
+
+from AutoFilter.cascade import key_expression  # noqa: E402
+from AutoFilter.criteria import NO_MATCH  # noqa: E402
+from AutoFilter.sql_dialect import EXPRESSION_DIALECT, POSTGRES_DIALECT, SQLITE_DIALECT  # noqa: E402
+
+
+def fields(**types):
+    layer_fields = QgsFields()
+    for name, field_type in types.items():
+        layer_fields.append(QgsField(name, field_type))
+    return layer_fields
+
+
+def test_keys_are_typed_deduplicated_and_sorted():
+    # "02" and "2.0" are the key 2 of an integer field
+    assert key_expression(fields(id=QVariant.Int), ['id'], ['2', '1', '02', '2.0'], SQLITE_DIALECT) == '"id" IN (1,2)'
+
+
+def test_a_single_key_is_an_equality():
+    assert key_expression(fields(id=QVariant.Int), ['id'], ['7'], EXPRESSION_DIALECT) == '"id" = 7'
+
+
+def test_keys_use_the_dialects_membership():
+    assert key_expression(fields(id=QVariant.Int), ['id'], ['1', '2'], POSTGRES_DIALECT) == '"id" = ANY(ARRAY[1,2])'
+
+
+def test_each_key_field_is_tried_and_unknown_fields_compare_as_text():
+    assert key_expression(fields(code=QVariant.String), ['code', 'other'], ['a'], SQLITE_DIALECT) == (
+        '"code" = \'a\' OR "other" = \'a\'')
+
+
+def test_keys_no_field_can_take_match_nothing():
+    assert key_expression(fields(id=QVariant.Int), ['id'], ['x', '1.5'], SQLITE_DIALECT) == NO_MATCH
+    assert key_expression(fields(id=QVariant.Int), ['id'], [], SQLITE_DIALECT) == NO_MATCH
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Criterion.expression: typed literals per field kind, in every SQL dialect.
+"""
+import pytest
+
+pytest.importorskip('qgis')
+
+from qgis.PyQt.QtCore import QVariant  # noqa: E402
+from qgis.core import QgsField, QgsFields  # noqa: E402
+
+from AutoFilter.criteria import NO_MATCH, Criterion  # noqa: E402
+from AutoFilter.sql_dialect import (EXPRESSION_DIALECT, ORACLE_DIALECT, ORACLE_IN_LIMIT, POSTGRES_DIALECT,  # noqa: E402
+                                    SQLITE_DIALECT)
+
+NUMBER = Criterion('Number', ['number'], 'int')
+DAY = Criterion('Day', ['day'], 'date')
+PERIOD = Criterion('Period', ['day'], 'date', 'between')
+
+
+def fields(**types):
+    layer_fields = QgsFields()
+    for name, field_type in types.items():
+        layer_fields.append(QgsField(name, field_type))
+    return layer_fields
+
+
+@pytest.mark.parametrize('dialect, expected', [
+    (EXPRESSION_DIALECT, '"number" = 12'),
+    (SQLITE_DIALECT, '"number" = 12'),
+    (POSTGRES_DIALECT, '"number" = 12'),
+])
+def test_integers_are_unquoted_and_normalised(dialect, expected):
+    # "012" and "12.0" are the same integer and are only listed once
+    assert NUMBER.field_expression('"number"', 'int', ['12', '012', '12.0'], dialect) == expected
+
+
+def test_values_that_cannot_be_integers_are_left_out():
+    assert NUMBER.field_expression('"number"', 'int', ['abc', '1.5'], SQLITE_DIALECT) is None
+    assert NUMBER.expression(fields(number=QVariant.Int), ['number'], ['abc']) == NO_MATCH
+
+
+@pytest.mark.parametrize('dialect, expected', [
+    (EXPRESSION_DIALECT, '"number" IN (1,2)'),
+    (SQLITE_DIALECT, '"number" IN (1,2)'),
+    (POSTGRES_DIALECT, '"number" = ANY(ARRAY[1,2])'),
+    (ORACLE_DIALECT, '"number" IN (1,2)'),
+])
+def test_integer_lists_use_each_dialects_membership(dialect, expected):
+    assert NUMBER.field_expression('"number"', 'int', ['1', '2', '1'], dialect) == expected
+
+
+def test_oracle_splits_long_lists():
+    values = [str(value) for value in range(ORACLE_IN_LIMIT + 1)]
+    expression = NUMBER.field_expression('"number"', 'int', values, ORACLE_DIALECT)
+    assert expression.startswith('("number" IN (0,')
+    assert expression.endswith(f' OR "number" IN ({ORACLE_IN_LIMIT}))')
+
+
+@pytest.mark.parametrize('dialect, expected', [
+    (SQLITE_DIALECT, '"ratio" = 2.5'),
+    (POSTGRES_DIALECT, '"ratio" = 2.5'),
+])
+def test_reals_are_unquoted(dialect, expected):
+    assert NUMBER.field_expression('"ratio"', 'real', [' 2.5 '], dialect) == expected
+
+
+@pytest.mark.parametrize('dialect, expected', [
+    (EXPRESSION_DIALECT, "\"day\" = '2024-03-01'"),
+    (SQLITE_DIALECT, "\"day\" = '2024-03-01'"),
+    (POSTGRES_DIALECT, "\"day\" = DATE '2024-03-01'"),
+    (ORACLE_DIALECT, "\"day\" = DATE '2024-03-01'"),
+])
+def test_dates_use_each_dialects_literals(dialect, expected):
+    assert DAY.field_expression('"day"', 'date', ['2024-03-01'], dialect) == expected
+
+
+def test_a_date_matches_the_whole_day_of_a_datetime_field():
+    assert DAY.field_expression('"day"', 'datetime', ['2024-03-01'], POSTGRES_DIALECT) == (
+        "(\"day\" >= TIMESTAMP '2024-03-01 00:00:00' AND \"day\" < TIMESTAMP '2024-03-02 00:00:00')")
+
+
+@pytest.mark.parametrize('dialect, expected', [
+    (SQLITE_DIALECT, "\"day\" BETWEEN '2024-03-01' AND '2024-03-10'"),
+    (POSTGRES_DIALECT, "\"day\" BETWEEN DATE '2024-03-01' AND DATE '2024-03-10'"),
+])
+def test_range_bounds_are_put_in_order(dialect, expected):
+    assert PERIOD.field_expression('"day"', 'date', ['2024-03-10', '2024-03-01'], dialect) == expected
+
+
+def test_a_datetime_range_includes_its_last_day():
+    assert PERIOD.field_expression('"day"', 'datetime', ['2024-03-01', '2024-03-10'], SQLITE_DIALECT) == (
+        "(\"day\" >= '2024-03-01' AND \"day\" < '2024-03-11')")
+
+
+def test_a_range_with_an_invalid_bound_matches_nothing():
+    assert PERIOD.field_expression('"day"', 'date', ['2024-03-01', 'soon'], SQLITE_DIALECT) is None
+    assert PERIOD.expression(fields(day=QVariant.Date), ['day'], ['2024-03-01', 'soon']) == NO_MATCH
+
+
+def test_literals_follow_each_fields_type():
+    layer_fields = fields(number=QVariant.Int, code=QVariant.String)
+    assert NUMBER.expression(layer_fields, ['number', 'code'], ['7']) == '"number" = 7 OR "code" = \'7\''
+
+
+def test_check_rejects_values_the_type_cannot_take():
+    assert NUMBER.check(['12']) is None
+    assert NUMBER.check(['twelve']) is not None
+    assert DAY.check(['2024-02-30']) is not None
+    assert PERIOD.check(['2024-03-01']) is not None
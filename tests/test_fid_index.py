@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+LayerFidIndex.lookup and fid_subset_string: filter values to feature ids.
+"""
+from array import array
+
+import pytest
+
+pytest.importorskip('qgis')
+
+from qgis.PyQt.QtCore import QVariant  # noqa: E402
+from qgis.core import QgsField, QgsFields  # noqa: E402
+
+from AutoFilter.fid_index import LayerFidIndex, fid_subset_string  # noqa: E402
+
+
+class Layer:
+    def __init__(self, provider, pk_type=None):
+        self.provider = provider
+        self.layer_fields = QgsFields()
+        self.pk = []
+        if pk_type is not None:
+            self.layer_fields.append(QgsField('gid', pk_type))
+            self.pk = [0]
+
+    def providerType(self):
+        return self.provider
+
+    def primaryKeyAttributes(self):
+        return self.pk
+
+    def fields(self):
+        return self.layer_fields
+
+
+def make_index():
+    return LayerFidIndex({'number': {'12': array('q', [3, 1]), '7': array('q', [2])},
+                          'name': {'A': array('q', [5, 1])}},
+                         {'number': 'int', 'name': 'text'})
+
+
+def test_values_are_looked_up_in_their_fields_indexed_form():
+    # "012" and "12.0" find the integer 12, as they do in the filter expression
+    assert make_index().lookup(['number'], ['012', '12.0']) == [1, 3]
+    assert make_index().lookup(['number'], ['1.5', 'abc']) == []
+
+
+def test_ids_of_every_field_and_value_are_merged_and_sorted():
+    assert make_index().lookup(['number', 'name'], ['7', 'A', '12']) == [1, 2, 3, 5]
+
+
+def test_a_field_that_is_not_indexed_gives_no_answer():
+    assert make_index().lookup(['number', 'code'], ['7']) is None
+
+
+def test_memory_layers_are_filtered_by_feature_id():
+    assert fid_subset_string(Layer('memory'), [1, 2]) == ('$id IN (1,2)', False)
+    assert fid_subset_string(Layer('memory'), []) == ('$id IN (-1)', False)
+
+
+def test_an_integer_primary_key_stands_for_the_feature_id():
+    assert fid_subset_string(Layer('postgres', QVariant.LongLong), [4, 9]) == ('"gid" IN (4,9)', False)
+
+
+def test_ogr_layers_fall_back_to_the_native_fid_field():
+    assert fid_subset_string(Layer('ogr', QVariant.String), [4]) == ('FID IN (4)', True)
+
+
+def test_layers_without_an_id_key_cannot_be_filtered_by_id():
+    assert fid_subset_string(Layer('postgres', QVariant.String), [4]) == (None, False)
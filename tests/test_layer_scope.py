@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+LayerScope: the layers of the selected layer tree group, cached until the tree changes.
+"""
+import pytest
+
+pytest.importorskip('qgis')
+
+from qgis.core import QgsLayerTree, QgsLayerTreeLayer  # noqa: E402
+
+from AutoFilter.layer_scope import SCOPE_GROUP, LayerScope  # noqa: E402
+
+
+class Signal:
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def disconnect(self, slot):
+        self.slots.remove(slot)
+
+
+class ThemeCollection:
+    def __init__(self):
+        self.mapThemesChanged = Signal()
+        self.mapThemeChanged = Signal()
+
+
+class Project:
+    def __init__(self, root):
+        self.root = root
+        self.collection = ThemeCollection()
+        self.mapThemeCollectionChanged = Signal()
+        self.cleared = Signal()
+
+    def layerTreeRoot(self):
+        return self.root
+
+    def mapThemeCollection(self):
+        return self.collection
+
+
+@pytest.fixture
+def tree(monkeypatch):
+    # The scope is a user setting; pin it rather than touch the settings
+    monkeypatch.setattr(LayerScope, 'scope', SCOPE_GROUP)
+    root = QgsLayerTree()
+    root.addChildNode(QgsLayerTreeLayer('outside', 'Outside'))
+    group = root.addGroup('Parcels')
+    group.addChildNode(QgsLayerTreeLayer('a', 'A'))
+    group.addGroup('Nested').addChildNode(QgsLayerTreeLayer('b', 'B'))
+    return root, group
+
+
+def test_a_group_scopes_the_layers_below_it(tree):
+    root, group = tree
+    scope = LayerScope(Project(root), lambda: group)
+    assert scope.layer_ids() == {'a', 'b'}
+    assert scope.restrict({'a': '"x" = 1', 'outside': '"x" = 1'}) == {'a': '"x" = 1'}
+    scope.unload()
+
+
+def test_group_layers_are_cached_until_the_tree_changes(tree):
+    root, group = tree
+    scope = LayerScope(Project(root), lambda: group)
+    first = scope.layer_ids()
+    assert scope.layer_ids() is first
+    group.addChildNode(QgsLayerTreeLayer('c', 'C'))
+    assert scope.layer_ids() == {'a', 'b', 'c'}
+    scope.unload()
+
+
+def test_no_group_or_the_root_scopes_every_layer(tree):
+    root, _group = tree
+    plan = {'outside': '"x" = 1'}
+    for selected in (None, root):
+        scope = LayerScope(Project(root), lambda: selected)
+        assert scope.layer_ids() is None
+        assert scope.restrict(plan) is plan
+        scope.unload()
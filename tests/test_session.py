@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+FilterSession: originals, snapshots and the minimal undo/redo/clear plans.
+"""
+from AutoFilter.session import FilterSession
+
+
+class Signal:
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def disconnect(self, slot):
+        self.slots.remove(slot)
+
+    def emit(self):
+        for slot in list(self.slots):
+            slot()
+
+
+class Layer:
+    def __init__(self, layer_id, subset=''):
+        self._id = layer_id
+        self.subset = subset
+
+    def id(self):
+        return self._id
+
+    def subsetString(self):
+        return self.subset
+
+
+class Project:
+    def __init__(self, *layers):
+        self.layers = {layer.id(): layer for layer in layers}
+        self.cleared = Signal()
+
+    def mapLayer(self, layer_id):
+        return self.layers.get(layer_id)
+
+
+def apply(session, project, plan):
+    # What the plugin does around the engine: remember, set, commit
+    session.remember(plan)
+    for layer_id, expression in plan.items():
+        project.layers[layer_id].subset = expression
+    session.commit()
+
+
+def move(session, project, plan, step):
+    for layer_id, expression in plan.items():
+        project.layers[layer_id].subset = expression
+    session.moved(step)
+
+
+def make_session():
+    project = Project(Layer('a'), Layer('b', '"kept" = 1'), Layer('c'))
+    return project, FilterSession(project)
+
+
+def test_clear_restores_only_touched_layers_to_their_originals():
+    project, session = make_session()
+    apply(session, project, {'a': '"x" = 1', 'b': '"x" = 1'})
+    assert session.clear_plan() == {'a': '', 'b': '"kept" = 1'}
+
+
+def test_undo_and_redo_plan_only_the_layers_that_differ():
+    project, session = make_session()
+    apply(session, project, {'a': '"x" = 1', 'b': '"x" = 1'})
+    apply(session, project, {'a': '"x" = 2', 'b': '"x" = 1'})
+
+    undo = session.undo_plan()
+    assert undo == {'a': '"x" = 1'}
+    move(session, project, undo, -1)
+
+    redo = session.redo_plan()
+    assert redo == {'a': '"x" = 2'}
+    move(session, project, redo, 1)
+    assert not session.can_redo()
+
+
+def test_undo_to_the_start_restores_layers_touched_later_too():
+    project, session = make_session()
+    apply(session, project, {'a': '"x" = 1'})
+    apply(session, project, {'c': '"y" = 1'})
+
+    move(session, project, session.undo_plan(), -1)
+    # c was untouched in the first snapshot, so it goes back to its original
+    assert project.layers['c'].subset == ''
+    assert session.undo_plan() == {'a': ''}
+
+
+def test_a_new_filter_discards_the_redo_history():
+    project, session = make_session()
+    apply(session, project, {'a': '"x" = 1'})
+    apply(session, project, {'a': '"x" = 2'})
+    move(session, project, session.undo_plan(), -1)
+
+    apply(session, project, {'a': '"x" = 3'})
+    assert not session.can_redo()
+    assert session.redo_plan() is None
+    assert session.undo_plan() == {'a': '"x" = 1'}
+
+
+def test_an_unchanged_snapshot_is_not_pushed_twice():
+    project, session = make_session()
+    apply(session, project, {'a': '"x" = 1'})
+    session.commit()
+    assert len(session.snapshots) == 1
+
+
+def test_nothing_to_undo_or_redo_without_filters():
+    _project, session = make_session()
+    assert session.undo_plan() is None
+    assert session.redo_plan() is None
+    assert session.clear_plan() == {}
+
+
+def test_deferred_filters_belong_to_the_snapshot():
+    project, session = make_session()
+    session.remember({'a': '"x" = 1', 'c': '"x" = 1'})
+    project.layers['a'].subset = '"x" = 1'
+    session.commit({'c': '"x" = 1'})
+    assert session.snapshots[-1] == {'a': '"x" = 1', 'c': '"x" = 1'}
+
+
+def test_linked_filters_complete_the_latest_snapshot():
+    project, session = make_session()
+    apply(session, project, {'a': '"x" = 1'})
+    apply(session, project, {'a': '"x" = 2'})
+    # Linked layers are filtered once gathered, as part of the same filter
+    session.remember({'c': '"y" = 2'})
+    project.layers['c'].subset = '"y" = 2'
+    session.commit(amend={'c'})
+    assert len(session.snapshots) == 2
+    assert session.snapshots[-1] == {'a': '"x" = 2', 'c': '"y" = 2'}
+    # One undo takes back the filter and its linked layers
+    assert session.undo_plan() == {'a': '"x" = 1', 'c': ''}
+
+
+def test_snapshots_record_the_filter_a_substitute_stands_for():
+    project, _session = make_session()
+    substitutes = {'$id IN (1,2)': '"x" = 1'}
+    session = FilterSession(project, lambda layer: substitutes.get(layer.subsetString(), layer.subsetString()))
+    session.remember({'a': '"x" = 1'})
+    project.layers['a'].subset = '$id IN (1,2)'
+    session.commit()
+    assert session.snapshots[-1] == {'a': '"x" = 1'}
+    assert session.expressions() == {'', '"x" = 1'}
+    move(session, project, session.undo_plan(), -1)
+    # Redo sets the filter itself, never the stale id list
+    assert session.redo_plan() == {'a': '"x" = 1'}
+
+
+def test_a_cleared_project_forgets_the_session():
+    project, session = make_session()
+    apply(session, project, {'a': '"x" = 1'})
+    project.cleared.emit()
+    assert session.originals == {} and not session.can_undo()
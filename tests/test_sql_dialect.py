@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+OracleDialect.membership: IN lists of at most ORACLE_IN_LIMIT items.
+"""
+import pytest
+
+pytest.importorskip('qgis')
+
+from AutoFilter.sql_dialect import ORACLE_DIALECT, ORACLE_IN_LIMIT  # noqa: E402
+
+
+def in_lists(expression):
+    return expression.strip('()').split(') OR "number" IN (')
+
+
+def test_a_list_at_the_limit_is_one_in_list():
+    expression = ORACLE_DIALECT.membership('"number"', 'int', range(ORACLE_IN_LIMIT))
+    assert expression.startswith('"number" IN (0,')
+    assert ' OR ' not in expression
+
+
+def test_longer_lists_are_split_into_full_chunks_in_order():
+    values = list(range(2 * ORACLE_IN_LIMIT + 1))
+    expression = ORACLE_DIALECT.membership('"number"', 'int', values)
+    assert expression.startswith('("number" IN (') and expression.endswith('))')
+    chunks = [chunk.replace('"number" IN (', '').split(',') for chunk in in_lists(expression)]
+    assert [len(chunk) for chunk in chunks] == [ORACLE_IN_LIMIT, ORACLE_IN_LIMIT, 1]
+    assert [int(value) for chunk in chunks for value in chunk] == values
+
+
+def test_text_values_are_quoted_in_every_chunk():
+    expression = ORACLE_DIALECT.membership('"code"', 'text', ["o'k"] * (ORACLE_IN_LIMIT + 1))
+    assert expression.count("'o''k'") == ORACLE_IN_LIMIT + 1
+    assert expression.count('"code" IN (') == 2
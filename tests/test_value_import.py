@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+read_values: streamed, deduplicated and normalised Multi-Filter values.
+"""
+import datetime
+
+import pytest
+
+from AutoFilter.value_import import file_kind, normalise, read_values
+
+
+def write_csv(tmp_path, text, name='values.csv'):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_values_are_deduplicated_in_file_order(tmp_path):
+    path = write_csv(tmp_path, 'id\nB\nA\nB\nC\nA\n')
+    assert read_values(path) == (['id', 'B', 'A', 'C'], 6)
+
+
+def test_blank_cells_are_skipped_but_counted_as_rows(tmp_path):
+    path = write_csv(tmp_path, 'A\n\n  \nB\n')
+    values, rows = read_values(path)
+    assert values == ['A', 'B']
+    assert rows == 4
+
+
+def test_the_chosen_column_is_read_with_a_sniffed_delimiter(tmp_path):
+    path = write_csv(tmp_path, 'name;code\nfirst;10\nsecond;20\n')
+    assert read_values(path, column=1) == (['code', '10', '20'], 3)
+
+
+def test_rows_shorter_than_the_column_have_no_value(tmp_path):
+    path = write_csv(tmp_path, 'name,code\nfirst,10\nsecond\n')
+    assert read_values(path, column=1) == (['code', '10'], 3)
+
+
+def test_csv_cells_are_read_as_text(tmp_path):
+    path = write_csv(tmp_path, '12.0\n12\n-3.00\n1.5\n007\n')
+    assert read_values(path)[0] == ['12.0', '12', '-3.00', '1.5', '007']
+
+
+def test_a_byte_order_mark_is_not_part_of_the_first_value(tmp_path):
+    path = tmp_path / 'bom.csv'
+    path.write_bytes('﻿A\nB\n'.encode('utf-8'))
+    assert read_values(str(path))[0] == ['A', 'B']
+
+
+def test_cells_are_normalised_as_spreadsheets_give_them():
+    assert normalise(12.0) == '12'
+    assert normalise(1.5) == '1.5'
+    assert normalise(datetime.datetime(2024, 3, 1)) == '2024-03-01'
+    assert normalise(datetime.datetime(2024, 3, 1, 8, 30)) == '2024-03-01T08:30:00'
+    assert normalise('  text ') == 'text'
+    assert normalise('') is None
+    assert normalise(None) is None
+
+
+def test_unsupported_files_are_rejected():
+    assert file_kind('values.TXT') == 'csv'
+    with pytest.raises(ValueError):
+        file_kind('values.ods')
+
+
+def test_xlsx_columns_are_streamed(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for row in (('name', 'code'), ('a', 12.0), ('b', 12), ('c', None), ('d', 7)):
+        sheet.append(row)
+    path = str(tmp_path / 'values.xlsx')
+    workbook.save(path)
+    assert read_values(path, column=1) == (['code', '12', '7'], 5)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+ValueListStore: session-scoped list ids, queued writes and clear(keep).
+"""
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+pytest.importorskip('qgis')
+
+from AutoFilter.value_table import LOOKUP_TABLE, ValueListStore, list_key, write_list  # noqa: E402
+
+
+class Provider:
+    def storageType(self):
+        return 'GPKG'
+
+
+class Layer:
+    def __init__(self, path):
+        self.path = path
+
+    def providerType(self):
+        return 'ogr'
+
+    def dataProvider(self):
+        return Provider()
+
+    def source(self):
+        return f'{self.path}|layername=parcels'
+
+
+def write_queued(store):
+    # What the filter task does with the queued writes
+    jobs = store.take_writes()
+    for _key, kind, target, list_id, values, _inline in jobs:
+        write_list(kind, target, list_id, values)
+    store.finished([(job[0], job[3]) for job in jobs], [])
+    return jobs
+
+
+def stored_lists(path):
+    with closing(sqlite3.connect(path)) as connection:
+        if connection.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (LOOKUP_TABLE,)).fetchone() is None:
+            return None
+        return {row[0] for row in connection.execute(f'SELECT DISTINCT list_id FROM {LOOKUP_TABLE}')}
+
+
+def test_list_ids_follow_the_values_not_their_order():
+    assert list_key(['b', 'a']) == list_key(['a', 'b'])
+    assert list_key(['a', 'b']) != list_key(['ab'])
+    assert list_key(['a', 'b']) != list_key(['a', 'b', 'c'])
+
+
+def test_list_ids_are_unique_to_the_session():
+    assert list_key(['a', 'b'], 'one') != list_key(['a', 'b'], 'two')
+    store = ValueListStore(inline_limit=1)
+    expression, native = store.membership_expression(Layer('data.gpkg'), 'code', ['a', 'b'])
+    assert native
+    assert list_key(['a', 'b'], store.session) in expression
+    assert ValueListStore().session != store.session
+
+
+def test_short_lists_are_inlined_and_not_written():
+    store = ValueListStore(inline_limit=2)
+    assert store.membership_expression(Layer('data.gpkg'), 'code', ['a', 'b']) == ('"code" IN (\'a\',\'b\')', False)
+    assert store.take_writes() == []
+
+
+def test_a_list_is_queued_once_until_it_is_written(tmp_path):
+    path = str(tmp_path / 'data.gpkg')
+    store = ValueListStore(inline_limit=1)
+    store.membership_expression(Layer(path), 'code', ['a', 'b'])
+    store.membership_expression(Layer(path), 'code', ['b', 'a'])
+    jobs = write_queued(store)
+    assert len(jobs) == 1
+    assert stored_lists(path) == {jobs[0][3]}
+    # Written lists are not queued again
+    store.membership_expression(Layer(path), 'code', ['a', 'b'])
+    assert store.take_writes() == []
+
+
+def test_clear_keeps_the_lists_a_subset_string_still_uses(tmp_path):
+    path = str(tmp_path / 'data.gpkg')
+    store = ValueListStore(inline_limit=1)
+    kept, _native = store.membership_expression(Layer(path), 'code', ['a', 'b'])
+    store.membership_expression(Layer(path), 'code', ['c', 'd'])
+    write_queued(store)
+
+    store.clear(keep=[kept])
+    assert stored_lists(path) == {list_key(['a', 'b'], store.session)}
+    # The table is dropped with the last list
+    store.clear()
+    assert stored_lists(path) is None
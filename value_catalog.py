@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Catalog of the distinct values of every criterion, for typeahead and
+ validation of filter input.
+"""
+from bisect import bisect_left
+from heapq import merge
+
+from qgis.PyQt.QtCore import QDate, QDateTime, Qt
+from qgis.core import QgsTask
+
+from .criteria import DATE_CRITERIA, field_kind, typed_value
+from .layer_sources import LayerWatcher, TaskSet, open_reader, reader_source
+
+# Criteria entered with date pickers are never catalogued
+UNCATALOGUED_CRITERIA = DATE_CRITERIA
+
+# Completions offered for a prefix
+COMPLETION_LIMIT = 50
+
+
+def catalog_text(value):
+    """Return the text form of an attribute value, or None for NULL."""
+    if value is None or (hasattr(value, 'isNull') and value.isNull()):
+        return None
+    if isinstance(value, (QDate, QDateTime)):
+        return value.toString(Qt.ISODate)
+    return str(value)
+
+
+def typed_text(kind, value):
+    """Return the catalog text a field of a kind would hold for an input value, or None.
+
+    Dates of date-time fields are compared by day, as date input matches them.
+    """
+    value = typed_value(kind, value)
+    if value is None:
+        return None
+    return value.isoformat() if kind in ('date', 'datetime') else str(value)
+
+
+class CatalogTask(QgsTask):
+    """Collect the distinct values of layer fields off the GUI thread.
+
+    Each source is reopened through a provider of the task's own, so the
+    values are not limited by the layer's current filter and the layer
+    itself is never touched outside the main thread.
+    """
+
+    def __init__(self, description, jobs, callback=None):
+        super().__init__(description, QgsTask.CanCancel)
+        # [(layer id, field, revision, reader source)]
+        self.jobs = jobs
+        self.callback = callback
+        # (layer id, field) -> sorted distinct values
+        self.results = {}
+
+    def run(self):
+        total = len(self.jobs) or 1
+        providers = {}
+        for i, (layer_id, field, _revision, source) in enumerate(self.jobs):
+            if self.isCanceled():
+                return False
+            if layer_id not in providers:
+                providers[layer_id] = open_reader(source)
+            provider = providers[layer_id]
+            if provider is not None:
+                field_index = provider.fields().lookupField(field)
+                if field_index >= 0:
+                    self.results[(layer_id, field)] = distinct_texts(provider.uniqueValues(field_index))
+            self.setProgress(100.0 * (i + 1) / total)
+        return True
+
+    def finished(self, result):
+        if self.callback:
+            self.callback(self, result)
+
+
+def distinct_texts(values):
+    """Return the sorted, distinct, non-NULL text forms of values."""
+    texts = {catalog_text(value) for value in values}
+    texts.discard(None)
+    return sorted(texts)
+
+
+class ValueCatalog:
+    """Sorted distinct values per criterion, built lazily in the background.
+
+    Values are cached per (layer, field) and merged per criterion on demand.
+    A layer's entries are dropped when it commits edits or its data source
+    changes, and are rebuilt the next time the criterion is prepared.
+    """
+
+    def __init__(self, field_index):
+        self.field_index = field_index
+        # (layer id, field) -> sorted distinct values
+        self._values = {}
+        # Entries being collected by a running task
+        self._pending = set()
+        # criterion -> (catalogued pairs, merged sorted values)
+        self._merged = {}
+        # criterion -> (catalogued pairs, {field kind: catalogued texts})
+        self._kinds = {}
+        self.watcher = LayerWatcher(self.invalidate_layer)
+        self.tasks = TaskSet()
+
+    def prepare(self, criterion, on_ready=None):
+        """Start collecting the values of a criterion that are not cached yet."""
+        if criterion in UNCATALOGUED_CRITERIA:
+            return
+        jobs = []
+        for layer, fields in self.field_index.layers_for(criterion):
+            revision = self.watcher.watch(layer)
+            missing = [field for field in fields if (layer.id(), field) not in self._values
+                       and (layer.id(), field) not in self._pending]
+            if not missing:
+                continue
+            source = reader_source(layer)
+            for field in missing:
+                self._pending.add((layer.id(), field))
+                jobs.append((layer.id(), field, revision, source))
+        if not jobs:
+            if on_ready:
+                on_ready(criterion)
+            return
+
+        def done(task, result):
+            self.tasks.discard(task)
+            for layer_id, field, revision, _source in task.jobs:
+                self._pending.discard((layer_id, field))
+                # Values read before an edit was committed are stale
+                if (layer_id, field) in task.results and revision == self.watcher.revision(layer_id):
+                    self._values[(layer_id, field)] = task.results[(layer_id, field)]
+            self._merged.clear()
+            self._kinds.clear()
+            if result and on_ready:
+                on_ready(criterion)
+
+        task = CatalogTask(f'AutoFilter: Catalog {criterion} values', jobs, done)
+        self.tasks.start(task)
+
+    def is_ready(self, criterion):
+        """Return True once every field of a criterion has been catalogued."""
+        if criterion in UNCATALOGUED_CRITERIA:
+            return False
+        return all((layer.id(), field) in self._values
+                   for layer, fields in self.field_index.layers_for(criterion) for field in fields)
+
+    def values(self, criterion):
+        """Return the sorted distinct values catalogued so far for a criterion."""
+        pairs = frozenset((layer.id(), field)
+                          for layer, fields in self.field_index.layers_for(criterion) for field in fields
+                          if (layer.id(), field) in self._values)
+        cached = self._merged.get(criterion)
+        if cached is None or cached[0] != pairs:
+            merged = []
+            for value in merge(*(self._values[pair] for pair in pairs)):
+                if not merged or merged[-1] != value:
+                    merged.append(value)
+            cached = (pairs, merged)
+            self._merged[criterion] = cached
+        return cached[1]
+
+    def field_values(self, layer_id, field):
+        """Return the sorted distinct values of one layer field, or None if not catalogued."""
+        return self._values.get((layer_id, field))
+
+    def complete(self, criterion, prefix, limit=COMPLETION_LIMIT):
+        """Return up to limit catalogued values starting with prefix."""
+        if criterion in UNCATALOGUED_CRITERIA:
+            return []
+        values = self.values(criterion)
+        completions = []
+        for value in values[bisect_left(values, prefix):]:
+            if not value.startswith(prefix) or len(completions) >= limit:
+                break
+            completions.append(value)
+        return completions
+
+    def contains(self, criterion, value):
+        """Return whether a value exists, or None while the catalog is incomplete."""
+        missing = self.missing(criterion, [value])
+        return None if missing is None else not missing
+
+    def missing(self, criterion, values):
+        """Return the values no field of a criterion holds, or None while the catalog is incomplete.
+
+        Values are read as each field's type reads them in a filter, so "12"
+        finds 12.0 in a real field and "012" finds 12 in an integer one.
+        """
+        if not self.is_ready(criterion):
+            return None
+        texts = self._texts_by_kind(criterion)
+        return [value for value in values
+                if not any(typed_text(kind, value) in found for kind, found in texts.items())]
+
+    def _texts_by_kind(self, criterion):
+        # The catalogued texts of a criterion's fields, merged per field kind
+        fields = [(layer, field) for layer, layer_fields in self.field_index.layers_for(criterion) for field in layer_fields]
+        pairs = frozenset((layer.id(), field) for layer, field in fields)
+        cached = self._kinds.get(criterion)
+        if cached is None or cached[0] != pairs:
+            texts = {}
+            for layer, field in fields:
+                kind = field_kind(layer.fields().field(field))
+                values = self._values.get((layer.id(), field), ())
+                if kind in ('date', 'datetime'):
+                    values = (value[:10] for value in values)
+                texts.setdefault(kind, set()).update(values)
+            cached = (pairs, texts)
+            self._kinds[criterion] = cached
+        return cached[1]
+
+    def invalidate_layer(self, layer_id):
+        """Forget the values of a layer so they are collected again."""
+        for key in [key for key in self._values if key[0] == layer_id]:
+            del self._values[key]
+        self._merged.clear()
+        self._kinds.clear()
+
+    def unload(self):
+        self.tasks.cancel_all()
+        self.watcher.unload()
+        self._values.clear()
+        self._merged.clear()
+        self._kinds.clear()
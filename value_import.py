@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Streaming import of Multi-Filter values from CSV, XLSX and XLS files.
+"""
+import csv
+import datetime
+import os.path
+
+# File dialog filter for the supported formats
+SPREADSHEET_FILTER = 'Spreadsheets (*.xlsx *.xls *.csv)'
+
+# Bytes read to guess the delimiter of a CSV file
+CSV_SNIFF_BYTES = 64 * 1024
+CSV_DELIMITERS = ',;\t|'
+
+
+def file_kind(path):
+    """Return 'csv', 'xlsx' or 'xls' for a file path."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.csv', '.txt'):
+        return 'csv'
+    if extension in ('.xlsx', '.xlsm'):
+        return 'xlsx'
+    if extension == '.xls':
+        return 'xls'
+    raise ValueError(f'Unsupported file type: {extension or os.path.basename(path)}')
+
+
+def column_label(column):
+    """Return the spreadsheet letter of a 0-based column index ('A', 'AB', ...)."""
+    label = ''
+    column += 1
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        label = chr(ord('A') + remainder) + label
+    return label
+
+
+def normalise(value):
+    """Return the text form of a cell value, or None for a blank cell.
+
+    Integral numbers lose the '.0' spreadsheets give them and dates are
+    written in ISO form, so imported values match attribute values.
+    """
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, datetime.datetime):
+        value = value.date() if value.time() == datetime.time() else value
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    text = str(value).strip()
+    return text or None
+
+
+def sheet_names(path):
+    """Return the sheet names of a workbook ([] for a CSV file)."""
+    kind = file_kind(path)
+    if kind == 'xlsx':
+        import openpyxl
+        workbook = openpyxl.load_workbook(path, read_only=True)
+        try:
+            return list(workbook.sheetnames)
+        finally:
+            workbook.close()
+    if kind == 'xls':
+        import xlrd
+        book = xlrd.open_workbook(path, on_demand=True)
+        try:
+            return book.sheet_names()
+        finally:
+            book.release_resources()
+    return []
+
+
+def header_row(path, sheet=None):
+    """Return the normalised cells of the first row, to choose a column."""
+    for row in iter_rows(path, sheet=sheet):
+        return [normalise(value) or '' for value in row]
+    return []
+
+
+def iter_rows(path, columns=None, sheet=None):
+    """Yield the rows of a file lazily as tuples of cell values.
+
+    columns, if given, is a 0-based (first, last) range and only those
+    cells are read. sheet is a sheet name, the first sheet by default.
+    """
+    kind = file_kind(path)
+    if kind == 'csv':
+        yield from _csv_rows(path, columns)
+    elif kind == 'xlsx':
+        yield from _xlsx_rows(path, columns, sheet)
+    else:
+        yield from _xls_rows(path, columns, sheet)
+
+
+def read_values(path, column=0, sheet=None):
+    """Return (values, rows): the distinct values of a column and the rows read.
+
+    Values are deduplicated as rows arrive, so memory grows with the number
+    of distinct values rather than with the size of the file.
+    """
+    values = {}
+    rows = 0
+    for row in iter_rows(path, (column, column), sheet):
+        rows += 1
+        value = normalise(row[0]) if row else None
+        if value is not None:
+            values.setdefault(value, None)
+    return list(values), rows
+
+
+def _csv_rows(path, columns):
+    with open(path, newline='', encoding='utf-8-sig', errors='replace') as csv_file:
+        sample = csv_file.read(CSV_SNIFF_BYTES)
+        csv_file.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=CSV_DELIMITERS)
+        except csv.Error:
+            dialect = csv.excel
+        for row in csv.reader(csv_file, dialect):
+            yield tuple(row[columns[0]:columns[1] + 1]) if columns else tuple(row)
+
+
+def _xlsx_rows(path, columns, sheet):
+    import openpyxl
+    # Read-only workbooks stream rows from the zipped XML
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.worksheets[0]
+        bounds = {'min_col': columns[0] + 1, 'max_col': columns[1] + 1} if columns else {}
+        yield from worksheet.iter_rows(values_only=True, **bounds)
+    finally:
+        workbook.close()
+
+
+def _xls_rows(path, columns, sheet):
+    import xlrd
+    # The legacy format cannot be streamed; other sheets are still left unread
+    book = xlrd.open_workbook(path, on_demand=True)
+    try:
+        worksheet = book.sheet_by_name(sheet) if sheet else book.sheet_by_index(0)
+        for row in range(worksheet.nrows):
+            first, last = columns if columns else (0, worksheet.row_len(row) - 1)
+            last = min(last, worksheet.row_len(row) - 1)
+            yield tuple(_xls_value(book, worksheet.cell(row, column)) for column in range(first, last + 1))
+    finally:
+        book.release_resources()
+
+
+def _xls_value(book, cell):
+    import xlrd
+    if cell.ctype == xlrd.XL_CELL_DATE:
+        return xlrd.xldate_as_datetime(cell.value, book.datemode)
+    if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+        return None
+    return cell.value
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AutoFilter
+                                 A QGIS plugin
+ AutoFilter
+                              -------------------
+        begin                : 2023-09-07
+        copyright            : (C) 2023 by Hasan Sami
+        email                : hasami@earthlink.iq
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Provider-side lookup tables for large Multi-Filter value lists.
+"""
+import hashlib
+import sqlite3
+import uuid
+from contextlib import closing
+
+from qgis.core import QgsDataSourceUri, QgsProviderRegistry
+
+# Lists up to this size are inlined as IN (...) in the subset string
+INLINE_VALUE_LIMIT = 500
+
+# Name of the lookup table written next to the layer data
+LOOKUP_TABLE = 'autofilter_values'
+
+# Rows sent per INSERT statement to PostgreSQL
+INSERT_BATCH_SIZE = 1000
+
+
+def quote_sql(value):
+    """Quote a value as an SQL string literal."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def inline_membership(field, values):
+    """Return the inline '"field" IN (...)' form of a membership test."""
+    return f'"{field}" IN (' + ','.join(quote_sql(value) for value in values) + ')'
+
+
+class ValueListStore:
+    """Store large value lists in the layer's own database.
+
+    Each list is written once per database into an autofilter_values table
+    keyed by a hash of its values and of the session, and layers are
+    filtered with a semi-join ('"field" IN (SELECT value FROM
+    autofilter_values WHERE list_id = ...)') instead of a subset string
+    holding every value. GeoPackage and SpatiaLite lists are written with
+    sqlite3, PostgreSQL lists through the provider connection API. Other
+    providers fall back to the inline form.
+
+    membership_expression() only queues the write; the FilterEngine takes
+    the queued writes with take_writes() and runs them in its background
+    task before the plan is checked, falling back to the inline form for
+    a list that cannot be written, and reports back with finished().
+
+    The table has to be a real one: the subset string is evaluated on the
+    provider's own connection, which cannot see a TEMP table of ours. The
+    lists are therefore scoped to the session by hand: their ids are
+    unique to the session, so no other session shares their rows. clear()
+    deletes the lists written during the session that no kept subset
+    string refers to, and drops the table once no session has lists left
+    in it. The plugin calls it when filters are cleared, when the project
+    is closed and when the plugin is unloaded, keeping only the lists the
+    layers are still filtered by (a saved project may refer to them).
+    """
+
+    def __init__(self, inline_limit=INLINE_VALUE_LIMIT):
+        self.inline_limit = inline_limit
+        # Part of every list id, so that sessions never share a list
+        self.session = uuid.uuid4().hex
+        # database key -> set of list ids written there
+        self._written = {}
+        # (database key, list id) -> write job queued for the engine (see take_writes)
+        self._pending = {}
+
+    def membership_expression(self, layer, field, values, inline=None):
+        """Return (expression, native) filtering a field by a value list.
+
+        native is True when the expression is provider SQL that QGIS
+        expressions cannot parse. inline(field, values), if given, builds
+        the inline form instead of inline_membership().
+        """
+        inline = inline or inline_membership
+        if len(values) <= self.inline_limit:
+            return inline(field, values), False
+        backend = self._backend(layer)
+        if backend is None:
+            return inline(field, values), False
+        list_id = list_key(values, self.session)
+        kind, key, target = backend
+        table = LOOKUP_TABLE if kind == 'sqlite' else f'"{target[1]}"."{LOOKUP_TABLE}"'
+        value_column = 'value'
+        if kind == 'postgres' and layer.fields().field(field).isNumeric():
+            value_column = 'CAST(value AS NUMERIC)'
+        expression = f'"{field}" IN (SELECT {value_column} FROM {table} WHERE list_id = {quote_sql(list_id)})'
+        if list_id not in self._written.get(key, set()):
+            job = self._pending.get((key, list_id))
+            if job is None:
+                job = self._pending[(key, list_id)] = (key, kind, target, list_id, list(values), {})
+            if expression not in job[5]:
+                # The inline form stands in if the list cannot be written
+                job[5][expression] = inline(field, values)
+        return expression, True
+
+    def take_writes(self):
+        """Return the queued writes: [(key, kind, target, list id, values, {expression: inline form})].
+
+        They stay queued until finished() reports them, so a write dropped
+        by a cancelled task is taken again by the next plan.
+        """
+        return [job[:5] + (dict(job[5]),) for job in self._pending.values()]
+
+    def finished(self, written, failed):
+        """Record the (key, list id) pairs of the lists written, and of those that could not be."""
+        for key, list_id in written:
+            self._written.setdefault(key, set()).add(list_id)
+        for pending in set(written) | set(failed):
+            self._pending.pop(pending, None)
+
+    def clear(self, keep=()):
+        """Delete the lists written during this session, and empty lookup tables.
+
+        Lists whose id appears in one of the keep expressions are left in
+        place, since a subset string may still refer to them.
+        """
+        for pending in [pending for pending in self._pending if not any(pending[1] in expression for expression in keep)]:
+            del self._pending[pending]
+        for key in list(self._written):
+            list_ids = {list_id for list_id in self._written[key]
+                        if not any(list_id in expression for expression in keep)}
+            if not list_ids:
+                continue
+            self._written[key] -= list_ids
+            if not self._written[key]:
+                del self._written[key]
+            kind, target = key
+            try:
+                if kind == 'sqlite':
+                    delete_sqlite_lists(target, list_ids)
+                else:
+                    delete_postgres_lists(target, list_ids)
+            except Exception:
+                # Read-only or unreachable database: nothing more to do
+                pass
+
+    def _backend(self, layer):
+        provider = layer.providerType()
+        if provider == 'ogr' and layer.dataProvider().storageType() == 'GPKG':
+            path = layer.source().split('|')[0]
+            return 'sqlite', ('sqlite', path), path
+        if provider == 'spatialite':
+            path = QgsDataSourceUri(layer.source()).database()
+            return 'sqlite', ('sqlite', path), path
+        if provider == 'postgres':
+            uri = QgsDataSourceUri(layer.source())
+            schema = uri.schema() or 'public'
+            return 'postgres', ('postgres', (layer.source(), schema)), (layer.source(), schema)
+        return None
+
+
+def list_key(values, session=''):
+    """Return an id for a value list, the same for the same values within a session."""
+    digest = hashlib.sha1(session.encode('utf-8'))
+    for value in sorted(values):
+        digest.update(str(value).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def write_list(kind, target, list_id, values):
+    """Write a value list with write_sqlite_list() or write_postgres_list()."""
+    if kind == 'sqlite':
+        write_sqlite_list(target, list_id, values)
+    else:
+        write_postgres_list(target, list_id, values)
+
+
+def write_sqlite_list(path, list_id, values):
+    """Write a value list into a GeoPackage or SpatiaLite database."""
+    with closing(sqlite3.connect(path)) as connection, connection:
+        # One write transaction with the table's creation, so that
+        # delete_sqlite_lists() cannot drop the table in between
+        connection.execute('BEGIN IMMEDIATE')
+        connection.execute(
+            f'CREATE TABLE IF NOT EXISTS {LOOKUP_TABLE} '
+            '(list_id TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (list_id, value)) WITHOUT ROWID')
+        connection.executemany(
+            f'INSERT OR IGNORE INTO {LOOKUP_TABLE} (list_id, value) VALUES (?, ?)',
+            ((list_id, str(value)) for value in values))
+
+
+def delete_sqlite_lists(path, list_ids):
+    """Delete value lists from a database, and the lookup table once it is empty."""
+    with closing(sqlite3.connect(path)) as connection, connection:
+        # Writers wait until the table is dropped or known to be in use
+        connection.execute('BEGIN IMMEDIATE')
+        connection.executemany(f'DELETE FROM {LOOKUP_TABLE} WHERE list_id = ?', [(list_id,) for list_id in list_ids])
+        # Other sessions' lists may still be there
+        if connection.execute(f'SELECT 1 FROM {LOOKUP_TABLE} LIMIT 1').fetchone() is None:
+            connection.execute(f'DROP TABLE {LOOKUP_TABLE}')
+
+
+def postgres_connection(target):
+    """Return (connection, schema) for a PostgreSQL layer source."""
+    source, schema = target
+    metadata = QgsProviderRegistry.instance().providerMetadata('postgres')
+    return metadata.createConnection(source, {}), schema
+
+
+def write_postgres_list(target, list_id, values):
+    """Write a value list into an unlogged table of a PostgreSQL schema."""
+    connection, schema = postgres_connection(target)
+    table = f'"{schema}"."{LOOKUP_TABLE}"'
+    statements = [f'CREATE UNLOGGED TABLE IF NOT EXISTS {table} '
+                  '(list_id text NOT NULL, value text NOT NULL, PRIMARY KEY (list_id, value))']
+    values = list(values)
+    for start in range(0, len(values), INSERT_BATCH_SIZE):
+        rows = ','.join(f'({quote_sql(list_id)},{quote_sql(value)})' for value in values[start:start + INSERT_BATCH_SIZE])
+        statements.append(f'INSERT INTO {table} (list_id, value) VALUES {rows} ON CONFLICT DO NOTHING')
+    # One transaction: a list is either complete or absent, and an insert
+    # racing delete_postgres_lists() fails instead of losing its rows
+    connection.executeSql('BEGIN; ' + '; '.join(statements) + '; COMMIT')
+
+
+def delete_postgres_lists(target, list_ids):
+    """Delete value lists from a PostgreSQL schema, and the lookup table once it is empty."""
+    connection, schema = postgres_connection(target)
+    table = f'"{schema}"."{LOOKUP_TABLE}"'
+    # The lock keeps other sessions from adding lists between the check and
+    # the drop; other sessions' lists may still be there
+    connection.executeSql(
+        f'BEGIN; LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE; '
+        f'DELETE FROM {table} WHERE list_id IN ({",".join(quote_sql(list_id) for list_id in list_ids)}); '
+        f'DO $$ BEGIN IF NOT EXISTS (SELECT 1 FROM {table}) THEN DROP TABLE {table}; END IF; END $$; COMMIT')